@@ -1,5 +1,6 @@
 using System;
 using System.Collections.ObjectModel;
+using System.Globalization;
 using System.IO;
 using System.Linq;
 using LLMR.Helpers;
@@ -70,6 +71,7 @@ public class ChatHistoryCollection : ReactiveObject
     public event EventHandler<string>? ExceptionOccurred;
 
     private string? _directoryPath;
+    private string? _journalDirectoryPath;
 
     public ChatHistoryCollection()
     {
@@ -89,6 +91,7 @@ public class ChatHistoryCollection : ReactiveObject
         }
 
         _directoryPath = chatHistoriesDir;
+        _journalDirectoryPath = PathManager.Combine(baseDataDir, "Scripts", "chat_journals");
 
         LoadFiles();
     }
@@ -183,6 +186,8 @@ public class ChatHistoryCollection : ReactiveObject
             ConsoleMessageOccurred?.Invoke(this, $"Created folder: {_directoryPath}");
         }
 
+        CompactJournals();
+
         Categories.Clear();
 
         var rootCategory = new ChatHistoryCategory
@@ -196,6 +201,71 @@ public class ChatHistoryCollection : ReactiveObject
         Categories.Add(rootCategory);
     }
 
+    // The gradio servers append one line per turn to Scripts/chat_journals/chathistory_<id>.jsonl and only write
+    // chathistory_<id>.json when a session ends. Sessions that are still running (or whose server was killed)
+    // are compacted here, right before the explorer needs them.
+    private void CompactJournals()
+    {
+        if (_journalDirectoryPath is null || !Directory.Exists(_journalDirectoryPath))
+            return;
+
+        foreach (var journalFile in Directory.GetFiles(_journalDirectoryPath, "*.jsonl"))
+        {
+            try
+            {
+                // the .compacted marker holds the journal length the current json was built from
+                var markerFile = Path.ChangeExtension(journalFile, ".compacted");
+                var journalLength = new FileInfo(journalFile).Length;
+                if (File.Exists(markerFile) && File.ReadAllText(markerFile).Trim() == journalLength.ToString(CultureInfo.InvariantCulture))
+                    continue;
+
+                JObject? settings = null;
+                var conversation = new JArray();
+                foreach (var line in File.ReadLines(journalFile))
+                {
+                    if (string.IsNullOrWhiteSpace(line))
+                        continue;
+
+                    JObject record;
+                    try
+                    {
+                        record = JObject.Parse(line);
+                    }
+                    catch (JsonReaderException)
+                    {
+                        break; // turn is being written right now, picked up next time
+                    }
+
+                    var recordType = record["type"]?.ToString();
+                    record.Remove("type");
+                    if (recordType == "session")
+                        settings = record["settings"] as JObject;
+                    else if (recordType == "turn")
+                        conversation.Add(record);
+                }
+
+                if (settings is null)
+                    continue;
+
+                settings["downloaded_on"] = File.GetLastWriteTime(journalFile).ToString("MMMM dd, yyyy 'at' HH:mm:ss", CultureInfo.InvariantCulture);
+
+                var fullData = new JObject
+                {
+                    ["settings"] = settings,
+                    ["conversation"] = conversation
+                };
+
+                var historyFile = Path.Combine(_directoryPath!, Path.GetFileNameWithoutExtension(journalFile) + ".json");
+                File.WriteAllText(historyFile, fullData.ToString(Formatting.Indented));
+                File.WriteAllText(markerFile, journalLength.ToString(CultureInfo.InvariantCulture));
+            }
+            catch (Exception ex)
+            {
+                ExceptionOccurred?.Invoke(this, $"<CHC> Unable to compact journal '{journalFile}': {ex.Message}");
+            }
+        }
+    }
+
     private void LoadItemsFromDirectory(string directoryPath, ChatHistoryCategory parentCategory)
     {
         // Load directories and subfolders.
@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import importlib
+import inspect
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import shared_historyJournal
+from benchmark_mockBackend import add_mock_arguments, mock_from_args
+from shared_admissionControl import add_admission_arguments
+from shared_historyStore import HistoryStore
+from shared_persistenceWriter import get_writer
+
+# load test for the chat servers and the multicaller: N simulated participants against the mock
+# backend (or any --backend_url), reporting TTFT, tokens/s, latency percentiles, CPU / RSS and the
+# journal I/O per turn. --save writes the report, --baseline compares against a saved one and exits
+# with 1 if a metric got worse by more than --tolerance. multicaller_batch runs the multicaller's --mode batch
+# against the mock's Batch API (set its timing and final status with --batch_seconds / --batch_outcome)
+
+TARGETS = ["openai_v2", "openai_o1", "hf", "multicaller", "multicaller_batch"]
+
+SERVER_MODULES = {
+    "openai_v2": "openAI_v2_gradioServer",
+    "openai_o1": "openAI_o1-line_gradioServer",
+    "hf": "hfServerlessInference_gradioServer",
+}
+
+PROMPTS = [
+    "Explain the difference between a list and a tuple in Python.",
+    "Give me three ideas for a short story about a lighthouse.",
+    "What should I keep in mind when designing a survey question?",
+    "Summarize the plot of a heist movie in two sentences.",
+]
+
+# metrics compared against a baseline, and whether higher is better
+REGRESSION_METRICS = {
+    "ttft_p50": False,
+    "ttft_p95": False,
+    "latency_p50": False,
+    "latency_p95": False,
+    "latency_p99": False,
+    "tokens_per_second_p50": True,
+    "cpu_seconds_per_turn": False,
+    "persistence_bytes_per_turn": False,
+}
+
+
+def percentile(values, p):
+    # nearest rank, works for any number of values
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def rss_bytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS; peak instead of current without psutil
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return None
+
+
+def estimate_reply_tokens(text):
+    return len(text) // 4 + 1 if text else 0
+
+
+class TurnRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.turns = []
+
+    def add(self, **turn):
+        with self.lock:
+            self.turns.append(turn)
+
+
+def reply_of(output):
+    # a turned away request leaves the chatbot alone (gr.update() instead of a history)
+    history = output[0]
+    return history[-1]["content"] if isinstance(history, list) and history else ""
+
+
+class Participant:
+    # one simulated user: a conversation of `turns` messages, each timed from submit to the last update
+    def __init__(self, number, predict, turns, think_time, recorder):
+        self.number = number
+        self.predict = predict
+        self.turns = turns
+        self.think_time = think_time
+        self.recorder = recorder
+        self.history = []
+        self.state = None
+
+    def observe(self, output, started, timing):
+        reply = reply_of(output)
+        if timing["ttft"] is None and reply:
+            timing["ttft"] = time.perf_counter() - started
+        timing["last"] = output
+
+    def finish(self, message, started, timing):
+        latency = time.perf_counter() - started
+        output = timing["last"]
+        reply = reply_of(output) if output else ""
+        # only a turned away request hands the message back to the textbox
+        rejected = output is not None and output[2] == message
+        failed = reply.startswith("An error occurred")
+        if output and not rejected:
+            self.history = output[0]
+            self.state = output[1]
+        self.recorder.add(
+            participant=self.number,
+            ttft=timing["ttft"],
+            latency=latency,
+            tokens=estimate_reply_tokens(reply) if not (rejected or failed) else 0,
+            rejected=rejected,
+            failed=failed
+        )
+
+    async def run_async(self):
+        for turn in range(self.turns):
+            message = PROMPTS[(self.number + turn) % len(PROMPTS)]
+            started = time.perf_counter()
+            timing = {"ttft": None, "last": None}
+            async for output in self.predict(message, list(self.history), self.state):
+                self.observe(output, started, timing)
+            self.finish(message, started, timing)
+            await asyncio.sleep(self.think_time)
+
+    def run_sync(self):
+        for turn in range(self.turns):
+            message = PROMPTS[(self.number + turn) % len(PROMPTS)]
+            started = time.perf_counter()
+            timing = {"ttft": None, "last": None}
+            for output in self.predict(message, list(self.history), self.state):
+                self.observe(output, started, timing)
+            self.finish(message, started, timing)
+            time.sleep(self.think_time)
+
+
+def build_server(target, backend_url, args, store=None):
+    module = importlib.import_module(SERVER_MODULES[target])
+    common = dict(concurrency=args.concurrency, max_queue=args.max_queue, session_limit=args.session_limit, history_store=store)
+    if target == "openai_v2":
+        app = module.create_app(api_key="mock", model=args.model, system_message="You are a helpful assistant.", temperature=0.7,
+                                max_tokens=None, top_p=1.0, frequency_penalty=0.0, presence_penalty=0.0,
+                                async_predict=not args.sync_predict, base_url=f"{backend_url}/v1", **common)
+    elif target == "openai_o1":
+        app = module.create_app(api_key="mock", model="o1-mini", reasoning_effort=None, max_completion_tokens=None,
+                                async_predict=not args.sync_predict, base_url=f"{backend_url}/v1", **common)
+    else:
+        app = module.create_app(api_token="mock", model_id=args.hf_model, system_message="You are a helpful assistant.", temperature=0.8,
+                                max_completion_tokens=None, top_p=0.95, frequency_penalty=0.0, presence_penalty=0.0, stop_sequences="User:",
+                                pool_size=args.concurrency, base_url=backend_url, warmup=not args.no_warmup, **common)
+    return app.chat_predict
+
+
+def run_participants(predict, participants, turns, think_time, recorder):
+    people = [Participant(number, predict, turns, think_time, recorder) for number in range(participants)]
+    if inspect.isasyncgenfunction(predict):
+        async def run_all():
+            await asyncio.gather(*(person.run_async() for person in people))
+        asyncio.run(run_all())
+    else:
+        # the sync servers run one Gradio worker thread per request, so do the participants
+        threads = [threading.Thread(target=person.run_sync) for person in people]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def run_multicaller_benchmark(backend_url, args, recorder, scratch, batch=False):
+    # one run_multicaller with participants x turns calls, `participants` of them in flight (batch: one
+    # run_multicaller_batch job with that many requests). The multicaller has no per-call hook, so latencies
+    # come from the backend's side (in-process mock only)
+    import openAI_multicaller
+
+    saved = {}
+
+    def save_to_scratch(unique_id, *settings_and_responses, **kwargs):
+        # same file as save_results, but in the scratch directory
+        responses = settings_and_responses[10]
+        path = os.path.join(scratch, f"multicaller_{unique_id}.json")
+        with open(path, "w") as f:
+            json.dump({"responses": responses}, f, indent=4)
+        saved["responses"] = responses
+        saved["bytes"] = os.path.getsize(path)
+
+    openAI_multicaller.save_results = save_to_scratch
+    common = dict(api_key="mock", model=args.model, prompt=PROMPTS[0], n=args.participants * args.turns,
+                  system_message="You are a helpful assistant.", temperature=1.0, max_tokens=None, top_p=1.0,
+                  frequency_penalty=0.0, presence_penalty=0.0, max_retries=5, base_url=f"{backend_url}/v1")
+    if batch:
+        openAI_multicaller.run_multicaller_batch(poll_interval=0.2, max_poll_interval=1.0, **common)
+    else:
+        openAI_multicaller.run_multicaller(concurrency=args.participants, **common)
+
+    for entry in saved.get("responses", []):
+        failed = "error" in entry or not entry.get("assistant")
+        recorder.add(participant=entry["attempt"], ttft=None, latency=None,
+                     tokens=0 if failed else estimate_reply_tokens(entry["assistant"]), rejected=False, failed=failed)
+    return saved.get("bytes", 0)
+
+
+def summarize(target, recorder, wall, cpu_seconds, rss_before, rss_after, writer_before, writer_after, mock_stats, extra_bytes=0):
+    turns = recorder.turns
+    answered = [turn for turn in turns if not turn["rejected"] and not turn["failed"]]
+    ttfts = [turn["ttft"] for turn in answered if turn["ttft"] is not None]
+    latencies = [turn["latency"] for turn in answered if turn["latency"] is not None]
+    latency_source = "client"
+    if not latencies and mock_stats is not None:
+        latencies = mock_stats["durations"]
+        latency_source = "backend"
+    rates = [turn["tokens"] / (turn["latency"] - turn["ttft"]) for turn in answered
+             if turn["ttft"] is not None and turn["latency"] - turn["ttft"] > 0.001]
+    persisted = writer_after["bytes_written"] - writer_before["bytes_written"] + extra_bytes
+
+    report = {
+        "target": target,
+        "turns": len(turns),
+        "answered": len(answered),
+        "rejected": sum(turn["rejected"] for turn in turns),
+        "failed": sum(turn["failed"] for turn in turns),
+        "wall_seconds": wall,
+        "latency_source": latency_source,
+        "turns_per_second": len(answered) / wall if wall else None,
+        "cpu_seconds": cpu_seconds,
+        "cpu_seconds_per_turn": cpu_seconds / len(answered) if answered else None,
+        "cpu_percent": 100 * cpu_seconds / wall if wall else None,
+        "rss_mb_before": rss_before / 2**20 if rss_before else None,
+        "rss_mb_after": rss_after / 2**20 if rss_after else None,
+        "persistence_bytes_per_turn": persisted / len(answered) if answered else None,
+        "persistence_writes_per_turn": (writer_after["writes"] - writer_before["writes"]) / len(answered) if answered else None,
+        "persistence_fsyncs_per_turn": (writer_after["fsyncs"] - writer_before["fsyncs"]) / len(answered) if answered else None,
+    }
+    for p in (50, 95, 99):
+        report[f"ttft_p{p}"] = percentile(ttfts, p)
+        report[f"latency_p{p}"] = percentile(latencies, p)
+        report[f"tokens_per_second_p{p}"] = percentile(rates, p)
+    if mock_stats is not None:
+        report["backend_requests"] = mock_stats["requests"]
+        report["backend_errors_injected"] = mock_stats["errors"]
+        report["backend_p95_seconds"] = percentile(mock_stats["durations"], 95)
+    return report
+
+
+def run_target(target, backend_url, mock, args, scratch, store=None):
+    recorder = TurnRecorder()
+    predict = None if target.startswith("multicaller") else build_server(target, backend_url, args, store)
+    if mock is not None:
+        mock.stats.reset()
+
+    writer = get_writer()
+    writer.flush(30.0)
+    writer_before = writer.get_stats()
+    rss_before = rss_bytes()
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+
+    extra_bytes = 0
+    if target.startswith("multicaller"):
+        extra_bytes = run_multicaller_benchmark(backend_url, args, recorder, scratch, batch=target == "multicaller_batch")
+    else:
+        run_participants(predict, args.participants, args.turns, args.think_time, recorder)
+
+    wall = time.perf_counter() - started
+    cpu_seconds = time.process_time() - cpu_started
+    writer.flush(30.0)
+    return summarize(target, recorder, wall, cpu_seconds, rss_before, rss_bytes(), writer_before, writer.get_stats(),
+                     mock.stats.get_stats() if mock is not None else None, extra_bytes)
+
+
+def format_value(value, unit=""):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.3f}{unit}"
+    return f"{value}{unit}"
+
+
+def print_report(report):
+    print(f"<benchmark> {report['target']}: {report['answered']}/{report['turns']} turns answered "
+          f"({report['rejected']} turned away, {report['failed']} failed) in {report['wall_seconds']:.1f}s", flush=True)
+    print(f"<benchmark>   TTFT      p50 {format_value(report['ttft_p50'], 's')}  p95 {format_value(report['ttft_p95'], 's')}  p99 {format_value(report['ttft_p99'], 's')}")
+    print(f"<benchmark>   latency   p50 {format_value(report['latency_p50'], 's')}  p95 {format_value(report['latency_p95'], 's')}  p99 {format_value(report['latency_p99'], 's')}")
+    print(f"<benchmark>   tokens/s  p50 {format_value(report['tokens_per_second_p50'])}  p95 {format_value(report['tokens_per_second_p95'])}")
+    print(f"<benchmark>   CPU {format_value(report['cpu_percent'], '%')} ({format_value(report['cpu_seconds_per_turn'], 's')} per turn), "
+          f"RSS {format_value(report['rss_mb_before'], ' MB')} -> {format_value(report['rss_mb_after'], ' MB')}")
+    print(f"<benchmark>   persistence {format_value(report['persistence_bytes_per_turn'], ' B')} / "
+          f"{format_value(report['persistence_writes_per_turn'])} writes / {format_value(report['persistence_fsyncs_per_turn'])} fsyncs per turn", flush=True)
+
+
+def compare_to_baseline(reports, baseline_path, tolerance):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {report["target"]: report for report in json.load(f)["reports"]}
+
+    regressions = []
+    for report in reports:
+        before = baseline.get(report["target"])
+        if before is None:
+            continue
+        for metric, higher_is_better in REGRESSION_METRICS.items():
+            old, new = before.get(metric), report.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{report['target']} {metric}: {old:.4g} -> {new:.4g} ({change:+.0%})")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for the LLMR chat servers and the multicaller")
+    parser.add_argument('--targets', type=str, nargs='+', choices=TARGETS + ["all"], default=["all"], help='What to drive')
+    parser.add_argument('--participants', type=int, default=20, help='Simulated participants (multicaller: calls in flight)')
+    parser.add_argument('--turns', type=int, default=3, help='Messages per participant')
+    parser.add_argument('--think_time', type=float, default=0.0, help='Seconds a participant waits between two messages')
+    parser.add_argument('--model', type=str, default='gpt-4o', help='Model name sent to the OpenAI backend')
+    parser.add_argument('--hf_model', type=str, default='meta-llama/Llama-2-7b-chat-hf', help='Model ID sent to the HF backend')
+    parser.add_argument('--history_store', action='store_true', help='Also write every turn to a SQLite history store (in the scratch directory)')
+    parser.add_argument('--no_warmup', action='store_true', help='HF: skip the startup warm-up (compare cold starts with --cold_start)')
+    parser.add_argument('--sync_predict', action='store_true', help='Drive the OpenAI servers through their synchronous predict')
+    parser.add_argument('--backend_url', type=str, help='Use this backend (e.g. a separately started benchmark_mockBackend.py) instead of an in-process mock')
+    parser.add_argument('--save', type=str, help='Write the report as JSON to this path')
+    parser.add_argument('--baseline', type=str, help='Saved report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Relative change that counts as a regression')
+    add_admission_arguments(parser)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    targets = TARGETS if "all" in args.targets else args.targets
+
+    # journals go to a scratch directory, the real chat_histories stay untouched
+    scratch = tempfile.mkdtemp(prefix="llmr_benchmark_")
+    shared_historyJournal.CHAT_DIR = os.path.join(scratch, "chat_histories")
+    shared_historyJournal.JOURNAL_DIR = os.path.join(scratch, "chat_journals")
+    # kept out of args: vars(args) is saved with the report
+    store = HistoryStore(os.path.join(scratch, "chat_history.sqlite3")) if args.history_store else None
+
+    mock = None
+    backend_url = args.backend_url
+    if backend_url is None:
+        mock = mock_from_args(args)
+        backend_url = mock.url
+    print(f"<benchmark> Backend {backend_url}, {args.participants} participants x {args.turns} turns, journals in {scratch}", flush=True)
+
+    reports = []
+    for target in targets:
+        report = run_target(target, backend_url.rstrip("/"), mock, args, scratch, store)
+        print_report(report)
+        reports.append(report)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "arguments": vars(args), "reports": reports}, f, indent=2)
+        print(f"<benchmark> Report saved as {args.save}.")
+
+    if args.baseline:
+        regressions = compare_to_baseline(reports, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"<benchmark> Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("<benchmark> No regressions against the baseline.")
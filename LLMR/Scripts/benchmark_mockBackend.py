@@ -0,0 +1,659 @@
+import argparse
+import email.policy
+import itertools
+import json
+import math
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# stand-in for the OpenAI chat completions API (and its Batch API) and the HF serverless inference API, so the
+# servers, the apiHandlers and the multicaller can be load-tested without keys, cost or rate limits.
+# Point them at it with --base_url http://127.0.0.1:<port>/v1 (OpenAI) or --base_url http://127.0.0.1:<port> (HF)
+
+MOCK_MODELS = ["gpt-4o", "gpt-4o-mini", "gpt-3.5-turbo", "o1", "o1-mini"]
+
+BATCH_OUTCOMES = ["completed", "failed", "expired"]
+
+# reply text is drawn from these words, one word per token
+MOCK_WORDS = ("the", "model", "answers", "with", "a", "short", "and", "plain", "reply", "about", "your",
+              "question", "so", "that", "load", "tests", "see", "realistic", "token", "streams")
+
+
+class MockProfile:
+    # how the mock behaves: time to first token drawn from a log-normal distribution around
+    # ttft_median, then tokens at tokens_per_second. error_rate answers that share of requests with
+    # one of error_codes (429 with Retry-After, 503 as "model loading" for HF), disconnect_rate breaks
+    # that share of streams off halfway. single_choice_models answer n > 1 with the API's 400.
+    # cold_start: an HF model is loaded by the first request to it and answers 503 for that many seconds,
+    # idle_unload: and is unloaded again after that many seconds without requests (0 = never).
+    # batch_seconds: how long a Batch API job runs, batch_outcome: how it ends (completed, failed, expired)
+    def __init__(self, tokens_per_second=50.0, ttft_median=0.3, ttft_sigma=0.5, reply_tokens=(40, 200),
+                 error_rate=0.0, error_codes=(429, 500, 503), retry_after=1.0, disconnect_rate=0.0, seed=None,
+                 single_choice_models=(), cold_start=0.0, idle_unload=0.0, batch_seconds=2.0, batch_outcome="completed"):
+        self.tokens_per_second = tokens_per_second
+        self.ttft_median = ttft_median
+        self.ttft_sigma = ttft_sigma
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.retry_after = retry_after
+        self.disconnect_rate = disconnect_rate
+        self.single_choice_models = tuple(single_choice_models)
+        self.cold_start = cold_start
+        self.idle_unload = idle_unload
+        self.batch_seconds = batch_seconds
+        self.batch_outcome = batch_outcome
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def draw(self):
+        # everything random about one request, drawn under the lock (one generator for all threads)
+        with self.lock:
+            error = self.random.choice(self.error_codes) if self.random.random() < self.error_rate else None
+            ttft = self.random.lognormvariate(math.log(self.ttft_median), self.ttft_sigma) if self.ttft_median > 0 else 0.0
+            tokens = self.random.randint(*self.reply_tokens)
+            disconnect = self.random.random() < self.disconnect_rate
+            words = [self.random.choice(MOCK_WORDS) for _ in range(tokens)]
+        return {"error": error, "ttft": ttft, "words": words, "disconnect": disconnect}
+
+    def token_delay(self):
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+
+class TraceStore:
+    # recorded exchanges with a real API, one JSON line each: the response as timed events
+    # ([seconds since the request, raw line]). Replayed round robin per protocol
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.traces = {"openai": [], "hf": []}
+        self.positions = {"openai": 0, "hf": 0}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        trace = json.loads(line)
+                        self.traces[trace["protocol"]].append(trace)
+        except FileNotFoundError:
+            pass
+
+    def next(self, protocol):
+        with self.lock:
+            traces = self.traces[protocol]
+            if not traces:
+                return None
+            trace = traces[self.positions[protocol] % len(traces)]
+            self.positions[protocol] += 1
+            return trace
+
+    def append(self, trace):
+        with self.lock:
+            self.traces[trace["protocol"]].append(trace)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(trace) + "\n")
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.disconnects = 0
+            self.completion_tokens = 0
+            self.durations = []
+
+    def record(self, duration, tokens=0, error=False, disconnect=False):
+        with self.lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.disconnects += int(disconnect)
+            self.completion_tokens += tokens
+            self.durations.append(duration)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "disconnects": self.disconnects,
+                "completion_tokens": self.completion_tokens,
+                "durations": list(self.durations)
+            }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keep-alive so the clients' connection pools behave as they do against the real APIs
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---- plumbing ----
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return json.loads(body) if body else {}
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def break_stream(self):
+        # the connection is dropped without the terminating chunk, the client sees a broken stream
+        self.close_connection = True
+        self.wfile.flush()
+        self.connection.shutdown(1)
+
+    def error_payload(self, status, protocol):
+        # body and headers of an injected error
+        server = self.server
+        headers = {}
+        if status == 429:
+            headers["Retry-After"] = f"{server.profile.retry_after:g}"
+            payload = {"error": {"message": "Rate limit reached (mock).", "type": "rate_limit_exceeded"}}
+        elif status == 503 and protocol == "hf":
+            payload = {"error": "Model is currently loading (mock)", "estimated_time": server.profile.retry_after}
+        else:
+            payload = {"error": {"message": f"Mock error {status}.", "type": "server_error"}}
+        return payload, headers
+
+    def send_error_response(self, status, protocol):
+        payload, headers = self.error_payload(status, protocol)
+        self.send_json(status, payload, headers)
+
+    # ---- routes ----
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self.send_json(200, self.server.stats.get_stats())
+        elif self.path.rstrip("/") == "/v1/models":
+            self.send_json(200, {"object": "list", "data": [self.model_object(model) for model in MOCK_MODELS]})
+        elif self.path.startswith("/v1/models/"):
+            self.send_json(200, self.model_object(self.path[len("/v1/models/"):]))
+        elif self.path.startswith("/api/whoami"):
+            self.send_json(200, {"type": "user", "name": "mock"})
+        elif self.path.startswith("/v1/batches/"):
+            self.retrieve_batch(self.path[len("/v1/batches/"):])
+        elif self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+            self.send_file_content(self.path[len("/v1/files/"):-len("/content")])
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path} (mock)."}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") == "/v1/chat/completions":
+            self.handle_request("openai", self.serve_openai)
+        elif self.path.startswith("/models/"):
+            self.handle_request("hf", self.serve_hf)
+        elif self.path.rstrip("/") == "/v1/files":
+            self.upload_file()
+        elif self.path.rstrip("/") == "/v1/batches":
+            self.create_batch()
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path} (mock)."}})
+
+    def model_object(self, model):
+        return {"id": model, "object": "model", "created": 0, "owned_by": "mock"}
+
+    def handle_request(self, protocol, serve):
+        server = self.server
+        started = time.monotonic()
+        body = self.read_json()
+
+        if server.upstream:
+            self.record_upstream(protocol, body, started)
+            return
+        if server.traces is not None:
+            trace = server.traces.next(protocol)
+            if trace is not None:
+                self.replay(trace, started)
+                return
+
+        if protocol == "hf":
+            loading = server.hf_loading(self.path[len("/models/"):])
+            if loading > 0:
+                self.send_json(503, {"error": f"Model {self.path[len('/models/'):]} is currently loading (mock)", "estimated_time": round(loading, 1)})
+                server.stats.record(time.monotonic() - started, error=True)
+                return
+
+        plan = server.profile.draw()
+        if plan["error"]:
+            time.sleep(min(plan["ttft"], 0.05))
+            self.send_error_response(plan["error"], protocol)
+            server.stats.record(time.monotonic() - started, error=True)
+            return
+
+        time.sleep(plan["ttft"])
+        tokens = serve(body, plan)
+        server.stats.record(time.monotonic() - started, tokens=tokens, disconnect=plan["disconnect"])
+
+    def stream_words(self, words, disconnect, emit):
+        # emits word by word at the profile's rate; returns False if the stream was broken off
+        delay = self.server.profile.token_delay()
+        cut = len(words) // 2 if disconnect else None
+        for i, word in enumerate(words):
+            if i == cut:
+                self.break_stream()
+                return False
+            emit(i, word + " ")
+            if delay:
+                time.sleep(delay)
+        return True
+
+    def choices_error(self, body):
+        # the API's 400 for n > 1 on a single choice model, None if the request is fine
+        choices = max(1, int(body.get("n") or 1))
+        if choices > 1 and body.get("model", "gpt-4o") in self.server.profile.single_choice_models:
+            return {"error": {
+                "message": f"Unsupported value: 'n' does not support {choices} with this model. Supported values are: 1.",
+                "type": "invalid_request_error", "param": "n", "code": "unsupported_value"}}
+        return None
+
+    def openai_usage(self, body, words):
+        choices = max(1, int(body.get("n") or 1))
+        prompt_tokens = sum(len(str(message.get("content") or "")) for message in body.get("messages", [])) // 4 + 1
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": len(words) * choices, "total_tokens": prompt_tokens + len(words) * choices}
+
+    def chat_completion(self, body, words):
+        # the non-streaming answer; also the body of each line in a batch output file
+        choices = max(1, int(body.get("n") or 1))
+        # every choice a different rotation of the words, so the choices are not identical
+        texts = [" ".join(words[i % max(1, len(words)):] + words[:i % max(1, len(words))]) for i in range(choices)]
+        return {
+            "id": f"chatcmpl-mock-{next(self.server.ids)}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{"index": i, "message": {"role": "assistant", "content": texts[i]}, "finish_reason": "stop"} for i in range(choices)],
+            "usage": self.openai_usage(body, words)
+        }
+
+    def serve_openai(self, body, plan):
+        error = self.choices_error(body)
+        if error is not None:
+            self.send_json(400, error)
+            return 0
+        words = plan["words"]
+
+        if not body.get("stream"):
+            time.sleep(self.server.profile.token_delay() * len(words))
+            completion = self.chat_completion(body, words)
+            self.send_json(200, completion)
+            return completion["usage"]["completion_tokens"]
+
+        model = body.get("model", "gpt-4o")
+        completion_id = f"chatcmpl-mock-{next(self.server.ids)}"
+        created = int(time.time())
+        choices = max(1, int(body.get("n") or 1))
+        usage = self.openai_usage(body, words)
+
+        def chunk(choice_list, **extra):
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": choice_list}
+            payload.update(extra)
+            return f"data: {json.dumps(payload)}\n\n"
+
+        def emit(_, text):
+            self.write_chunk("".join(chunk([{"index": c, "delta": {"content": text}, "finish_reason": None}]) for c in range(choices)))
+
+        self.start_stream()
+        self.write_chunk("".join(chunk([{"index": c, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]) for c in range(choices)))
+        if not self.stream_words(words, plan["disconnect"], emit):
+            return len(words) // 2 * choices
+        self.write_chunk("".join(chunk([{"index": c, "delta": {}, "finish_reason": "stop"}]) for c in range(choices)))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self.write_chunk(chunk([], usage=usage))
+        self.write_chunk("data: [DONE]\n\n")
+        self.end_stream()
+        return len(words) * choices
+
+    def serve_hf(self, body, plan):
+        words = plan["words"]
+        inputs = body.get("inputs", "")
+
+        if not body.get("stream"):
+            time.sleep(self.server.profile.token_delay() * len(words))
+            # like the real API, the non-streaming answer echoes the prompt
+            self.send_json(200, [{"generated_text": inputs + " " + " ".join(words)}])
+            return len(words)
+
+        def emit(i, text):
+            event = {"index": i + 1, "token": {"id": i, "text": text, "logprob": 0.0, "special": False}, "generated_text": None, "details": None}
+            self.write_chunk(f"data:{json.dumps(event)}\n\n")
+
+        self.start_stream()
+        if not self.stream_words(words, plan["disconnect"], emit):
+            return len(words) // 2
+        final = {"index": len(words) + 1, "token": {"id": len(words), "text": "</s>", "logprob": 0.0, "special": True},
+                 "generated_text": " ".join(words), "details": None}
+        self.write_chunk(f"data:{json.dumps(final)}\n\n")
+        self.end_stream()
+        return len(words)
+
+    # ---- Batch API ----
+    # files and jobs are kept in memory. A job is validating for the first fifth of batch_seconds, then
+    # in_progress (request_counts grow with the time) and at batch_seconds ends as the profile's batch_outcome:
+    # completed; failed (during validation, no output file); expired (only the first half of the requests is
+    # answered, the rest goes to the error file). Each request is answered with the chat completion above and
+    # the profile's error_rate; record / replay do not apply
+
+    def upload_file(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length) if length else b""
+        header = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode("utf-8")
+        message = BytesParser(policy=email.policy.HTTP).parsebytes(header + data)
+        parts = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()} if message.is_multipart() else {}
+        if "file" not in parts:
+            self.send_json(400, {"error": {"message": "Missing the multipart field 'file' (mock).", "type": "invalid_request_error", "param": "file"}})
+            return
+        purpose = parts["purpose"].get_payload(decode=True).decode("utf-8") if "purpose" in parts else "batch"
+        self.send_json(200, self.server.add_file(parts["file"].get_payload(decode=True) or b"", parts["file"].get_filename() or "upload.jsonl", purpose))
+
+    def send_file_content(self, file_id):
+        with self.server.batch_lock:
+            file = self.server.files.get(file_id)
+        if file is None:
+            self.send_json(404, {"error": {"message": f"No such File object: {file_id} (mock).", "type": "invalid_request_error"}})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(file["content"])))
+        self.end_headers()
+        self.wfile.write(file["content"])
+
+    def create_batch(self):
+        server = self.server
+        body = self.read_json()
+        with server.batch_lock:
+            file = server.files.get(body.get("input_file_id"))
+        if file is None:
+            self.send_json(400, {"error": {"message": f"Unknown input_file_id {body.get('input_file_id')} (mock).", "type": "invalid_request_error", "param": "input_file_id"}})
+            return
+        if body.get("endpoint") != "/v1/chat/completions":
+            self.send_json(400, {"error": {"message": "The mock only runs /v1/chat/completions batches.", "type": "invalid_request_error", "param": "endpoint"}})
+            return
+
+        requests = [json.loads(line) for line in file["content"].decode("utf-8").splitlines() if line.strip()]
+        batch = {
+            "id": f"batch_mock-{next(server.ids)}", "object": "batch", "endpoint": body["endpoint"], "errors": None,
+            "input_file_id": body["input_file_id"], "completion_window": body.get("completion_window", "24h"),
+            "status": "validating", "output_file_id": None, "error_file_id": None, "created_at": int(time.time()),
+            "request_counts": {"total": len(requests), "completed": 0, "failed": 0}, "metadata": body.get("metadata")
+        }
+        with server.batch_lock:
+            server.batches[batch["id"]] = {"batch": batch, "requests": requests, "lines": [], "started": time.monotonic(),
+                                           "outcome": server.profile.batch_outcome}
+        self.send_json(200, batch)
+
+    def retrieve_batch(self, batch_id):
+        with self.server.batch_lock:
+            job = self.server.batches.get(batch_id)
+            if job is not None:
+                self.advance_batch(job)
+                payload = json.loads(json.dumps(job["batch"]))
+        if job is None:
+            self.send_json(404, {"error": {"message": f"No such Batch object: {batch_id} (mock).", "type": "invalid_request_error"}})
+            return
+        self.send_json(200, payload)
+
+    def advance_batch(self, job):
+        # brings the job up to date with the time since it was created (called under batch_lock)
+        server = self.server
+        batch = job["batch"]
+        if batch["status"] in BATCH_OUTCOMES:
+            return
+        elapsed = time.monotonic() - job["started"]
+        validating = server.profile.batch_seconds / 5
+        if elapsed < validating:
+            return
+        if job["outcome"] == "failed":
+            batch.update(status="failed", failed_at=int(time.time()), errors={"object": "list", "data": [
+                {"code": "mock_failure", "message": "The batch failed during validation (mock).", "param": None, "line": None}]})
+            return
+
+        total = len(job["requests"])
+        running = max(1e-9, server.profile.batch_seconds - validating)
+        answered = min(total, int(total * (elapsed - validating) / running))
+        if job["outcome"] == "expired":
+            answered = min(answered, total // 2)
+        while len(job["lines"]) < answered:
+            job["lines"].append(self.batch_line(job["requests"][len(job["lines"])], job["started"]))
+        succeeded = sum(line["response"]["status_code"] == 200 for line in job["lines"])
+        batch["status"] = "in_progress"
+        batch.setdefault("in_progress_at", int(time.time()))
+        batch["request_counts"] = {"total": total, "completed": succeeded, "failed": len(job["lines"]) - succeeded}
+        if elapsed < server.profile.batch_seconds:
+            return
+
+        if job["lines"]:
+            batch["output_file_id"] = server.add_file("".join(json.dumps(line) + "\n" for line in job["lines"]).encode("utf-8"), f"{batch['id']}_output.jsonl", "batch_output")["id"]
+        if job["outcome"] == "expired":
+            unanswered = [{"id": f"batch_req_mock-{next(server.ids)}", "custom_id": request.get("custom_id"), "response": None,
+                           "error": {"code": "batch_expired", "message": "This request could not be executed before the completion window expired."}}
+                          for request in job["requests"][len(job["lines"]):]]
+            if unanswered:
+                batch["error_file_id"] = server.add_file("".join(json.dumps(line) + "\n" for line in unanswered).encode("utf-8"), f"{batch['id']}_error.jsonl", "batch_output")["id"]
+            batch["request_counts"]["failed"] += len(unanswered)
+            batch.update(status="expired", expired_at=int(time.time()))
+        else:
+            batch.update(status="completed", completed_at=int(time.time()))
+
+    def batch_line(self, request, started):
+        # one line of the output file; the backend latency of a batch request is the time since its job started
+        server = self.server
+        body = request.get("body") or {}
+        plan = server.profile.draw()
+        error = self.choices_error(body)
+        tokens = 0
+        if plan["error"]:
+            status, payload = plan["error"], self.error_payload(plan["error"], "openai")[0]
+        elif error is not None:
+            status, payload = 400, error
+        else:
+            status, payload = 200, self.chat_completion(body, plan["words"])
+            tokens = payload["usage"]["completion_tokens"]
+        server.stats.record(time.monotonic() - started, tokens=tokens, error=status != 200)
+        return {"id": f"batch_req_mock-{next(server.ids)}", "custom_id": request.get("custom_id"),
+                "response": {"status_code": status, "request_id": f"req_mock-{next(server.ids)}", "body": payload}, "error": None}
+
+    # ---- record / replay ----
+
+    def record_upstream(self, protocol, body, started):
+        # forwards the request to the real API and streams the answer back, recording each line with its timing
+        server = self.server
+        request = urllib.request.Request(server.upstream.rstrip("/") + self.path, data=json.dumps(body).encode("utf-8"), method="POST")
+        request.add_header("Content-Type", "application/json")
+        if self.headers.get("Authorization"):
+            request.add_header("Authorization", self.headers["Authorization"])
+
+        try:
+            response = urllib.request.urlopen(request, timeout=600)
+        except urllib.error.HTTPError as e:
+            payload = e.read()
+            self.send_response(e.code)
+            self.send_header("Content-Type", e.headers.get("Content-Type", "application/json"))
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            server.stats.record(time.monotonic() - started, error=True)
+            return
+
+        events = []
+        with response:
+            if body.get("stream"):
+                self.start_stream()
+                for line in response:
+                    text = line.decode("utf-8")
+                    events.append([round(time.monotonic() - started, 4), text])
+                    self.write_chunk(text)
+                self.end_stream()
+            else:
+                payload = response.read()
+                events.append([round(time.monotonic() - started, 4), payload.decode("utf-8")])
+                self.send_json(200, json.loads(payload))
+
+        server.traces.append({"protocol": protocol, "stream": bool(body.get("stream")), "events": events})
+        server.stats.record(time.monotonic() - started)
+
+    def replay(self, trace, started):
+        speed = self.server.traces.speed
+        if not trace["stream"]:
+            offset, payload = trace["events"][0]
+            time.sleep(max(0.0, offset / speed - (time.monotonic() - started)))
+            self.send_json(200, json.loads(payload))
+        else:
+            self.start_stream()
+            for offset, text in trace["events"]:
+                time.sleep(max(0.0, offset / speed - (time.monotonic() - started)))
+                self.write_chunk(text)
+            self.end_stream()
+        self.server.stats.record(time.monotonic() - started)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host, port, profile, traces=None, upstream=None):
+        super().__init__((host, port), MockHandler)
+        self.profile = profile
+        self.traces = traces
+        self.upstream = upstream
+        self.stats = MockStats()
+        self.ids = itertools.count(1)
+        self.hf_lock = threading.Lock()
+        self.hf_models = {}  # model -> (loaded at, last request)
+        # reentrant: a job that finishes stores its output files while the lock is held
+        self.batch_lock = threading.RLock()
+        self.files = {}  # file id -> {"object": ..., "content": bytes}
+        self.batches = {}  # batch id -> job (see MockHandler.advance_batch)
+
+    def hf_loading(self, model):
+        # seconds until the HF model is loaded (0 = ready); a request to a cold model starts loading it
+        cold_start, idle_unload = self.profile.cold_start, self.profile.idle_unload
+        if cold_start <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self.hf_lock:
+            loaded_at, last_request = self.hf_models.get(model, (None, None))
+            if loaded_at is None or (idle_unload > 0 and loaded_at <= now and now - last_request > idle_unload):
+                loaded_at = now + cold_start
+            self.hf_models[model] = (loaded_at, now)
+        return max(0.0, loaded_at - now)
+
+    def add_file(self, content, filename, purpose):
+        with self.batch_lock:
+            file_id = f"file-mock-{next(self.ids)}"
+            file = {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                    "filename": filename, "purpose": purpose}
+            self.files[file_id] = {"object": file, "content": content}
+            return file
+
+    def handle_error(self, request, client_address):
+        # clients that hang up (timeouts, broken-off streams) are part of a load test, not an error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_mock_server(profile=None, host="127.0.0.1", port=0, traces=None, upstream=None):
+    # serves in a daemon thread (port 0 = any free port); stop with server.shutdown()
+    server = MockServer(host, port, profile or MockProfile(), traces=traces, upstream=upstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_mock_arguments(parser):
+    parser.add_argument('--tokens_per_second', type=float, default=50.0, help='Mock: streamed tokens per second per response')
+    parser.add_argument('--ttft_ms', type=float, default=300.0, help='Mock: median time to first token in milliseconds')
+    parser.add_argument('--ttft_sigma', type=float, default=0.5, help='Mock: spread of the log-normal time to first token')
+    parser.add_argument('--reply_tokens', type=int, nargs=2, default=[40, 200], metavar=('MIN', 'MAX'), help='Mock: reply length range in tokens')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Mock: share of requests answered with an error (0 to 1)')
+    parser.add_argument('--error_codes', type=int, nargs='+', default=[429, 500, 503], help='Mock: status codes used for injected errors')
+    parser.add_argument('--retry_after', type=float, default=1.0, help='Mock: Retry-After / estimated_time of injected 429 / 503 answers')
+    parser.add_argument('--disconnect_rate', type=float, default=0.0, help='Mock: share of streams broken off halfway (0 to 1)')
+    parser.add_argument('--single_choice_models', type=str, nargs='+', default=[], help='Mock: models that reject n > 1 with a 400, like some reasoning models')
+    parser.add_argument('--cold_start', type=float, default=0.0, help='Mock: seconds an HF model answers 503 "loading" after the first request to it')
+    parser.add_argument('--idle_unload', type=float, default=0.0, help='Mock: seconds without requests after which an HF model is cold again (0 = never)')
+    parser.add_argument('--batch_seconds', type=float, default=2.0, help='Mock: seconds a Batch API job takes from creation to its final status')
+    parser.add_argument('--batch_outcome', type=str, choices=BATCH_OUTCOMES, default='completed', help='Mock: final status of Batch API jobs')
+    parser.add_argument('--mock_seed', type=int, help='Mock: seed for reproducible timings and errors (optional)')
+    parser.add_argument('--trace', type=str, help='Mock: JSONL trace file to replay (or to record into with --record_upstream)')
+    parser.add_argument('--replay_speed', type=float, default=1.0, help='Mock: replay traces this many times faster than recorded')
+    parser.add_argument('--record_upstream', type=str, help='Mock: forward to this real API base (e.g. https://api.openai.com) and record the answers into --trace')
+
+
+def profile_from_args(args):
+    return MockProfile(
+        tokens_per_second=args.tokens_per_second,
+        ttft_median=args.ttft_ms / 1000,
+        ttft_sigma=args.ttft_sigma,
+        reply_tokens=tuple(args.reply_tokens),
+        error_rate=args.error_rate,
+        error_codes=args.error_codes,
+        retry_after=args.retry_after,
+        disconnect_rate=args.disconnect_rate,
+        seed=args.mock_seed,
+        single_choice_models=args.single_choice_models,
+        cold_start=args.cold_start,
+        idle_unload=args.idle_unload,
+        batch_seconds=args.batch_seconds,
+        batch_outcome=args.batch_outcome
+    )
+
+
+def mock_from_args(args, host="127.0.0.1", port=0):
+    if args.record_upstream and not args.trace:
+        raise ValueError("--record_upstream needs --trace to record into")
+    traces = TraceStore(args.trace, args.replay_speed) if args.trace else None
+    return start_mock_server(profile_from_args(args), host=host, port=port, traces=traces, upstream=args.record_upstream)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI / HF inference backend for load tests")
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=8900, help='Port to listen on')
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    server = mock_from_args(args, host=args.host, port=args.port)
+    print(f"<mock backend> Listening on {server.url} (OpenAI: --base_url {server.url}/v1, HF: --base_url {server.url})", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
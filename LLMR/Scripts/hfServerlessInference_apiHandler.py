@@ -1,27 +1,54 @@
-import requests
 import sys
 import argparse
+from shared_httpPool import get_shared_session
+from shared_modelCatalogue import get_catalogue
 
 def validate_api_token(api_token):
     test_url = "https://huggingface.co/api/whoami-v2"
     headers = {"Authorization": f"Bearer {api_token}"}
-    response = requests.get(test_url, headers=headers)
+    response = get_shared_session().get(test_url, headers=headers)
     return response.status_code == 200
 
-def get_available_models(api_token):
+def fetch_llama_models(api_token, etag=None, page_size=100, max_models=500):
+    # filtered and sorted server-side, pages follow the Link header (cursor pagination);
+    # If-None-Match on the first page lets an unchanged listing come back as a bodyless 304
     api_url = "https://huggingface.co/api/models"
     headers = {"Authorization": f"Bearer {api_token}"}
     params = {
-        "filter": "llama",
+        "search": "llama",
         "sort": "downloads",
-        "direction": -1
+        "direction": -1,
+        "limit": page_size
     }
-    response = requests.get(api_url, headers=headers, params=params)
+    session = get_shared_session()
+    response = session.get(api_url, headers=dict(headers, **({"If-None-Match": etag} if etag else {})), params=params)
+    if response.status_code == 304:
+        return None, etag
     if response.status_code != 200:
+        raise Exception(f"Model listing failed with status code {response.status_code}")
+    etag = response.headers.get("ETag")
+
+    model_ids = []
+    while True:
+        for model in response.json():
+            model_id = model.get("modelId") or model.get("id", "")
+            if "llama" in model_id.lower():
+                model_ids.append(model_id)
+        next_url = response.links.get("next", {}).get("url")
+        if not next_url or len(model_ids) >= max_models:
+            break
+        response = session.get(next_url, headers=headers)
+        if response.status_code != 200:
+            break
+
+    return model_ids[:max_models], etag
+
+def get_available_models(api_token, force_refresh=False):
+    # answered from the model catalogue (disk, per token), refreshed in the background once stale
+    try:
+        return get_catalogue().get("huggingface", api_token, lambda etag: fetch_llama_models(api_token, etag), force_refresh=force_refresh)
+    except Exception:
         return []
-    models = response.json()
-    model_ids = [model["modelId"] for model in models if "llama" in model["modelId"].lower()]
-    return model_ids
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Llama API Handler")
@@ -1,29 +1,148 @@
-import gradio as gr
 import requests
 import json
-import os
 import uuid
 import sys
 import argparse
-import datetime
+import atexit
+import time
+import itertools
 import re  # note from Moe: leave regex for post-processing! (removing "User:"s in replies)
-
-def run_gradio(api_token, model_id, system_message, temperature, max_completion_tokens, top_p, frequency_penalty, presence_penalty, stop_sequences):
-    api_url = f"https://api-inference.huggingface.co/models/{model_id}"
+from shared_startupProfile import STARTUP, add_health_route, missing_packages, startup_phase  # first: starts the startup clock
+from shared_admissionControl import AdmissionController, add_admission_arguments, admitted
+from shared_contextWindow import ContextWindow, add_context_arguments
+from shared_historyFormat import add_format_arguments
+from shared_historyJournal import HistoryJournal
+from shared_historyStore import add_store_arguments, store_from_args
+from shared_httpPool import connection_stats, create_session
+from shared_metrics import add_metrics_arguments, add_metrics_route, configure_metrics, get_metrics
+from shared_modelWarmup import ModelLoading, ModelWarmer, add_warmup_arguments, gated
+from shared_rateLimiter import RETRYABLE_STATUS_CODES, RateLimiter, RetryableError, call_with_backoff, estimate_tokens, hf_loading_wait, parse_retry_after
+from shared_responseCache import add_cache_arguments, cache_from_args, is_deterministic
+from shared_streamCoalescer import StreamCoalescer, StreamStats, add_stream_arguments
+
+HF_INFERENCE_URL = "https://api-inference.huggingface.co"
+
+def clean_reply(text):
+    # POST-PROCESSING: Remove any trailing 'User:' & following text
+    return re.split(r'User:', text, flags=re.IGNORECASE)[0].strip()
+
+def iter_stream_tokens(response):
+    # text-generation-inference token stream (server-sent events):
+    # data:{"token": {"text": " Hello", "special": false}, "generated_text": null, ...}
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        event = json.loads(data)
+        if event.get("error"):
+            raise Exception(f"<HFGS.py> Stream failed: {event['error']}")
+        token = event.get("token") or {}
+        if token.get("text") and not token.get("special"):
+            yield token["text"]
+
+def create_app(api_token, model_id, system_message, temperature, max_completion_tokens, top_p, frequency_penalty, presence_penalty, stop_sequences, requests_per_minute=None, tokens_per_minute=None, max_retries=5, pool_size=10, connect_timeout=5.0, read_timeout=60.0, stream=True, seed=None, cache=None, context_strategy="sliding", context_budget=None, context_last_k=10, http=None, stream_interval=0.05, stream_min_chars=64, concurrency=8, max_queue=64, session_limit=1, base_url=None, history_store=None, history_format="json", warmup=True, keep_warm_interval=240.0, keep_warm_idle=1800.0, load_timeout=300.0, max_loading_waiters=64):
+    # heavy libraries are imported on use instead of at module level, the module itself loads in milliseconds
+    with startup_phase("import gradio"):
+        import gradio as gr
+
+    # one governor per server: all participants share the token's rate limits
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    settings = {
+        "api_token": api_token,
+        "model_id": model_id,
+        "system_message": system_message,
+        "temperature": temperature,
+        "max_completion_tokens": max_completion_tokens,
+        "top_p": top_p,
+        "frequency_penalty": frequency_penalty,
+        "presence_penalty": presence_penalty
+    }
+    # one journal line per turn, chathistory_<id>.json is compacted on session end
+    journal = HistoryJournal(settings, "<hfSI_gS.py internal>", store=history_store, history_format=history_format)
+    atexit.register(journal.compact_all)
+    stream_stats = StreamStats("<hfSI_gS.py internal>")
+    # queue wait, TTFT, latency and token usage of every call (/metrics and the metrics log)
+    metrics = get_metrics().server("hf", model_id)
+
+    # bounded model calls with a visible queue in front of them (Gradio itself only hands requests over)
+    admission = AdmissionController(concurrency, max_queue, session_limit, log_prefix="<hfSI_gS.py internal>")
+
+    # bounds the prompt of every turn to the model's token budget; the summary strategy keeps
+    # excerpts of the dropped turns instead of spending a second inference call on a summary
+    context = ContextWindow(
+        model_id,
+        strategy=context_strategy,
+        budget=context_budget,
+        completion_reserve=max_completion_tokens or 512,
+        last_k=context_last_k,
+        log_prefix="<hfSI_gS.py internal>"
+    )
+
+    def end_session(unique_id):
+        journal.compact(unique_id)
+        context.forget(unique_id)
+
+    api_url = f"{base_url or HF_INFERENCE_URL}/models/{model_id}"
     headers = {
         "Authorization": f"Bearer {api_token}",
         "Content-Type": "application/json"
     }
+    # one keep-alive pool for all participants (no new TCP / TLS handshake per message), or the pool
+    # shared with other apps in the same process (multiModel_gradioServer.py). The headers are sent
+    # per request so a shared pool can serve several tokens
+    if http is None:
+        http = create_session(pool_size=pool_size, connect_timeout=connect_timeout, read_timeout=read_timeout)
+    request_counter = itertools.count(1)
+
+    def ping_model():
+        # smallest possible generation; use_cache off, a cached answer would not load the model
+        payload = {"inputs": "Hello", "parameters": {"max_new_tokens": 1}, "options": {"wait_for_model": False, "use_cache": False}}
+        limiter.acquire(estimate_tokens("Hello", 1))
+        response = http.post(api_url, json=payload, headers=headers)
+        if response.status_code == 503:
+            return False, hf_loading_wait(response)
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            # rate limited / server trouble: says nothing about the model, ask again later
+            return False, parse_retry_after(response.headers.get("retry-after"))
+        if response.status_code != 200:
+            raise Exception(f"<HFGS.py> Request failed with status code {response.status_code}: {response.text}")
+        return True, None
+
+    # cold starts: the model is pinged until it is loaded and kept loaded while participants are active;
+    # requests that arrive while it loads wait for it (bounded) instead of getting the 503
+    warmer = ModelWarmer(
+        ping_model,
+        "hf",
+        model_id,
+        keep_warm_interval=keep_warm_interval,
+        keep_warm_idle=keep_warm_idle,
+        load_timeout=load_timeout,
+        max_waiters=max_loading_waiters,
+        log_prefix="<hfSI_gS.py internal>"
+    )
 
     def generate_unique_id():
         return uuid.uuid4().hex
 
-    def predict(message, history, unique_id_state):
+    def journal_turn(message, unique_id, reply, record):
+        # usage and timings go into the saved history, cost and latency per session / model
+        started = time.perf_counter()
+        journal.append_turn(unique_id, message, reply, model=model_id, usage=record.usage(), **record.timings())
+        record.persistence_seconds += time.perf_counter() - started
+
+    # the loading gate comes first: a request waiting for a cold model holds no admission slot
+    @gated(warmer, metrics, notify=gr.Warning, inform=gr.Info, unchanged=gr.update(), max_rounds=max_retries + 1)
+    @admitted(admission, metrics, notify=gr.Warning, unchanged=gr.update())
+    def predict(message, history, unique_id_state, record):
         if unique_id_state is None:
             unique_id = generate_unique_id()
             unique_id_state = unique_id  # set  unique ID
         else:
             unique_id = unique_id_state  # retrieve existing unique ID
+        record.session = unique_id
 
         # build  conversation as list of mesgs
         messages = []
@@ -38,6 +157,11 @@ def run_gradio(api_token, model_id, system_message, temperature, max_completion_
         # add the new user message
         messages.append({"role": "user", "content": message})
 
+        # cut down to the token budget (the full history is still journaled)
+        messages, context_report = context.fit(messages, unique_id)
+        # the inference API reports no usage: the prompt is counted by the context window
+        record.prompt_tokens = context_report["prompt_tokens"]
+
         # parse the stop sequences
         if stop_sequences:
             stop_sequences_list = [seq.encode('utf-8').decode('unicode_escape').strip() for seq in stop_sequences.split(',')]
@@ -57,17 +181,21 @@ def run_gradio(api_token, model_id, system_message, temperature, max_completion_
         if 0.0 < top_p < 1.0:
             parameters["top_p"] = top_p
 
-        # messages to single string for  API
-        conversation = ""
+        if seed is not None:
+            parameters["seed"] = seed
+
+        # messages to single string for  API (one join instead of re-copying the prompt per message)
+        prompt_parts = []
         for msg in messages:
             if msg["role"] == "system":
-                conversation += f"{msg['content']}\n\n"
+                prompt_parts.append(f"{msg['content']}\n\n")
             elif msg["role"] == "user":
-                conversation += f"User: {msg['content']}\n"
+                prompt_parts.append(f"User: {msg['content']}\n")
             elif msg["role"] == "assistant":
-                conversation += f"Assistant: {msg['content']}\n"
+                prompt_parts.append(f"Assistant: {msg['content']}\n")
 
-        conversation += "Assistant:"
+        prompt_parts.append("Assistant:")
+        conversation = "".join(prompt_parts)
 
         payload = {
             "inputs": conversation,
@@ -77,130 +205,165 @@ def run_gradio(api_token, model_id, system_message, temperature, max_completion_
                 "use_cache": False,
             },
         }
-
-        try:
-            response = requests.post(api_url, headers=headers, json=payload, timeout=60)
+        if stream:
+            payload["stream"] = True
+
+        # deterministic requests (fixed seed) can be answered from the response cache
+        cache_key = None
+        if cache is not None and is_deterministic(parameters):
+            cache_key = cache.make_key({"model_id": model_id, "inputs": conversation, "parameters": parameters})
+            cached_reply = cache.get(cache_key)
+            if cached_reply is not None:
+                history = history or []
+                history.append({"role": "user", "content": message})
+                history.append({"role": "assistant", "content": cached_reply})
+                record.status = "cached"
+                journal_turn(message, unique_id, cached_reply, record)
+                yield history, unique_id_state, ""
+                return
+
+        def send_request():
+            response = http.post(api_url, json=payload, stream=stream, headers=headers)
+            if next(request_counter) % 25 == 0:
+                stats = connection_stats(http)
+                print(f"<hfSI_gS.py internal> HTTP pool: {stats['requests']} requests over {stats['connections']} connections ({stats['reused']} reused).")
             if response.status_code == 503:
-                raise Exception("<HFGS.py> 503: Model is loading. Please try again shortly.")
+                # model is loading (it went cold): the warmer polls it from now on, the request goes back through its gate
+                warmer.report_loading(hf_loading_wait(response))
+                response.close()
+                raise ModelLoading("<HFGS.py> 503: Model is loading.")
+            elif response.status_code in RETRYABLE_STATUS_CODES:
+                raise RetryableError(f"<HFGS.py> Request failed with status code {response.status_code}: {response.text}", status_code=response.status_code, retry_after=parse_retry_after(response.headers.get("retry-after")))
             elif response.status_code != 200:
                 raise Exception(f"<HFGS.py> Request failed with status code {response.status_code}: {response.text}")
+            return response
 
-            output = response.json()
-            # handle case where output is list
-            if isinstance(output, list):
-                if len(output) > 0:
-                    generated_text = output[0].get("generated_text", "")
+        try:
+            response = call_with_backoff(
+                send_request,
+                limiter=limiter,
+                tokens=estimate_tokens(conversation, parameters["max_new_tokens"]),
+                max_retries=max_retries,
+                on_retry=lambda e, retry, delay: print(f"<hfSI_gS.py internal> Request failed ({str(e)}), retry {retry}/{max_retries} in {delay:.1f}s.")
+            )
+
+            history = history or []
+            history.append({"role": "user", "content": message})
+
+            if stream:
+                # placeholder for the assistant's reply, filled token by token
+                history.append({"role": "assistant", "content": ""})
+                # tokens are coalesced (time window / character threshold): the reply is joined and
+                # cleaned once per UI update instead of once per token
+                coalescer = StreamCoalescer(stream_interval, stream_min_chars)
+                try:
+                    for token_text in iter_stream_tokens(response):
+                        record.chunk()
+                        if coalescer.add(token_text):
+                            history[-1]["content"] = clean_reply(coalescer.text)
+                            yield history, unique_id_state, ""
+                finally:
+                    # hands the connection back to the pool even if the stream breaks off
+                    response.close()
+                assistant_reply = clean_reply(coalescer.text)
+                if coalescer.flush():
+                    history[-1]["content"] = assistant_reply
+                    yield history, unique_id_state, ""
+                stream_stats.record(coalescer)
+                # one event per generated token
+                record.completion_tokens = record.chunks
+            else:
+                output = response.json()
+                # handle case where output is list
+                if isinstance(output, list):
+                    if len(output) > 0:
+                        generated_text = output[0].get("generated_text", "")
+                    else:
+                        generated_text = ""
+                elif isinstance(output, dict):
+                    generated_text = output.get("generated_text", "")
                 else:
                     generated_text = ""
-            elif isinstance(output, dict):
-                generated_text = output.get("generated_text", "")
-            else:
-                generated_text = ""
 
-            # assistant's reply
-            assistant_reply = generated_text[len(conversation):].strip()
+                # assistant's reply (the non-streaming API echoes the prompt)
+                assistant_reply = clean_reply(generated_text[len(conversation):])
+                record.completion_tokens = estimate_tokens(assistant_reply)
+                history.append({"role": "assistant", "content": assistant_reply})
 
-            # POST-PROCESSING: Remove any trailing 'User:' & following text
-            assistant_reply = re.split(r'User:', assistant_reply, flags=re.IGNORECASE)[0].strip()
+            history[-1]["content"] = assistant_reply
 
-            # update history
-            new_history = history or []
-            new_history.append({"role": "user", "content": message})
-            new_history.append({"role": "assistant", "content": assistant_reply})
+            # journal the turn
+            journal_turn(message, unique_id, assistant_reply, record)
 
-            # save 
-            download_history(new_history, unique_id)
+            if cache_key is not None:
+                cache.put_deferred(cache_key, assistant_reply)
 
             # yield updated hist
-            yield new_history, unique_id_state, ""
+            yield history, unique_id_state, ""
 
+        except ModelLoading:
+            # nothing was shown yet: gated() gives the slot back and waits for the model
+            record.status = "model_loading"
+            raise
         except requests.exceptions.Timeout:
+            record.status = "timeout"
             error_message = "An error occurred: The request timed out."
             history.append({"role": "assistant", "content": error_message})
             yield history, unique_id_state, ""
         except Exception as e:
+            record.status = "error"
             error_message = f"An error occurred: {str(e)}"
             history.append({"role": "assistant", "content": error_message})
             yield history, unique_id_state, ""
 
-    def download_history(history, unique_id):
-        # hist to list of user-assistant pairs
-        history_json = []
-        current_pair = {}
-        for msg in history:
-            if msg["role"] == "user":
-                current_pair = {"user": msg["content"]}
-            elif msg["role"] == "assistant":
-                if "user" in current_pair:
-                    current_pair["assistant"] = msg["content"]
-                    history_json.append(current_pair)
-                    current_pair = {}
-        # handle any remaining msg
-        if current_pair:
-            history_json.append(current_pair)
-
-        settings = {
-            "api_token": api_token,
-            "model_id": model_id,
-            "system_message": system_message,
-            "temperature": temperature,
-            "max_completion_tokens": max_completion_tokens,
-            "top_p": top_p,
-            "frequency_penalty": frequency_penalty,
-            "presence_penalty": presence_penalty,
-            "downloaded_on": datetime.datetime.now().strftime("%B %d, %Y at %H:%M:%S")  
-        }
-
-        full_data = {
-            "settings": settings,
-            "conversation": history_json
-        }
-
-        try:
-            print("<hfSI_gS.py internal> History is being downloaded...")
-
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            chat_dir = os.path.join(script_dir, "chat_histories")
-            os.makedirs(chat_dir, exist_ok=True)
-
-            filename = f"chathistory_{unique_id}.json"
-            filepath = os.path.join(chat_dir, filename)
-
-            print(f"<hfSI_gS.py internal> History is being saved as {filename} in the directory {filepath}.")
-
-            with open(filepath, "w") as f:
-                json.dump(full_data, f, indent=4)  # save settings and history
-
-            print("<hfSI_gS.py internal> History was successfully downloaded.")
-
-            return filepath
-        except Exception as e:
-            return f"Error saving chat history: {str(e)}"
-
     def create_interface():
         with gr.Blocks() as iface:
             chatbot = gr.Chatbot(type="messages")
             msg = gr.Textbox(label="Send message to the LLM")
             clear = gr.Button("Clear")
             unique_id_label = gr.Label(value="")  # display unique ID
-            state = gr.State(value=None)  # init session state for unique ID
+            state = gr.State(value=None, delete_callback=end_session)  # init session state for unique ID (compacted when the session closes)
 
             def update_unique_id(state):
+                warmer.touch()
                 if state is None:
                     state = generate_unique_id()
                 return f"Your unique ID: {state}", state
 
+            def clear_session(state):
+                # clearing starts a new session, so the old one is finished
+                end_session(state)
+                return [], None, ""
+
             # update unique ID
             iface.load(fn=update_unique_id, inputs=state, outputs=[unique_id_label, state])
 
             # pass message, hist & ID state to predict
-            msg.submit(predict, inputs=[msg, chatbot, state], outputs=[chatbot, state, msg])
-            clear.click(lambda: ([], None, ""), None, [chatbot, state, msg], queue=False)
+            # at most `concurrency` chats run, the others wait in Gradio's queue (no thread held per waiting request)
+            concurrency_limit, queue_size = admission.gradio_queue()
+            msg.submit(predict, inputs=[msg, chatbot, state], outputs=[chatbot, state, msg], concurrency_limit=concurrency_limit, api_name="predict")
+            clear.click(clear_session, state, [chatbot, state, msg], queue=False)
 
+        iface.queue(max_size=queue_size)
+        iface.chat_predict = predict  # lets benchmark_loadTest.py drive the chat without a browser
         return iface
 
-    interface = create_interface()
-    interface.launch(share=True)  
+    warmer.start(warm_up=warmup)
+
+    with startup_phase("build app"):
+        return create_interface()
+
+def run_gradio(*args, local_only=False, **kwargs):
+    # standalone server: one model configuration per process. local_only skips the share tunnel,
+    # the slowest part of the startup
+    app = create_app(*args, **kwargs)
+    with startup_phase("launch (local only)" if local_only else "launch + share tunnel"):
+        app.launch(share=not local_only, prevent_thread_lock=True)
+    add_metrics_route(app.server_app)
+    add_health_route(app.server_app, {"backend": "hf", "model": kwargs.get("model_id")})
+    STARTUP.mark_ready()
+    STARTUP.report("<hfSI_gS.py internal>")
+    app.block_thread()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Hugging Face Serverless Inference Gradio Server")
@@ -214,10 +377,36 @@ if __name__ == "__main__":
     parser.add_argument('--frequency_penalty', type=float, default=0.0, help='Frequency penalty (-2.0 to 2.0)')
     parser.add_argument('--presence_penalty', type=float, default=0.0, help='Presence penalty (-2.0 to 2.0)')
     parser.add_argument('--stop_sequences', type=str, default="User:,\\nUser:", help='Comma-separated list of stop sequences')
+    parser.add_argument('--requests_per_minute', type=int, help='Request rate limit shared by all participants (optional)')
+    parser.add_argument('--tokens_per_minute', type=int, help='Token rate limit shared by all participants (optional)')
+    parser.add_argument('--max_retries', type=int, default=5, help='Retries per request on 429 / 5xx / timeouts (a 503 "model loading" waits for the warm-up instead)')
+    parser.add_argument('--pool_size', type=int, default=10, help='Keep-alive connections to the inference API (match the Gradio concurrency)')
+    parser.add_argument('--connect_timeout', type=float, default=5.0, help='Connect timeout in seconds')
+    parser.add_argument('--read_timeout', type=float, default=60.0, help='Read timeout in seconds (between two streamed tokens when streaming)')
+    parser.add_argument('--no_stream', action='store_true', help='Wait for the full reply instead of streaming tokens')
+    parser.add_argument('--seed', type=int, help='Sampling seed for reproducible answers (optional)')
+    parser.add_argument('--base_url', type=str, help='Alternative API base URL, e.g. a local stand-in server (optional)')
+    add_cache_arguments(parser)
+    add_stream_arguments(parser)
+    add_admission_arguments(parser)
+    add_metrics_arguments(parser)
+    add_store_arguments(parser)
+    add_format_arguments(parser)
+    add_warmup_arguments(parser)
+    add_context_arguments(parser, summary_model=False)
+    parser.add_argument('--local_only', action='store_true', help='Do not create a public share link (faster startup, only reachable on this machine)')
+    parser.add_argument('--startup-profile', action='store_true', help='Print the time spent in each startup phase')
 
     args = parser.parse_args()
 
     if args.start_gradio:
+        STARTUP.enabled = args.startup_profile
+        configure_metrics(args)
+        missing = missing_packages("gradio")
+        if missing:
+            print(f"<hfSI_gS.py internal> Missing Python packages: {', '.join(missing)}")
+            sys.exit(1)
+
         run_gradio(
             api_token=args.api_token,
             model_id=args.model_id,
@@ -227,7 +416,33 @@ if __name__ == "__main__":
             top_p=args.top_p,
             frequency_penalty=args.frequency_penalty,
             presence_penalty=args.presence_penalty,
-            stop_sequences=args.stop_sequences
+            stop_sequences=args.stop_sequences,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            max_retries=args.max_retries,
+            pool_size=args.pool_size,
+            connect_timeout=args.connect_timeout,
+            read_timeout=args.read_timeout,
+            stream=not args.no_stream,
+            seed=args.seed,
+            cache=cache_from_args(args),
+            context_strategy=args.context_strategy,
+            context_budget=args.context_budget,
+            context_last_k=args.context_last_k,
+            stream_interval=args.stream_interval_ms / 1000,
+            stream_min_chars=args.stream_min_chars,
+            concurrency=args.concurrency,
+            max_queue=args.max_queue,
+            session_limit=args.session_limit,
+            base_url=args.base_url,
+            history_store=store_from_args(args),
+            history_format=args.history_format,
+            warmup=not args.no_warmup,
+            keep_warm_interval=args.keep_warm_interval,
+            keep_warm_idle=args.keep_warm_idle,
+            load_timeout=args.load_timeout,
+            max_loading_waiters=args.max_loading_waiters,
+            local_only=args.local_only
         )
     else:
         print("<hfSI_gS.py internal> Gradio interface is not running. Use --start-gradio to start the interface.")
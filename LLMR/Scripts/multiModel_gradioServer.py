@@ -0,0 +1,201 @@
+import argparse
+import html
+import importlib
+import json
+import secrets
+import sys
+import threading
+from shared_startupProfile import STARTUP, add_health_route, missing_packages, startup_phase  # first: starts the startup clock
+from shared_historyStore import HistoryStore
+from shared_httpPool import create_async_httpx_client, create_httpx_client, create_session
+from shared_metrics import add_metrics_arguments, add_metrics_route, configure_metrics
+from shared_responseCache import ResponseCache
+
+# one long-lived server for several model configurations: every route is the Blocks app of one
+# *_gradioServer.py (built by its create_app), mounted under its own path on one FastAPI app.
+# All routes share one Gradio stack, one HTTP pool per client library, one persistence writer and
+# (optionally) one response cache, and there is one share tunnel instead of one per model.
+#
+# config file (JSON), route keys other than path / backend are passed to create_app:
+# {
+#     "host": "127.0.0.1",
+#     "port": 7860,
+#     "share": true,
+#     "pool_size": 20,
+#     "async_pool_size": 100,
+#     "response_cache": false,
+#     "history_store": false,
+#     "history_format": "json",
+#     "routes": [
+#         {"path": "/gpt-4o", "backend": "openai_v2", "api_key": "...", "model": "gpt-4o", "system_message": "You are a helpful assistant.",
+#          "temperature": 0.7, "max_tokens": null, "top_p": 1.0, "frequency_penalty": 0.0, "presence_penalty": 0.0},
+#         {"path": "/o1", "backend": "openai_o1", "api_key": "...", "model": "o1", "reasoning_effort": "medium", "max_completion_tokens": null},
+#         {"path": "/llama", "backend": "hf", "api_token": "...", "model_id": "meta-llama/Llama-2-7b-chat-hf", "system_message": "You are a helpful assistant.",
+#          "temperature": 0.8, "max_completion_tokens": null, "top_p": 0.95, "frequency_penalty": 0.0, "presence_penalty": 0.0, "stop_sequences": "User:"}
+#     ]
+# }
+
+# backend -> module with create_app (imported only if a route uses it)
+BACKENDS = {
+    "openai_v2": "openAI_v2_gradioServer",
+    "openai_o1": "openAI_o1-line_gradioServer",
+    "hf": "hfServerlessInference_gradioServer",
+}
+
+
+def load_config(path):
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    routes = config.get("routes") or []
+    if not routes:
+        raise ValueError("<MMGS.py> The config has no routes.")
+
+    paths = set()
+    for route in routes:
+        path = route.get("path", "")
+        if not path.startswith("/") or path == "/":
+            raise ValueError(f"<MMGS.py> Route path '{path}' must start with '/' and not be the root.")
+        if path in paths:
+            raise ValueError(f"<MMGS.py> Route path '{path}' is used twice.")
+        paths.add(path)
+        if route.get("backend") not in BACKENDS:
+            raise ValueError(f"<MMGS.py> Unknown backend '{route.get('backend')}' for route '{path}', use one of {', '.join(BACKENDS)}.")
+
+    return config
+
+
+def build_server(config):
+    with startup_phase("import gradio"):
+        import gradio as gr
+        from fastapi import FastAPI
+        from fastapi.responses import HTMLResponse
+
+    pool_size = config.get("pool_size", 20)
+    # one pool per client library, shared by every route of that backend
+    http = create_session(pool_size=pool_size)
+    http_client = create_httpx_client(pool_size=pool_size)
+    # async streams all run on the server's event loop and share this pool
+    async_http_client = create_async_httpx_client(pool_size=config.get("async_pool_size", 100))
+    cache = ResponseCache() if config.get("response_cache") else None
+    # one SQLite store for all routes (true: chat_history.sqlite3 next to the scripts, or a path)
+    history_store = config.get("history_store")
+    store = (HistoryStore(history_store) if isinstance(history_store, str) else HistoryStore()) if history_store else None
+
+    app = FastAPI()
+    for route in config["routes"]:
+        options = dict(route)
+        path = options.pop("path")
+        backend = options.pop("backend")
+        with startup_phase(f"import {BACKENDS[backend]}"):
+            module = importlib.import_module(BACKENDS[backend])
+
+        if backend == "hf":
+            options.setdefault("http", http)
+        else:
+            options.setdefault("http_client", http_client)
+            options.setdefault("async_http_client", async_http_client)
+        options.setdefault("cache", cache)
+        options.setdefault("history_store", store)
+        options.setdefault("history_format", config.get("history_format", "json"))
+
+        blocks = module.create_app(**options)
+        with startup_phase(f"mount {path}"):
+            app = gr.mount_gradio_app(app, blocks, path=path)
+        print(f"<MMGS internal> Mounted {backend} ({route.get('model') or route.get('model_id')}) on {path}.")
+
+    # one /metrics for all routes, the series carry backend / model labels
+    add_metrics_route(app)
+    add_health_route(app, {"routes": [{"path": route["path"], "backend": route["backend"]} for route in config["routes"]]})
+
+    @app.get("/", response_class=HTMLResponse)
+    def index():
+        rows = []
+        for route in config["routes"]:
+            model = route.get("model") or route.get("model_id") or ""
+            rows.append(f'<li><a href="{html.escape(route["path"])}/">{html.escape(route["path"])}</a>: {html.escape(route["backend"])} / {html.escape(model)}</li>')
+        return "<html><body><h1>LLMR models</h1><ul>" + "".join(rows) + "</ul></body></html>"
+
+    return app
+
+
+def open_share_tunnel(host, port):
+    # same tunnel Gradio's launch(share=True) opens, one for the whole server
+    from gradio.networking import setup_tunnel
+    return setup_tunnel(host, port, secrets.token_urlsafe(32), None)
+
+
+def serve(config):
+    with startup_phase("import uvicorn"):
+        import uvicorn
+
+    host = config.get("host", "127.0.0.1")
+    port = config.get("port", 7860)
+    app = build_server(config)
+
+    with startup_phase("start server"):
+        server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        thread = threading.Thread(target=server.run, name="uvicorn", daemon=True)
+        thread.start()
+        while not server.started:
+            if not thread.is_alive():
+                print("<MMGS internal> Server failed to start.")
+                sys.exit(1)
+            thread.join(0.05)
+
+    local_url = f"http://{host}:{port}"
+    print(f"Running on local URL:  {local_url}", flush=True)
+    for route in config["routes"]:
+        print(f"<MMGS internal> {route['path']}: {local_url}{route['path']}/", flush=True)
+
+    if config.get("share", True):
+        try:
+            with startup_phase("share tunnel"):
+                public_url = open_share_tunnel(host, port)
+            print(f"Running on public URL: {public_url}", flush=True)
+        except Exception as e:
+            print(f"<MMGS internal> Could not create a share link ({str(e)}), the server is only reachable locally.", flush=True)
+
+    STARTUP.mark_ready()
+    STARTUP.report("<MMGS internal>")
+
+    try:
+        while thread.is_alive():
+            thread.join(1.0)
+    except KeyboardInterrupt:
+        server.should_exit = True
+        thread.join(10.0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-model Gradio Server")
+    parser.add_argument('--config', type=str, required=True, help='JSON file with the server settings and the model routes')
+    parser.add_argument('--host', type=str, help='Host to bind (overrides the config)')
+    parser.add_argument('--port', type=int, help='Port to bind (overrides the config)')
+    parser.add_argument('--no_share', action='store_true', help='Do not create a public share link (faster startup)')
+    parser.add_argument('--startup-profile', action='store_true', help='Print the time spent in each startup phase')
+    add_metrics_arguments(parser)
+
+    args = parser.parse_args()
+    STARTUP.enabled = args.startup_profile
+    configure_metrics(args)
+
+    missing = missing_packages("gradio", "fastapi", "uvicorn")
+    if missing:
+        print(f"<MMGS internal> Missing Python packages: {', '.join(missing)}")
+        sys.exit(1)
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        print(f"<MMGS internal> Invalid config: {str(e)}")
+        sys.exit(1)
+
+    if args.host:
+        config["host"] = args.host
+    if args.port:
+        config["port"] = args.port
+    if args.no_share:
+        config["share"] = False
+
+    serve(config)
@@ -1,11 +1,14 @@
 import sys
 import os
-import openai
 import json
 import logging
 import uuid
+from shared_clientRegistry import get_registry
+from shared_modelCatalogue import get_catalogue
 
-logging.basicConfig(level=logging.DEBUG)
+# module logger: the embedding process (Python.NET) decides what is shown, importing this module
+# must not turn on debug logging for everything else
+logger = logging.getLogger(__name__)
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 models_path = os.path.join(current_dir, "Models")
@@ -13,22 +16,25 @@ models_path = os.path.join(current_dir, "Models")
 sys.path.append(models_path)
 
 def validate_api_key(api_key):
+    # cheap check (one model lookup), memoized for a few minutes per key
     try:
-        client = openai.OpenAI(api_key=api_key)
-        response = client.models.list()
-        logging.debug("API-Schlüssel validiert und OpenAI-Client erfolgreich initialisiert.")
+        get_registry().validate(api_key)
+        logger.debug("API-Schlüssel validiert.")
         return True
     except Exception as e:
-        logging.error(f"Fehler bei der Validierung des API-Schlüssels: {e}")
+        logger.error(f"Fehler bei der Validierung des API-Schlüssels: {e}")
         return False
 
-def get_available_models(api_key):
+def get_available_models(api_key, force_refresh=False):
+    def fetch(etag):
+        client = get_registry().get_client(api_key)
+        return [model.id for model in client.models.list()], None
+
     try:
-        client = openai.OpenAI(api_key=api_key)
-        response = client.models.list()
-        models = [model.id for model in response]
-        logging.debug(f"Verfügbare Modelle: {models}")
+        # answered from the model catalogue (disk, per key), refreshed in the background once stale
+        models = get_catalogue().get("openai", api_key, fetch, force_refresh=force_refresh)
+        logger.debug(f"Verfügbare Modelle: {models}")
         return models
     except Exception as e:
-        logging.error(f"Fehler beim Abrufen der verfügbaren Modelle: {e}")
-        return []
\ No newline at end of file
+        logger.error(f"Fehler beim Abrufen der verfügbaren Modelle: {e}")
+        return []
@@ -1,97 +1,158 @@
-import gradio as gr
-import openai
-import json
 import os
 import uuid
 import sys
 import argparse
 import subprocess
-import datetime
+import atexit
+import time
+from shared_startupProfile import STARTUP, add_health_route, missing_packages, startup_phase  # first: starts the startup clock
+from shared_admissionControl import AdmissionController, add_admission_arguments, admitted
+from shared_contextWindow import ContextWindow, add_context_arguments, openai_summarizer
+from shared_historyFormat import add_format_arguments
+from shared_historyJournal import HistoryJournal
+from shared_historyStore import add_store_arguments, store_from_args
+from shared_metrics import add_metrics_arguments, add_metrics_route, configure_metrics, get_metrics
+from shared_rateLimiter import RateLimiter, call_with_backoff, estimate_tokens
+from shared_responseCache import add_cache_arguments, cache_from_args, is_deterministic
+from shared_streamCoalescer import StreamCoalescer, StreamStats, add_stream_arguments
 
-def run_gradio(api_key, model, temperature, max_tokens, top_p, frequency_penalty, presence_penalty):
-    client = openai.Client(api_key=api_key)
+def create_app(api_key, model, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, requests_per_minute=None, tokens_per_minute=None, max_retries=5, cache=None, context_strategy="sliding", context_budget=None, context_last_k=10, context_summary_model=None, stream_interval=0.05, stream_min_chars=64, concurrency=8, max_queue=64, session_limit=1, history_store=None, history_format="json"):
+    # heavy libraries are imported on use instead of at module level
+    with startup_phase("import openai"):
+        import openai
+    with startup_phase("import gradio"):
+        import gradio as gr
+
+    client = openai.Client(api_key=api_key, max_retries=0)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    settings = {
+        "api_key": api_key,
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "top_p": top_p,
+        "frequency_penalty": frequency_penalty,
+        "presence_penalty": presence_penalty
+    }
+    journal = HistoryJournal(settings, "<GSPY internal>", store=history_store, history_format=history_format)
+    atexit.register(journal.compact_all)
+    stream_stats = StreamStats("<GSPY internal>")
+    # queue wait, TTFT, latency and token usage of every call (metrics log)
+    metrics = get_metrics().server("openai_v1", model)
+
+    # bounded model calls with a visible queue in front of them (Gradio itself only hands requests over)
+    admission = AdmissionController(concurrency, max_queue, session_limit, log_prefix="<GSPY internal>")
+
+    context = ContextWindow(
+        model,
+        strategy=context_strategy,
+        budget=context_budget,
+        completion_reserve=max_tokens,
+        last_k=context_last_k,
+        summarize=openai_summarizer(client, context_summary_model or model, limiter, max_retries) if context_strategy == "summary" else None,
+        log_prefix="<GSPY internal>"
+    )
+
+    def end_session(unique_id):
+        journal.compact(unique_id)
+        context.forget(unique_id)
 
     def generate_unique_id():
         return uuid.uuid4().hex
 
-    def predict(message, history, unique_id_state):
+    def journal_turn(message, unique_id, reply, record):
+        # usage and timings go into the saved history
+        started = time.perf_counter()
+        journal.append_turn(unique_id, message, reply, model=model, usage=record.usage(), **record.timings())
+        record.persistence_seconds += time.perf_counter() - started
+
+    @admitted(admission, metrics, notify=gr.Warning, unchanged=gr.update())
+    def predict(message, history, unique_id_state, record):
         if unique_id_state is None:
             unique_id = generate_unique_id()
             unique_id_state = unique_id  # generated unique ID 
         else:
             unique_id = unique_id_state  # alt: retrieve existing ID 
+        record.session = unique_id
     
         history_openai_format = []
         for human, assistant in history:
             history_openai_format.append({"role": "user", "content": human})
             history_openai_format.append({"role": "assistant", "content": assistant})
         history_openai_format.append({"role": "user", "content": message})
+        history_openai_format, _ = context.fit(history_openai_format, unique_id)
     
+        streaming_started = False
         try:
             partial_message = ""  # empty response container:
-            response = client.chat.completions.create(
-                model=model,
-                messages=history_openai_format,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                top_p=top_p,
-                frequency_penalty=frequency_penalty,
-                presence_penalty=presence_penalty,
-                stream=True
+            parameters = {
+                "model": model,
+                "messages": history_openai_format,
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "top_p": top_p,
+                "frequency_penalty": frequency_penalty,
+                "presence_penalty": presence_penalty,
+                "stream": True,
+                # the last chunk carries the token usage (no choices in it)
+                "stream_options": {"include_usage": True}
+            }
+
+            # temperature 0 requests can be answered from the response cache
+            cache_key = None
+            if cache is not None and is_deterministic(parameters):
+                cache_key = cache.make_key(parameters)
+                cached_reply = cache.get(cache_key)
+                if cached_reply is not None:
+                    record.status = "cached"
+                    journal_turn(message, unique_id, cached_reply, record)
+                    yield history + [(message, cached_reply)], unique_id_state, ""
+                    return
+
+            response = call_with_backoff(
+                lambda: client.chat.completions.create(**parameters),
+                limiter=limiter,
+                tokens=estimate_tokens(history_openai_format, max_tokens),
+                max_retries=max_retries
             )
     
+            # one [message, reply] pair appended once and filled in place (no list copy per chunk),
+            # deltas coalesced by time window / character threshold
+            history.append([message, ""])
+            streaming_started = True
+            coalescer = StreamCoalescer(stream_interval, stream_min_chars)
             for chunk in response:
-                if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
-                    partial_message += chunk.choices[0].delta.content
-                    # yield partial response (streaming!) clear input
-                    yield history + [(message, partial_message)], unique_id_state, ""
-    
-            # download history
-            download_history(history + [(message, partial_message)], unique_id)
-    
-        except Exception:
-            # save errormsg in hist!
-            yield history + [(message, "An error occurred. Please try again later.")], unique_id_state, ""
-
-
-    def download_history(history, unique_id):
-        history_json = [{"user": human, "assistant": assistant} for human, assistant in history]
-        settings = {
-            "api_key": api_key,
-            "model": model,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "top_p": top_p,
-            "frequency_penalty": frequency_penalty,
-            "presence_penalty": presence_penalty,
-            "downloaded_on": datetime.datetime.now().strftime("%B %d, %Y at %H:%M:%S")  # Zeitstempel
-        }
-        
-        full_data = {
-            "settings": settings,
-            "conversation": history_json
-        }
-    
-        try:
-            print("<GSPY internal> History is being downloaded...")
-    
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            chat_dir = os.path.join(script_dir, "chat_histories")
-            os.makedirs(chat_dir, exist_ok=True)
-    
-            filename = f"chathistory_{unique_id}.json"
-            filepath = os.path.join(chat_dir, filename)
-    
-            print("<GSPY internal> History is being saved as " + filename + " in the directory " + filepath + ".")
-    
-            with open(filepath, "w") as f:
-                json.dump(full_data, f, indent=4)  # save as json (settings and hist)
+                if chunk.usage:
+                    record.add_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    record.chunk()
+                    if coalescer.add(chunk.choices[0].delta.content):
+                        history[-1][1] = coalescer.text
+                        # yield partial response (streaming!) clear input
+                        yield history, unique_id_state, ""
+
+            partial_message = coalescer.text
+            if coalescer.flush():
+                history[-1][1] = partial_message
+                yield history, unique_id_state, ""
+            stream_stats.record(coalescer)
     
-            print("<GSPY internal> History was successfully downloaded.")
+            # journal the turn (chathistory_<id>.json is compacted on session end)
+            journal_turn(message, unique_id, partial_message, record)
+
+            if cache_key is not None:
+                cache.put_deferred(cache_key, partial_message)
     
-            return filepath
         except Exception:
-            return "Error saving chat history."
+            record.status = "error"
+            # save errormsg in hist! (in the reply placeholder if streaming had started)
+            if streaming_started:
+                history[-1][1] = "An error occurred. Please try again later."
+            else:
+                history.append([message, "An error occurred. Please try again later."])
+            yield history, unique_id_state, ""
+
 
     def create_interface():
         with gr.Blocks() as iface:
@@ -99,22 +160,41 @@ def run_gradio(api_key, model, temperature, max_tokens, top_p, frequency_penalty
             msg = gr.Textbox(label="Send message to the LLM")
             clear = gr.Button("Clear")
             unique_id_label = gr.Label(value="") 
-            state = gr.State(value=None)  
+            state = gr.State(value=None, delete_callback=end_session)
 
             def update_unique_id(state):
                 if state is None:
                     state = generate_unique_id()
                 return f"Your unique ID: {state}", state
 
+            def clear_session(state):
+                # clearing starts a new session, so the old one is finished
+                end_session(state)
+                return [], None, ""
+
             iface.load(fn=update_unique_id, inputs=state, outputs=[unique_id_label, state])
 
-            msg.submit(predict, inputs=[msg, chatbot, state], outputs=[chatbot, state, msg])
-            clear.click(lambda: None, None, chatbot, queue=False)
+            # at most `concurrency` chats run, the others wait in Gradio's queue (no thread held per waiting request)
+            concurrency_limit, queue_size = admission.gradio_queue()
+            msg.submit(predict, inputs=[msg, chatbot, state], outputs=[chatbot, state, msg], concurrency_limit=concurrency_limit, api_name="predict")
+            clear.click(clear_session, state, [chatbot, state, msg], queue=False)
 
+        iface.queue(max_size=queue_size)
         return iface
 
-    interface = create_interface()
-    interface.launch(share=True)  
+    with startup_phase("build app"):
+        return create_interface()
+
+def run_gradio(*args, local_only=False, **kwargs):
+    # local_only skips the share tunnel, the slowest part of the startup
+    app = create_app(*args, **kwargs)
+    with startup_phase("launch (local only)" if local_only else "launch + share tunnel"):
+        app.launch(share=not local_only, prevent_thread_lock=True)
+    add_metrics_route(app.server_app)
+    add_health_route(app.server_app, {"backend": "openai_v1", "model": kwargs.get("model")})
+    STARTUP.mark_ready()
+    STARTUP.report("<GSPY internal>")
+    app.block_thread()
 
 def start_gradio_interface(api_key, model, temperature, max_tokens, top_p, frequency_penalty, presence_penalty):
     global gradio_process
@@ -167,10 +247,29 @@ if __name__ == "__main__":
     parser.add_argument('--top_p', type=float, default=1.0, help='Top P')
     parser.add_argument('--frequency_penalty', type=float, default=0.0, help='Frequency penalty')
     parser.add_argument('--presence_penalty', type=float, default=0.0, help='Presence penalty')
+    parser.add_argument('--requests_per_minute', type=int, help='Request rate limit (optional)')
+    parser.add_argument('--tokens_per_minute', type=int, help='Token rate limit (optional)')
+    parser.add_argument('--max_retries', type=int, default=5, help='Retries per request on 429 / 5xx / connection errors')
+    add_cache_arguments(parser)
+    add_stream_arguments(parser)
+    add_admission_arguments(parser)
+    add_metrics_arguments(parser)
+    add_store_arguments(parser)
+    add_format_arguments(parser)
+    add_context_arguments(parser)
+    parser.add_argument('--local_only', action='store_true', help='Do not create a public share link (faster startup, only reachable on this machine)')
+    parser.add_argument('--startup-profile', action='store_true', help='Print the time spent in each startup phase')
 
     args = parser.parse_args()
 
     if args.start_gradio:
+        STARTUP.enabled = args.startup_profile
+        configure_metrics(args)
+        missing = missing_packages("openai", "gradio")
+        if missing:
+            print(f"<GSPY internal> Missing Python packages: {', '.join(missing)}")
+            sys.exit(1)
+
         if not all([
             args.api_key,
             args.model,
@@ -190,7 +289,23 @@ if __name__ == "__main__":
             max_tokens=args.max_tokens,
             top_p=args.top_p,
             frequency_penalty=args.frequency_penalty,
-            presence_penalty=args.presence_penalty
+            presence_penalty=args.presence_penalty,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            max_retries=args.max_retries,
+            cache=cache_from_args(args),
+            context_strategy=args.context_strategy,
+            context_budget=args.context_budget,
+            context_last_k=args.context_last_k,
+            context_summary_model=args.context_summary_model,
+            stream_interval=args.stream_interval_ms / 1000,
+            stream_min_chars=args.stream_min_chars,
+            concurrency=args.concurrency,
+            max_queue=args.max_queue,
+            session_limit=args.session_limit,
+            history_store=store_from_args(args),
+            history_format=args.history_format,
+            local_only=args.local_only
         )
     else:
         print("API Handler is not running as a Gradio interface.")
@@ -3,55 +3,498 @@ import json
 import os
 import uuid
 import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
 import openai
+from shared_historyFormat import add_format_arguments, write_history
+from shared_historyStore import add_store_arguments, store_from_args
+from shared_metrics import add_metrics_arguments, configure_metrics, get_metrics, usage_counts, usage_summary
+from shared_rateLimiter import RateLimiter, call_with_backoff, estimate_tokens, get_status_code
+from shared_responseAnalytics import summarize_responses
+from shared_responseCache import add_cache_arguments, cache_from_args, is_deterministic
 
-def run_multicaller(api_key, model, prompt, n, system_message, temperature, max_tokens, top_p, frequency_penalty, presence_penalty):
-    client = openai.OpenAI(api_key=api_key)
+# batch job states after which nothing changes anymore
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
 
+# sampling settings that can be given as a list in a sweep spec
+SWEEP_GRID_KEYS = ("temperature", "max_tokens", "top_p", "frequency_penalty", "presence_penalty", "seed")
+
+# worker threads share stdout (read line by line by the .NET host), keep lines whole
+print_lock = threading.Lock()
+
+def log(message):
+    with print_lock:
+        print(message, flush=True)
+
+def build_parameters(model, system_message, prompt, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, seed=None):
     messages = [
         {"role": "system", "content": system_message},
         {"role": "user", "content": prompt}
     ]
 
+    parameters = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "top_p": top_p,
+        "frequency_penalty": frequency_penalty,
+        "presence_penalty": presence_penalty
+    }
+
+    if max_tokens is not None:
+        parameters["max_tokens"] = max_tokens
+
+    if seed is not None:
+        parameters["seed"] = seed
+
+    return parameters
+
+def request_completion(client, parameters, limiter, max_retries, label, cache=None, sample=None):
+    # every call is isolated: an exception only ends up in its own entry. Latency and token usage go to
+    # the metrics log, the usage also into the saved results
+    metrics = get_metrics().server("multicaller", parameters["model"])
+    record = metrics.start()
+
+    def on_retry(error, retry, delay):
+        log(f"Retrying call {label} (retry {retry}/{max_retries}) in {delay:.1f}s: {str(error)}")
+
+    # the sample number is part of the key: a rerun gets back the same n answers, not n copies of one
+    cache_key = None
+    if cache is not None and is_deterministic(parameters):
+        cache_key = cache.make_key(parameters, sample=sample)
+        cached_reply = cache.get(cache_key)
+        if cached_reply is not None:
+            log(f"Completed call {label} (cached)")
+            record.status = "cached"
+            metrics.finish(record)
+            return {"assistant": cached_reply}
+
+    try:
+        completion = call_with_backoff(
+            lambda: client.chat.completions.create(**parameters),
+            limiter=limiter,
+            tokens=estimate_tokens(parameters["messages"], parameters.get("max_tokens")),
+            max_retries=max_retries,
+            on_retry=on_retry
+        )
+
+        assistant_reply = completion.choices[0].message.content
+        record.add_usage(completion.usage)
+        if cache_key is not None and assistant_reply is not None:
+            cache.put(cache_key, assistant_reply)
+
+        log(f"Completed call {label}")
+
+        return {"assistant": assistant_reply, "usage": record.usage()}
+
+    except Exception as e:
+        log(f"Error on call {label}: {str(e)}")
+        record.status = "error"
+
+        return {"error": str(e)}
+
+    finally:
+        metrics.finish(record)
+
+class ChoicesRejected(Exception):
+    # the model does not accept n > 1
+    pass
+
+def rejects_choices(error):
+    # e.g. 400 "Unsupported value: 'n' does not support 2 with this model. Supported values are: 1."
+    return get_status_code(error) == 400 and (getattr(error, "param", None) == "n" or "'n'" in str(error))
+
+def split_tokens(total, weights):
+    # integer shares of total in proportion to weights, adding up to total
+    weight_sum = sum(weights)
+    if not total or not weight_sum:
+        return [0] * len(weights)
+    shares = [total * weight // weight_sum for weight in weights]
+    shares[-1] += total - sum(shares)
+    return shares
+
+def attempt_numbers(attempts):
+    # 3 / 1-4 for a single attempt or a run of them, 1,3,4 for a chunk with gaps (attempts answered from the cache)
+    if len(attempts) == 1:
+        return f"{attempts[0]}"
+    if attempts[-1] - attempts[0] == len(attempts) - 1:
+        return f"{attempts[0]}-{attempts[-1]}"
+    return ",".join(str(attempt) for attempt in attempts)
+
+def request_choices(client, parameters, limiter, max_retries, label, attempts, cache=None):
+    # one call with n = len(attempts): the prompt is sent, billed and rate limited once for all of them.
+    # label(attempts) names the call in the log, only the attempts actually requested are in it.
+    # Returns one entry per attempt, raises ChoicesRejected if the model only takes n = 1
+    metrics = get_metrics().server("multicaller", parameters["model"])
+    record = metrics.start()
+
+    # same per-sample cache keys as single calls, only the samples that are missing are requested
+    entries = {}
+    cache_keys = {}
+    if cache is not None and is_deterministic(parameters):
+        for attempt in attempts:
+            cache_keys[attempt] = cache.make_key(parameters, sample=attempt)
+            cached_reply = cache.get(cache_keys[attempt])
+            if cached_reply is not None:
+                entries[attempt] = {"assistant": cached_reply}
+    pending = [attempt for attempt in attempts if attempt not in entries]
+    call_label = label(pending or attempts)
+
+    def on_retry(error, retry, delay):
+        log(f"Retrying call {call_label} (retry {retry}/{max_retries}) in {delay:.1f}s: {str(error)}")
+
+    try:
+        if not pending:
+            log(f"Completed call {call_label} (cached)")
+            record.status = "cached"
+            return [{"attempt": attempt, **entries[attempt]} for attempt in attempts]
+
+        max_tokens = parameters.get("max_tokens")
+        completion = call_with_backoff(
+            lambda: client.chat.completions.create(n=len(pending), **parameters),
+            limiter=limiter,
+            tokens=estimate_tokens(parameters["messages"], max_tokens * len(pending) if max_tokens else None),
+            max_retries=max_retries,
+            on_retry=on_retry
+        )
+
+        record.add_usage(completion.usage)
+        replies = [choice.message.content for choice in sorted(completion.choices, key=lambda choice: choice.index)]
+
+        # usage is reported per call: the prompt goes to the call's first choice, the completion tokens are
+        # split by reply length, so the entries still add up to what was billed
+        completion_shares = split_tokens(record.completion_tokens, [len(reply or "") + 1 for reply in replies])
+        reasoning_shares = split_tokens(record.reasoning_tokens, [len(reply or "") + 1 for reply in replies])
+        for position, attempt in enumerate(pending):
+            if position >= len(replies):
+                entries[attempt] = {"error": f"The API returned {len(replies)} of {len(pending)} requested choices."}
+                continue
+            first = position == 0
+            usage = usage_summary(record.prompt_tokens if first else 0, completion_shares[position],
+                                  record.cached_tokens if first else 0, reasoning_shares[position])
+            entries[attempt] = {"assistant": replies[position], "usage": usage, "call": pending[0], "choice": position}
+            if attempt in cache_keys and replies[position] is not None:
+                cache.put(cache_keys[attempt], replies[position])
+
+        log(f"Completed call {call_label} ({len(pending)} choices)")
+
+    except Exception as e:
+        if rejects_choices(e):
+            record.status = "unsupported_n"
+            raise ChoicesRejected(str(e))
+        log(f"Error on call {call_label}: {str(e)}")
+        record.status = "error"
+        for attempt in pending:
+            entries[attempt] = {"error": str(e)}
+
+    finally:
+        metrics.finish(record)
+
+    return [{"attempt": attempt, **entries[attempt]} for attempt in attempts]
+
+def request_attempts(client, parameters, limiter, max_retries, attempts, label, cache=None, single_choice_models=None):
+    # attempts as one n-choices call, or one call each (a single attempt, or a model that rejected n > 1;
+    # single_choice_models remembers those for the rest of the run)
+    single_choice_models = single_choice_models if single_choice_models is not None else set()
+    if len(attempts) > 1 and parameters["model"] not in single_choice_models:
+        try:
+            return request_choices(client, parameters, limiter, max_retries, label, attempts, cache=cache)
+        except ChoicesRejected as e:
+            if parameters["model"] not in single_choice_models:
+                single_choice_models.add(parameters["model"])
+                log(f"{parameters['model']} does not accept n > 1, falling back to one call per attempt: {str(e)}")
+    return [{"attempt": attempt, **request_completion(client, parameters, limiter, max_retries, label([attempt]), cache=cache, sample=attempt)}
+            for attempt in attempts]
+
+def chunk_attempts(n, choices_per_call):
+    attempts = list(range(1, n + 1))
+    size = max(1, choices_per_call or 1)
+    return [attempts[i:i + size] for i in range(0, n, size)]
+
+def run_multicaller(api_key, model, prompt, n, system_message, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, concurrency=1, requests_per_minute=None, tokens_per_minute=None, max_retries=5, base_url=None, seed=None, cache=None, store=None, history_format="json", analytics=True, choices_per_call=1):
+    # retries are handled by call_with_backoff, not by the client itself
+    client = openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    unique_id = uuid.uuid4().hex
+
+    parameters = build_parameters(model, system_message, prompt, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, seed)
+
+    # choices_per_call > 1: up to that many attempts per call through the API's n parameter
+    chunks = chunk_attempts(n, choices_per_call)
+    single_choice_models = set()
+
+    def label(attempts):
+        return f"{attempt_numbers(attempts)}/{n}"
+
+    def call_chunk(attempts):
+        return request_attempts(client, parameters, limiter, max_retries, attempts, label, cache=cache, single_choice_models=single_choice_models)
+
+    # bounded worker pool: at most `concurrency` calls are in flight at once
+    workers = max(1, min(concurrency or 1, len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        responses = [entry for entries in executor.map(call_chunk, chunks) for entry in entries]
+
+    # executor.map keeps input order, sort anyway so the file is always ordered by attempt
+    responses.sort(key=lambda entry: entry["attempt"])
+
+    if cache is not None:
+        log(cache.describe())
+
+    save_results(unique_id, api_key, model, system_message, prompt, n, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, responses, seed=seed, store=store, history_format=history_format, analytics=analytics)
+
+def run_multicaller_batch(api_key, model, prompt, n, system_message, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, base_url=None, poll_interval=5.0, max_poll_interval=60.0, max_retries=5, seed=None, store=None, history_format="json", analytics=True):
+    # offline variant of run_multicaller: the same n requests go through the Batch API
+    # (half price, outside the per-minute limits) and end up in the same multicaller_<id>.json
+    client = openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
     unique_id = uuid.uuid4().hex
 
+    parameters = build_parameters(model, system_message, prompt, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, seed)
+
+    def with_retries(fn):
+        return call_with_backoff(fn, max_retries=max_retries, on_retry=lambda e, retry, delay: log(f"Batch API request failed ({str(e)}), retry {retry}/{max_retries} in {delay:.1f}s"))
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    chat_dir = os.path.join(script_dir, "chat_histories", "Multicaller")
+    os.makedirs(chat_dir, exist_ok=True)
+    input_path = os.path.join(chat_dir, f"batch_input_{unique_id}.jsonl")
+
+    # 1) batch input file: one chat completion request per attempt
+    with open(input_path, "w", encoding="utf-8") as f:
+        for attempt in range(1, n + 1):
+            request = {
+                "custom_id": f"attempt-{attempt}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": parameters
+            }
+            f.write(json.dumps(request) + "\n")
+
+    # 2) upload and create the job
+    try:
+        with open(input_path, "rb") as f:
+            def upload():
+                f.seek(0)  # a retry has to send the whole file again
+                return client.files.create(file=f, purpose="batch")
+
+            input_file = with_retries(upload)
+        batch = with_retries(lambda: client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"llmr_multicaller_id": unique_id}
+        ))
+    finally:
+        os.remove(input_path)
+
+    log(f"Batch {batch.id} created for {n} calls")
+
+    # 3) poll with a growing interval: quick feedback for small jobs, few requests for long ones
+    interval = poll_interval
+    last_progress = None
+    while batch.status not in BATCH_FINAL_STATUSES:
+        time.sleep(interval)
+        interval = min(max_poll_interval, interval * 1.5)
+        batch = with_retries(lambda: client.batches.retrieve(batch.id))
+
+        counts = batch.request_counts
+        progress = (batch.status, getattr(counts, "completed", 0), getattr(counts, "failed", 0))
+        if progress != last_progress:
+            log(f"Batch {batch.id} is {batch.status}: {progress[1]} completed, {progress[2]} failed of {n}")
+            last_progress = progress
+
+    # 4) stream results (and per-request errors) back into attempt entries
+    results = {}
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            read_batch_results(client, file_id, results)
+
+    if batch.status != "completed":
+        reason = f"Batch {batch.id} ended with status '{batch.status}'."
+        errors = getattr(batch, "errors", None)
+        if errors is not None and getattr(errors, "data", None):
+            reason += " " + "; ".join(str(error.message) for error in errors.data)
+        log(reason)
+    else:
+        reason = "No result was returned for this request by the batch job."
+
     responses = []
+    for attempt in range(1, n + 1):
+        responses.append({"attempt": attempt, **results.get(attempt, {"error": reason})})
+
+    log(f"Batch {batch.id} finished: {sum('assistant' in entry for entry in responses)}/{n} calls succeeded")
+
+    save_results(unique_id, api_key, model, system_message, prompt, n, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, responses, batch_id=batch.id, seed=seed, store=store, history_format=history_format, analytics=analytics)
+
+def read_batch_results(client, file_id, results):
+    # output files can be large, read them line by line instead of loading them at once
+    with client.files.with_streaming_response.content(file_id) as response:
+        for line in response.iter_lines():
+            if not line.strip():
+                continue
 
-    for i in range(n):
+            record = json.loads(line)
+            attempt = int(record["custom_id"].rsplit("-", 1)[1])
+
+            body = (record.get("response") or {}).get("body") or {}
+            if record.get("error"):
+                results[attempt] = {"error": str(record["error"].get("message", record["error"]))}
+            elif "error" in body and body["error"]:
+                results[attempt] = {"error": str(body["error"].get("message", body["error"]))}
+            else:
+                results[attempt] = {"assistant": body["choices"][0]["message"]["content"], "usage": usage_summary(**usage_counts(body.get("usage")))}
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+def load_sweep_spec(path):
+    # a spec is one JSON / YAML object, a list of them, or a .jsonl file with one object per line
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    if path.lower().endswith((".yaml", ".yml")):
         try:
-            parameters = {
-                "model": model,
-                "messages": messages,
-                "temperature": temperature,
-                "top_p": top_p,
-                "frequency_penalty": frequency_penalty,
-                "presence_penalty": presence_penalty
-            }
+            import yaml
+        except ImportError:
+            raise SystemExit("Reading a YAML sweep spec needs PyYAML (pip install pyyaml); use a .json or .jsonl spec instead.")
+        spec = yaml.safe_load(text)
+    elif path.lower().endswith(".jsonl"):
+        spec = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        spec = json.loads(text)
 
-            if max_tokens is not None:
-                parameters["max_tokens"] = max_tokens
+    return spec if isinstance(spec, list) else [spec]
 
-            completion = client.chat.completions.create(**parameters)
+def expand_sweep(blocks, defaults):
+    # every block spans prompts x models x system messages x sampling grid, e.g.
+    # {"prompts": ["...", {"id": "q2", "prompt": "..."}], "models": ["gpt-4o", "gpt-4o-mini"],
+    #  "n": 5, "grid": {"temperature": [0, 0.5, 1], "top_p": [1, 0.9]}}
+    # keys that are missing fall back to the command line values
+    cells = []
+    for block in blocks:
+        prompts = as_list(block.get("prompts", block.get("prompt", defaults["prompt"])))
+        models = as_list(block.get("models", block.get("model", defaults["model"])))
+        system_messages = as_list(block.get("system_messages", block.get("system_message", defaults["system_message"])))
+        n = block.get("n", defaults["n"])
+        grid = block.get("grid", {})
+        grid_values = [as_list(grid.get(key, block.get(key, defaults[key]))) for key in SWEEP_GRID_KEYS]
 
-            assistant_reply = completion.choices[0].message.content
+        for prompt_index, prompt in enumerate(prompts, start=1):
+            if isinstance(prompt, dict):
+                prompt_id = prompt.get("id", prompt_index)
+                prompt_text = prompt["prompt"]
+            else:
+                prompt_id = prompt_index
+                prompt_text = prompt
 
-            responses.append({
-                "attempt": i + 1,
-                "assistant": assistant_reply
-            })
+            if prompt_text is None:
+                raise ValueError("Sweep spec contains a block without prompts.")
 
-            print(f"Completed call {i + 1}/{n}")
+            for model, system_message, values in product(models, system_messages, product(*grid_values)):
+                cell = {
+                    "cell": len(cells) + 1,
+                    "prompt_id": prompt_id,
+                    "prompt": prompt_text,
+                    "model": model,
+                    "system_message": system_message,
+                    "n": n
+                }
+                cell.update(zip(SWEEP_GRID_KEYS, values))
+                cells.append(cell)
 
-        except Exception as e:
-            responses.append({
-                "attempt": i + 1,
-                "error": str(e)
-            })
-            print(f"Error on call {i + 1}/{n}: {str(e)}")
+    return cells
 
-    save_results(unique_id, api_key, model, system_message, prompt, n, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, responses)
+def run_sweep(api_key, spec_path, defaults, concurrency=1, requests_per_minute=None, tokens_per_minute=None, max_retries=5, base_url=None, cache=None, analytics=True, choices_per_call=1, store=None):
+    # all cells share one client, one rate limiter and one worker pool
+    client = openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
 
-def save_results(unique_id, api_key, model, system_message, prompt, n, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, responses):
+    cells = expand_sweep(load_sweep_spec(spec_path), defaults)
+    calls = [(cell, attempts) for cell in cells for attempts in chunk_attempts(cell["n"], choices_per_call)]
+    single_choice_models = set()
+
+    sweep_id = uuid.uuid4().hex
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    chat_dir = os.path.join(script_dir, "chat_histories", "Multicaller")
+    os.makedirs(chat_dir, exist_ok=True)
+    filepath = os.path.join(chat_dir, f"sweep_{sweep_id}.jsonl")
+
+    total = sum(cell["n"] for cell in cells)
+    log(f"Sweep {sweep_id}: {len(cells)} cells, {total} answers in {len(calls)} calls, writing to {filepath}")
+
+    write_lock = threading.Lock()
+    completed = [0]
+    # answers per cell for the summaries (only what the analytics need) and the history store (all of it)
+    cell_responses = {cell["cell"]: [] for cell in cells}
+
+    with open(filepath, "w", encoding="utf-8") as f:
+        def call_cell(call):
+            cell, attempts = call
+            parameters = build_parameters(
+                cell["model"], cell["system_message"], cell["prompt"], cell["temperature"], cell["max_tokens"],
+                cell["top_p"], cell["frequency_penalty"], cell["presence_penalty"], cell["seed"]
+            )
+
+            def label(chunk):
+                return f"cell {cell['cell']} attempt {attempt_numbers(chunk)}/{cell['n']}"
+
+            entries = request_attempts(client, parameters, limiter, max_retries, attempts, label, cache=cache, single_choice_models=single_choice_models)
+            completed_on = datetime.datetime.now().strftime("%B %d, %Y at %H:%M:%S")
+
+            # one record per attempt, written as soon as its call is done
+            with write_lock:
+                for entry in entries:
+                    record = {"sweep_id": sweep_id}
+                    record.update((key, value) for key, value in cell.items() if key != "n")
+                    record.update(entry)
+                    record["completed_on"] = completed_on
+                    f.write(json.dumps(record) + "\n")
+                    if store is not None:
+                        cell_responses[cell["cell"]].append(dict(entry))
+                    elif analytics:
+                        cell_responses[cell["cell"]].append({key: entry[key] for key in ("attempt", "assistant", "error", "usage") if key in entry})
+                f.flush()
+                completed[0] += len(entries)
+                done = completed[0]
+            log(f"Sweep progress {done}/{total}")
+
+        workers = max(1, min(concurrency or 1, len(calls)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for _ in executor.map(call_cell, calls):
+                pass
+
+    if cache is not None:
+        log(cache.describe())
+
+    log(f"Results saved to {filepath}")
+
+    if store is not None:
+        # every cell is a multicaller session in the store (<sweep_id>_<cell>), like a single run
+        for cell in cells:
+            settings = result_settings(api_key, cell["model"], cell["system_message"], cell["prompt"], cell["n"], cell["temperature"], cell["max_tokens"],
+                                       cell["top_p"], cell["frequency_penalty"], cell["presence_penalty"], seed=cell["seed"])
+            settings["sweep_id"] = sweep_id
+            responses = sorted(cell_responses[cell["cell"]], key=lambda entry: entry.get("attempt", 0))
+            try:
+                store.save_multicaller(f"{sweep_id}_{cell['cell']}", settings, responses)
+            except Exception as e:
+                log(f"Error saving cell {cell['cell']} to the history store: {str(e)}")
+        log(f"{len(cells)} cells saved to the history store")
+
+    if analytics:
+        # one line per cell; JSONL like the sweep itself, so the .NET explorer does not list it as a history
+        summary_path = os.path.join(chat_dir, f"sweep_{sweep_id}_summary.jsonl")
+        with open(summary_path, "w", encoding="utf-8") as f:
+            for cell in cells:
+                record = {"sweep_id": sweep_id, **cell, "summary": summarize_responses(cell_responses[cell["cell"]])}
+                f.write(json.dumps(record) + "\n")
+        log(f"Summary saved to {summary_path}")
+
+def result_settings(api_key, model, system_message, prompt, n, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, batch_id=None, seed=None):
     settings = {
         "api_key": api_key,
         "model": model,
@@ -66,32 +509,48 @@ def save_results(unique_id, api_key, model, system_message, prompt, n, temperatu
         "downloaded_on": datetime.datetime.now().strftime("%B %d, %Y at %H:%M:%S")
     }
 
+    if seed is not None:
+        settings["seed"] = seed
+
+    if batch_id is not None:
+        settings["batch_id"] = batch_id
+
+    return settings
+
+def save_results(unique_id, api_key, model, system_message, prompt, n, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, responses, batch_id=None, seed=None, store=None, history_format="json", analytics=True):
+    settings = result_settings(api_key, model, system_message, prompt, n, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, batch_id=batch_id, seed=seed)
+
     data = {
         "settings": settings,
         "responses": responses
     }
 
+    if analytics:
+        # length distributions, duplicates, near-duplicates and agreement of the answers
+        data["summary"] = summarize_responses(responses)
+
     try:
         script_dir = os.path.dirname(os.path.abspath(__file__))
         chat_dir = os.path.join(script_dir, "chat_histories", "Multicaller")
-        os.makedirs(chat_dir, exist_ok=True)
-
         filename = f"multicaller_{unique_id}.json"
-        filepath = os.path.join(chat_dir, filename)
-
-        with open(filepath, "w") as f:
-            json.dump(data, f, indent=4)
+        filepath = write_history(os.path.join(chat_dir, filename), data, history_format)
 
         print(f"Results saved to {filepath}")
 
     except Exception as e:
         print(f"Error saving results: {str(e)}")
 
+    if store is not None:
+        try:
+            store.save_multicaller(unique_id, settings, responses)
+        except Exception as e:
+            print(f"Error saving results to the history store: {str(e)}")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="OpenAI Multicaller")
     parser.add_argument('--api_key', type=str, required=True, help='OpenAI API Key')
     parser.add_argument('--model', type=str, default='gpt-4o', help='Model name')
-    parser.add_argument('--prompt', type=str, required=True, help='User prompt')
+    parser.add_argument('--prompt', type=str, help='User prompt (required unless --sweep is given)')
     parser.add_argument('--n', type=int, default=5, help='Number of API calls')
     parser.add_argument('--system_message', type=str, default='You are a helpful assistant.', help='System message')
     parser.add_argument('--temperature', type=float, default=1, help='Temperature')
@@ -99,18 +558,103 @@ if __name__ == "__main__":
     parser.add_argument('--top_p', type=float, default=1, help='Top P')
     parser.add_argument('--frequency_penalty', type=float, default=0, help='Frequency penalty')
     parser.add_argument('--presence_penalty', type=float, default=0, help='Presence penalty')
+    parser.add_argument('--seed', type=int, help='Sampling seed for (mostly) reproducible answers (optional)')
+    parser.add_argument('--concurrency', type=int, default=1, help='Maximum number of API calls in flight at once (default 1 = sequential, as before; raise it to run calls in parallel)')
+    parser.add_argument('--choices_per_call', type=int, default=1, help='Answers per API call via the n parameter: the prompt is sent and billed once per call (models that reject n > 1 fall back to single calls)')
+    parser.add_argument('--requests_per_minute', type=int, help='Request rate limit shared by all calls (optional)')
+    parser.add_argument('--tokens_per_minute', type=int, help='Token rate limit shared by all calls (optional)')
+    parser.add_argument('--max_retries', type=int, default=5, help='Retries per call on 429 / 5xx / connection errors')
+    parser.add_argument('--sweep', type=str, help='Path to a JSON / JSONL / YAML sweep spec (prompts x models x sampling grid)')
+    parser.add_argument('--mode', type=str, choices=['live', 'batch'], default='live', help='live: synchronous calls, batch: OpenAI Batch API (offline, cheaper)')
+    parser.add_argument('--base_url', type=str, help='Alternative API base URL, e.g. a local stand-in server (optional)')
+    parser.add_argument('--poll_interval', type=float, default=5.0, help='Initial seconds between batch status checks (batch mode)')
+    parser.add_argument('--max_poll_interval', type=float, default=60.0, help='Upper bound for the growing batch poll interval (batch mode)')
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_store_arguments(parser)
+    add_format_arguments(parser)
+    parser.add_argument('--no_analytics', action='store_true', help='Do not add the summary block (lengths, duplicates, agreement) to the results')
 
     args = parser.parse_args()
 
-    run_multicaller(
-        api_key=args.api_key,
-        model=args.model,
-        prompt=args.prompt,
-        n=args.n,
-        system_message=args.system_message,
-        temperature=args.temperature,
-        max_tokens=args.max_tokens,
-        top_p=args.top_p,
-        frequency_penalty=args.frequency_penalty,
-        presence_penalty=args.presence_penalty
-    )
+    if args.sweep is None and args.prompt is None:
+        parser.error("--prompt is required unless --sweep is given")
+    if args.sweep and args.mode == 'batch':
+        parser.error("--mode batch is not available for sweeps")
+
+    cache = cache_from_args(args)
+    configure_metrics(args)
+    store = store_from_args(args)
+
+    if args.sweep:
+        defaults = {
+            "prompt": args.prompt,
+            "model": args.model,
+            "n": args.n,
+            "system_message": args.system_message,
+            "temperature": args.temperature,
+            "max_tokens": args.max_tokens,
+            "top_p": args.top_p,
+            "frequency_penalty": args.frequency_penalty,
+            "presence_penalty": args.presence_penalty,
+            "seed": args.seed
+        }
+        run_sweep(
+            api_key=args.api_key,
+            spec_path=args.sweep,
+            defaults=defaults,
+            concurrency=args.concurrency,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            max_retries=args.max_retries,
+            base_url=args.base_url,
+            cache=cache,
+            analytics=not args.no_analytics,
+            choices_per_call=args.choices_per_call,
+            store=store
+        )
+    elif args.mode == 'batch':
+        run_multicaller_batch(
+            api_key=args.api_key,
+            model=args.model,
+            prompt=args.prompt,
+            n=args.n,
+            system_message=args.system_message,
+            temperature=args.temperature,
+            max_tokens=args.max_tokens,
+            top_p=args.top_p,
+            frequency_penalty=args.frequency_penalty,
+            presence_penalty=args.presence_penalty,
+            base_url=args.base_url,
+            poll_interval=args.poll_interval,
+            max_poll_interval=args.max_poll_interval,
+            max_retries=args.max_retries,
+            seed=args.seed,
+            store=store,
+            history_format=args.history_format,
+            analytics=not args.no_analytics
+        )
+    else:
+        run_multicaller(
+            api_key=args.api_key,
+            model=args.model,
+            prompt=args.prompt,
+            n=args.n,
+            system_message=args.system_message,
+            temperature=args.temperature,
+            max_tokens=args.max_tokens,
+            top_p=args.top_p,
+            frequency_penalty=args.frequency_penalty,
+            presence_penalty=args.presence_penalty,
+            concurrency=args.concurrency,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            max_retries=args.max_retries,
+            base_url=args.base_url,
+            seed=args.seed,
+            cache=cache,
+            store=store,
+            history_format=args.history_format,
+            analytics=not args.no_analytics,
+            choices_per_call=args.choices_per_call
+        )
@@ -1,31 +1,35 @@
 import sys
 import os
-import openai
 import json
 import logging
 import uuid
+from shared_clientRegistry import get_registry
+from shared_modelCatalogue import get_catalogue
 
-# configure logging
-logging.basicConfig(level=logging.DEBUG)
+# module logger: the embedding process (Python.NET) decides what is shown, importing this module
+# must not turn on debug logging for everything else
+logger = logging.getLogger(__name__)
 
 def validate_api_key(api_key):
+    # cheap check (one model lookup), memoized for a few minutes per key
     try:
-        client = openai.OpenAI(api_key=api_key)
-        response = client.models.list()
-        logging.debug("API key validated and models retrieved.")
+        get_registry().validate(api_key)
+        logger.debug("API key validated.")
         return True
     except Exception as e:
-        logging.error(f"Error with the validation of the api key: {e}")
+        logger.error(f"Error with the validation of the api key: {e}")
         return False
 
-def get_available_models(api_key):
+def get_available_models(api_key, force_refresh=False):
+    def fetch(etag):
+        client = get_registry().get_client(api_key)
+        return [model.id for model in client.models.list()], None
+
     try:
-        client = openai.OpenAI(api_key=api_key)
-        response = client.models.list()
-        models = [model.id for model in response]
-        logging.debug(f"Available models: {models}")
+        # answered from the model catalogue (disk, per key), refreshed in the background once stale
+        models = get_catalogue().get("openai", api_key, fetch, force_refresh=force_refresh)
+        logger.debug(f"Available models: {models}")
         return models
     except Exception as e:
-        logging.error(f"Error while retrieving models: {e}")
+        logger.error(f"Error while retrieving models: {e}")
         return []
-        
\ No newline at end of file
@@ -1,19 +1,75 @@
-import gradio as gr
-import openai
-import json
-import os
 import uuid
 import sys
 import argparse
-import datetime
+import asyncio
+import atexit
+import time
+from shared_startupProfile import STARTUP, add_health_route, missing_packages, startup_phase  # first: starts the startup clock
+from shared_admissionControl import AdmissionController, add_admission_arguments, admitted
+from shared_contextWindow import ContextWindow, add_context_arguments, openai_summarizer
+from shared_historyFormat import add_format_arguments
+from shared_historyJournal import HistoryJournal
+from shared_historyStore import add_store_arguments, store_from_args
+from shared_metrics import add_metrics_arguments, add_metrics_route, configure_metrics, get_metrics
+from shared_rateLimiter import RateLimiter, call_with_backoff, call_with_backoff_async, estimate_tokens
+from shared_responseCache import add_cache_arguments, cache_from_args, is_deterministic
+from shared_streamCoalescer import StreamCoalescer, StreamStats, add_stream_arguments
 
-def run_gradio(api_key, model, system_message, temperature, max_tokens, top_p, frequency_penalty, presence_penalty):
-    client = openai.Client(api_key=api_key)
+def create_app(api_key, model, system_message, temperature, max_tokens, top_p, frequency_penalty, presence_penalty, requests_per_minute=None, tokens_per_minute=None, max_retries=5, seed=None, cache=None, context_strategy="sliding", context_budget=None, context_last_k=10, context_summary_model=None, http_client=None, stream_interval=0.05, stream_min_chars=64, concurrency=8, max_queue=64, session_limit=1, async_predict=True, async_http_client=None, base_url=None, history_store=None, history_format="json"):
+    # heavy libraries are imported on use instead of at module level, the module itself loads in milliseconds
+    with startup_phase("import openai"):
+        import openai
+    with startup_phase("import gradio"):
+        import gradio as gr
+
+    # one governor per server: all participants share the key's rate limits
+    # http_client: connection pool shared with other apps in the same process (multiModel_gradioServer.py)
+    client = openai.Client(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client)
+    # streams run on AsyncOpenAI (one event loop, no thread per open stream) unless async_predict is off;
+    # the sync client stays for summaries and --sync_predict
+    async_client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=async_http_client) if async_predict else None
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    settings = {
+        "api_key": api_key,
+        "model": model,
+        "system_message": system_message,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "top_p": top_p,
+        "frequency_penalty": frequency_penalty,
+        "presence_penalty": presence_penalty
+    }
+    # one journal line per turn, chathistory_<id>.json is compacted on session end
+    journal = HistoryJournal(settings, "<oAI_v2_gS.py internal>", store=history_store, history_format=history_format)
+    atexit.register(journal.compact_all)
+    stream_stats = StreamStats("<oAI_v2_gS.py internal>")
+    # queue wait, TTFT, latency and token usage of every call (/metrics and the metrics log)
+    metrics = get_metrics().server("openai_v2", model)
+
+    # bounded model calls with a visible queue in front of them (Gradio itself only hands requests over)
+    admission = AdmissionController(concurrency, max_queue, session_limit, log_prefix="<oAI_v2_gS.py internal>")
+
+    # bounds the prompt of every turn to the model's token budget
+    context = ContextWindow(
+        model,
+        strategy=context_strategy,
+        budget=context_budget,
+        completion_reserve=max_tokens,
+        last_k=context_last_k,
+        summarize=openai_summarizer(client, context_summary_model or model, limiter, max_retries) if context_strategy == "summary" else None,
+        log_prefix="<oAI_v2_gS.py internal>"
+    )
+
+    def end_session(unique_id):
+        journal.compact(unique_id)
+        context.forget(unique_id)
 
     def generate_unique_id():
         return uuid.uuid4().hex
 
-    def predict(message, history, unique_id_state):
+    def prepare(message, history, unique_id_state):
+        # everything before the model call, shared by the sync and the async predict
         if unique_id_state is None:
             unique_id = generate_unique_id()
             unique_id_state = unique_id  
@@ -27,98 +83,160 @@ def run_gradio(api_key, model, system_message, temperature, max_tokens, top_p, f
             messages.extend(history)
         # new user message
         messages.append({"role": "user", "content": message})
+        # cut down to the token budget (the full history is still journaled)
+        messages, _ = context.fit(messages, unique_id)
+
+        parameters = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "top_p": top_p,
+            "frequency_penalty": frequency_penalty,
+            "presence_penalty": presence_penalty,
+            "stream": True,
+            # the last chunk carries the token usage (no choices in it)
+            "stream_options": {"include_usage": True}
+        }
+
+        if max_tokens is not None:
+            parameters["max_tokens"] = max_tokens
+
+        if seed is not None:
+            parameters["seed"] = seed
+
+        # deterministic requests (temperature 0 / fixed seed) can be answered from the response cache
+        cache_key = None
+        cached_reply = None
+        if cache is not None and is_deterministic(parameters):
+            cache_key = cache.make_key(parameters)
+            cached_reply = cache.get(cache_key)
+
+        return unique_id, unique_id_state, parameters, cache_key, cached_reply
+
+    def journal_turn(message, unique_id, reply, record):
+        # usage and timings go into the saved history, cost and latency per session / model
+        started = time.perf_counter()
+        journal.append_turn(unique_id, message, reply, model=model, usage=record.usage(), **record.timings())
+        record.persistence_seconds += time.perf_counter() - started
+
+    def answer_from_cache(message, history, unique_id, cached_reply, record):
+        record.status = "cached"
+        history = history or []
+        history.append({"role": "user", "content": message})
+        history.append({"role": "assistant", "content": cached_reply})
+        journal_turn(message, unique_id, cached_reply, record)
+        return history
+
+    def start_reply(message, history):
+        # append new messages to hist
+        history = history or []
+        history.append({"role": "user", "content": message})
+        history.append({"role": "assistant", "content": ""})  # placeholder for assistant's response
+        return history
+
+    def finish_reply(message, unique_id, reply, cache_key, coalescer, record):
+        stream_stats.record(coalescer)
+        # once response is complete, journal the turn
+        journal_turn(message, unique_id, reply, record)
+        if cache_key is not None:
+            started = time.perf_counter()
+            cache.put_deferred(cache_key, reply)
+            record.persistence_seconds += time.perf_counter() - started
 
+    def on_retry(e, retry, delay):
+        print(f"<oAI_v2_gS.py internal> Request failed ({str(e)}), retry {retry}/{max_retries} in {delay:.1f}s.")
+
+    def predict_sync(message, history, unique_id_state, record):
         try:
-            partial_message = ""  # empty response container
-            parameters = {
-                "model": model,
-                "messages": messages,
-                "temperature": temperature,
-                "top_p": top_p,
-                "frequency_penalty": frequency_penalty,
-                "presence_penalty": presence_penalty,
-                "stream": True
-            }
-
-            if max_tokens is not None:
-                parameters["max_tokens"] = max_tokens
-
-            response = client.chat.completions.create(**parameters)
-
-            # append new messages to hist
-            history = history or []
-            history.append({"role": "user", "content": message})
-            history.append({"role": "assistant", "content": ""})  # placeholder for assistant's response
+            unique_id, unique_id_state, parameters, cache_key, cached_reply = prepare(message, history, unique_id_state)
+            record.session = unique_id
+            if cached_reply is not None:
+                yield answer_from_cache(message, history, unique_id, cached_reply, record), unique_id_state, ""
+                return
+
+            response = call_with_backoff(
+                lambda: client.chat.completions.create(**parameters),
+                limiter=limiter,
+                tokens=estimate_tokens(parameters["messages"], max_tokens),
+                max_retries=max_retries,
+                on_retry=on_retry
+            )
+
+            history = start_reply(message, history)
 
+            # deltas are coalesced (time window / character threshold), the same history object is
+            # updated in place and only the last message changes between two updates
+            coalescer = StreamCoalescer(stream_interval, stream_min_chars)
             for chunk in response:
-                if hasattr(chunk.choices[0].delta, 'content') and chunk.choices[0].delta.content:
-                    partial_message += chunk.choices[0].delta.content
-                    # update assistant's msh in hist
-                    history[-1]['content'] = partial_message
-                    # yield updated history & clear txtbox
-                    yield history, unique_id_state, ""
+                if chunk.usage:
+                    record.add_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    record.chunk()
+                    if coalescer.add(chunk.choices[0].delta.content):
+                        # update assistant's msh in hist
+                        history[-1]['content'] = coalescer.text
+                        # yield updated history & clear txtbox
+                        yield history, unique_id_state, ""
 
-            # once response is complete, dwnload history
-            download_history(history, unique_id)
+            partial_message = coalescer.text
+            if coalescer.flush():
+                history[-1]['content'] = partial_message
+                yield history, unique_id_state, ""
+            finish_reply(message, unique_id, partial_message, cache_key, coalescer, record)
 
         except Exception as e:
             # if error add it to history (so can be seen in form of reply in the ui!)
+            record.status = "error"
             history.append({"role": "assistant", "content": f"An error occurred: {str(e)}"})
             yield history, unique_id_state, ""
 
-    def download_history(history, unique_id):
-        # convert message history to a list of user-assistant pairs
-        history_json = []
-        current_pair = {}
-        for message in history:
-            if message['role'] == 'user':
-                current_pair = {'user': message['content']}
-            elif message['role'] == 'assistant':
-                if 'user' in current_pair:
-                    current_pair['assistant'] = message['content']
-                    history_json.append(current_pair)
-                    current_pair = {}
-        # handle any remaining message
-        if current_pair:
-            history_json.append(current_pair)
-
-        settings = {
-            "api_key": api_key,
-            "model": model,
-            "system_message": system_message,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "top_p": top_p,
-            "frequency_penalty": frequency_penalty,
-            "presence_penalty": presence_penalty,
-            "downloaded_on": datetime.datetime.now().strftime("%B %d, %Y at %H:%M:%S")  # Timestamp
-        }
-
-        full_data = {
-            "settings": settings,
-            "conversation": history_json
-        }
-
+    async def predict_async(message, history, unique_id_state, record):
+        # same contract as predict_sync, but every open stream is a coroutine on Gradio's event loop
+        # instead of a worker thread held for the whole generation
         try:
-            print("<oAI_v2_gS.py internal> History is being downloaded...")
-
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            chat_dir = os.path.join(script_dir, "chat_histories")
-            os.makedirs(chat_dir, exist_ok=True)
+            # token counting, the cache lookup and a possible summary call block: run them off the loop
+            unique_id, unique_id_state, parameters, cache_key, cached_reply = await asyncio.to_thread(prepare, message, history, unique_id_state)
+            record.session = unique_id
+            if cached_reply is not None:
+                yield answer_from_cache(message, history, unique_id, cached_reply, record), unique_id_state, ""
+                return
 
-            filename = f"chathistory_{unique_id}.json"
-            filepath = os.path.join(chat_dir, filename)
+            response = await call_with_backoff_async(
+                lambda: async_client.chat.completions.create(**parameters),
+                limiter=limiter,
+                tokens=estimate_tokens(parameters["messages"], max_tokens),
+                max_retries=max_retries,
+                on_retry=on_retry
+            )
 
-            print(f"<oAI_v2_gS.py internal> History is being saved as {filename} in the directory {filepath}.")
+            history = start_reply(message, history)
 
-            with open(filepath, "w") as f:
-                json.dump(full_data, f, indent=4)  # Save settings and history
+            coalescer = StreamCoalescer(stream_interval, stream_min_chars)
+            try:
+                async for chunk in response:
+                    if chunk.usage:
+                        record.add_usage(chunk.usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        record.chunk()
+                        if coalescer.add(chunk.choices[0].delta.content):
+                            history[-1]['content'] = coalescer.text
+                            yield history, unique_id_state, ""
+            finally:
+                # hands the connection back to the pool even if the participant left mid-stream
+                await response.close()
 
-            print("<oAI_v2_gS.py internal> History was successfully downloaded.")
+            partial_message = coalescer.text
+            if coalescer.flush():
+                history[-1]['content'] = partial_message
+                yield history, unique_id_state, ""
+            finish_reply(message, unique_id, partial_message, cache_key, coalescer, record)
 
-            return filepath
         except Exception as e:
-            return f"Error saving chat history: {str(e)}"
+            record.status = "error"
+            history.append({"role": "assistant", "content": f"An error occurred: {str(e)}"})
+            yield history, unique_id_state, ""
+
+    predict = admitted(admission, metrics, notify=gr.Warning, unchanged=gr.update())(predict_async if async_predict else predict_sync)
 
     def create_interface():
         with gr.Blocks() as iface:
@@ -126,24 +244,46 @@ def run_gradio(api_key, model, system_message, temperature, max_tokens, top_p, f
             msg = gr.Textbox(label="Send message to the LLM")
             clear = gr.Button("Clear")
             unique_id_label = gr.Label(value="")  # display unique ID gradio
-            state = gr.State(value=None)  # unitialize session state for unique ID
+            state = gr.State(value=None, delete_callback=end_session)  # unitialize session state for unique ID (compacted when the session closes)
 
             def update_unique_id(state):
                 if state is None:
                     state = generate_unique_id()
                 return f"Your unique ID: {state}", state
 
+            def clear_session(state):
+                # clearing starts a new session, so the old one is finished
+                end_session(state)
+                return [], None, ""
+
             # update unique ID when iface is loaded
             iface.load(fn=update_unique_id, inputs=state, outputs=[unique_id_label, state])
 
             # ensure to pass message, history & unique ID state to predict
-            msg.submit(predict, inputs=[msg, chatbot, state], outputs=[chatbot, state, msg])
-            clear.click(lambda: ([], None, ""), None, [chatbot, state, msg], queue=False)
+            # at most `concurrency` chats run, the others wait in Gradio's queue (no thread held per waiting request)
+            concurrency_limit, queue_size = admission.gradio_queue()
+            # api_name: the endpoint keeps its /predict name (the function behind it is predict_async)
+            msg.submit(predict, inputs=[msg, chatbot, state], outputs=[chatbot, state, msg], concurrency_limit=concurrency_limit, api_name="predict")
+            clear.click(clear_session, state, [chatbot, state, msg], queue=False)
 
+        iface.queue(max_size=queue_size)
+        iface.chat_predict = predict  # lets benchmark_loadTest.py drive the chat without a browser
         return iface
 
-    interface = create_interface()
-    interface.launch(share=True) 
+    with startup_phase("build app"):
+        return create_interface()
+
+def run_gradio(*args, local_only=False, **kwargs):
+    # standalone server: one model configuration per process. local_only skips the share tunnel,
+    # the slowest part of the startup
+    app = create_app(*args, **kwargs)
+    with startup_phase("launch (local only)" if local_only else "launch + share tunnel"):
+        app.launch(share=not local_only, prevent_thread_lock=True)
+    add_metrics_route(app.server_app)
+    add_health_route(app.server_app, {"backend": "openai_v2", "model": kwargs.get("model")})
+    STARTUP.mark_ready()
+    STARTUP.report("<oAI_v2_gS.py internal>")
+    app.block_thread()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="OpenAI v2 Gradio Server")
@@ -156,10 +296,32 @@ if __name__ == "__main__":
     parser.add_argument('--top_p', type=float, default=1.0, help='Top P')
     parser.add_argument('--frequency_penalty', type=float, default=0.0, help='Frequency penalty')
     parser.add_argument('--presence_penalty', type=float, default=0.0, help='Presence penalty')
+    parser.add_argument('--requests_per_minute', type=int, help='Request rate limit shared by all participants (optional)')
+    parser.add_argument('--tokens_per_minute', type=int, help='Token rate limit shared by all participants (optional)')
+    parser.add_argument('--max_retries', type=int, default=5, help='Retries per request on 429 / 5xx / connection errors')
+    parser.add_argument('--seed', type=int, help='Sampling seed for (mostly) reproducible answers (optional)')
+    add_cache_arguments(parser)
+    add_stream_arguments(parser)
+    add_admission_arguments(parser)
+    add_metrics_arguments(parser)
+    add_store_arguments(parser)
+    add_format_arguments(parser)
+    parser.add_argument('--base_url', type=str, help='Alternative API base URL, e.g. a local stand-in server (optional)')
+    parser.add_argument('--sync_predict', action='store_true', help='Stream with the synchronous client (one worker thread per open stream)')
+    add_context_arguments(parser)
+    parser.add_argument('--local_only', action='store_true', help='Do not create a public share link (faster startup, only reachable on this machine)')
+    parser.add_argument('--startup-profile', action='store_true', help='Print the time spent in each startup phase')
 
     args = parser.parse_args()
 
     if args.start_gradio:
+        STARTUP.enabled = args.startup_profile
+        configure_metrics(args)
+        missing = missing_packages("openai", "gradio")
+        if missing:
+            print(f"<oAI_v2_gS.py internal> Missing Python packages: {', '.join(missing)}")
+            sys.exit(1)
+
         if not all([
             args.api_key,
             args.model,
@@ -180,7 +342,26 @@ if __name__ == "__main__":
             max_tokens=args.max_tokens,
             top_p=args.top_p,
             frequency_penalty=args.frequency_penalty,
-            presence_penalty=args.presence_penalty
+            presence_penalty=args.presence_penalty,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            max_retries=args.max_retries,
+            seed=args.seed,
+            cache=cache_from_args(args),
+            context_strategy=args.context_strategy,
+            context_budget=args.context_budget,
+            context_last_k=args.context_last_k,
+            context_summary_model=args.context_summary_model,
+            stream_interval=args.stream_interval_ms / 1000,
+            stream_min_chars=args.stream_min_chars,
+            concurrency=args.concurrency,
+            max_queue=args.max_queue,
+            session_limit=args.session_limit,
+            async_predict=not args.sync_predict,
+            base_url=args.base_url,
+            history_store=store_from_args(args),
+            history_format=args.history_format,
+            local_only=args.local_only
         )
     else:
         print("<oAI_v2_gS.py internal> Gradio interface is not running. Use --start-gradio to start the interface.")
@@ -0,0 +1,223 @@
+import asyncio
+import collections
+import functools
+import inspect
+import threading
+import time
+
+
+class Ticket:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.enqueued_at = time.monotonic()
+        self.admitted = False
+        self.on_admit = None  # set by waiters that cannot block on the condition (event loop)
+
+
+class AdmissionController:
+    # bounds the model calls of one server: at most `concurrency` run at once, up to `max_queue` more
+    # wait in FIFO order, everything beyond that is turned away right away. A session can only have
+    # `session_limit` requests in flight (double submits, several tabs). Behind Gradio the waiting is done
+    # by Gradio's own queue (see gradio_queue), so a request reaching predict finds a free slot; the
+    # queue here only fills up for callers that bypass it (benchmark_loadTest.py)
+    def __init__(self, concurrency=8, max_queue=64, session_limit=1, log_prefix="<admission>", log_every=25):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.session_limit = session_limit
+        self.log_prefix = log_prefix
+        self.log_every = log_every
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = collections.deque()
+        self.in_flight = collections.Counter()
+        self.stats = {
+            "admitted": 0,
+            "rejected_busy": 0,
+            "rejected_session": 0,
+            "max_depth": 0,
+            "total_wait": 0.0,
+            "max_wait": 0.0,
+        }
+
+    def gradio_queue(self):
+        # (concurrency_limit of the chat event, max_size of the Blocks queue): waiting requests stay in Gradio's
+        # queue, which shows participants their position, instead of each holding a worker thread in wait()
+        return self.concurrency, max(1, self.max_queue)
+
+    def enter(self, session_id):
+        # returns a ticket, or a reason ("busy" / "session") why the request is turned away
+        with self.condition:
+            if session_id is not None and self.session_limit and self.in_flight[session_id] >= self.session_limit:
+                self.stats["rejected_session"] += 1
+                return None, "session"
+            if self.active >= self.concurrency and len(self.waiting) >= self.max_queue:
+                self.stats["rejected_busy"] += 1
+                return None, "busy"
+
+            ticket = Ticket(session_id)
+            if session_id is not None:
+                self.in_flight[session_id] += 1
+            self.waiting.append(ticket)
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(self.waiting))
+            self.admit_waiting()
+            return ticket, None
+
+    def admit_waiting(self):
+        # called with the condition held
+        while self.waiting and self.active < self.concurrency:
+            ticket = self.waiting.popleft()
+            ticket.admitted = True
+            self.active += 1
+            if ticket.on_admit is not None:
+                ticket.on_admit()
+            waited = time.monotonic() - ticket.enqueued_at
+            self.stats["admitted"] += 1
+            self.stats["total_wait"] += waited
+            self.stats["max_wait"] = max(self.stats["max_wait"], waited)
+            if self.log_every and self.stats["admitted"] % self.log_every == 0:
+                print(self.describe_locked())
+        self.condition.notify_all()
+
+    def wait(self, ticket, poll_interval=1.0):
+        # yields the ticket's queue position (1 = next) whenever it changes, until it is admitted
+        last_position = None
+        while True:
+            with self.condition:
+                if ticket.admitted:
+                    return
+                position = self.waiting.index(ticket) + 1
+            if position != last_position:
+                last_position = position
+                yield position
+            with self.condition:
+                if not ticket.admitted:
+                    self.condition.wait(poll_interval)
+
+    async def wait_async(self, ticket, poll_interval=1.0):
+        # wait() for async predicts: the coroutine sleeps on an asyncio.Event, not on the condition
+        loop = asyncio.get_running_loop()
+        admitted_event = asyncio.Event()
+        with self.condition:
+            if ticket.admitted:
+                return
+            ticket.on_admit = lambda: loop.call_soon_threadsafe(admitted_event.set)
+
+        last_position = None
+        while True:
+            with self.condition:
+                if ticket.admitted:
+                    return
+                position = self.waiting.index(ticket) + 1
+            if position != last_position:
+                last_position = position
+                yield position
+            try:
+                await asyncio.wait_for(admitted_event.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def leave(self, ticket):
+        with self.condition:
+            if ticket.admitted:
+                self.active -= 1
+            elif ticket in self.waiting:
+                # participant left while waiting
+                self.waiting.remove(ticket)
+            if ticket.session_id is not None:
+                self.in_flight[ticket.session_id] -= 1
+                if self.in_flight[ticket.session_id] <= 0:
+                    del self.in_flight[ticket.session_id]
+            self.admit_waiting()
+
+    def get_stats(self):
+        with self.condition:
+            return dict(self.stats, active=self.active, queued=len(self.waiting))
+
+    def describe_locked(self):
+        admitted = self.stats["admitted"]
+        average_wait = self.stats["total_wait"] / admitted if admitted else 0.0
+        return (f"{self.log_prefix} Queue: {self.active}/{self.concurrency} running, {len(self.waiting)} waiting "
+                f"(max {self.stats['max_depth']}), wait avg {average_wait:.1f}s / max {self.stats['max_wait']:.1f}s, "
+                f"turned away {self.stats['rejected_busy']} busy / {self.stats['rejected_session']} per-session")
+
+
+def admitted(admission, metrics, notify=None, unchanged=None):
+    # wraps a streaming predict(message, history, unique_id_state, record): a full queue is answered at once
+    # instead of timing out, and the slot is released however the generator ends. A turned away request leaves
+    # the chat alone (unchanged: the chatbot output, e.g. gr.update(), so a stream still running in the session is
+    # not overwritten), the reason is shown with notify (gr.Warning) and the message stays in the textbox.
+    # Every call is measured: predict gets the request's RequestRecord (shared_metrics.py) to fill in.
+    # Works for sync and async generators
+    def rejection_text(reason):
+        if reason == "session":
+            return "Your previous message is still being answered, please wait for it to finish."
+        return "Server busy: the queue is full. Please try again in a moment."
+
+    def reject(record, reason):
+        record.status = f"rejected_{reason}"
+        metrics.finish(record)
+        if notify is not None:
+            notify(rejection_text(reason))
+
+    def finish(record, completed):
+        if not completed and record.status == "ok":
+            # participant left (or the connection broke) before the reply was done
+            record.status = "cancelled"
+        metrics.finish(record)
+
+    def decorator(predict):
+        if inspect.isasyncgenfunction(predict):
+            @functools.wraps(predict)
+            async def async_wrapper(message, history, unique_id_state):
+                record = metrics.start(unique_id_state)
+                ticket, reason = admission.enter(unique_id_state)
+                if ticket is None:
+                    reject(record, reason)
+                    yield (history if unchanged is None else unchanged), unique_id_state, message
+                    return
+
+                completed = False
+                try:
+                    async for _ in admission.wait_async(ticket):
+                        pass
+                    record.admitted()
+                    async for output in predict(message, history, unique_id_state, record):
+                        yield output
+                    completed = True
+                finally:
+                    admission.leave(ticket)
+                    finish(record, completed)
+
+            wrapper = async_wrapper
+        else:
+            @functools.wraps(predict)
+            def wrapper(message, history, unique_id_state):
+                record = metrics.start(unique_id_state)
+                ticket, reason = admission.enter(unique_id_state)
+                if ticket is None:
+                    reject(record, reason)
+                    yield (history if unchanged is None else unchanged), unique_id_state, message
+                    return
+
+                completed = False
+                try:
+                    for _ in admission.wait(ticket):
+                        pass
+                    record.admitted()
+                    yield from predict(message, history, unique_id_state, record)
+                    completed = True
+                finally:
+                    admission.leave(ticket)
+                    finish(record, completed)
+
+        # Gradio reads the signature to map its inputs: it has to see the wrapper's three, not predict's four
+        del wrapper.__wrapped__
+        return wrapper
+
+    return decorator
+
+
+def add_admission_arguments(parser):
+    parser.add_argument('--concurrency', type=int, default=8, help='Model calls running at the same time')
+    parser.add_argument('--max_queue', type=int, default=64, help='Requests waiting for a free slot before new ones are turned away')
+    parser.add_argument('--session_limit', type=int, default=1, help='Requests one participant can have in flight (0 = unlimited)')
@@ -0,0 +1,73 @@
+import threading
+import time
+from shared_modelCatalogue import key_fingerprint
+
+# keys that passed validation recently are not checked again within this time
+VALIDATION_TTL_SECONDS = 600
+
+# model looked up by the cheap validation call; any answer but 401 means the key works
+VALIDATION_MODEL = "gpt-4o-mini"
+
+
+class ClientRegistry:
+    # one OpenAI client (and with it one keep-alive connection pool) per API key, kept for the life of the
+    # process: the apiHandlers are imported once by Python.NET and then called again and again.
+    # Clients are keyed by a fingerprint of the key, the registry never holds the key outside the client
+    def __init__(self, validation_ttl_seconds=VALIDATION_TTL_SECONDS):
+        self.validation_ttl_seconds = validation_ttl_seconds
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.validated = {}  # fingerprint -> time of the last successful validation
+
+    def get_client(self, api_key):
+        fingerprint = key_fingerprint(api_key)
+        with self.lock:
+            client = self.clients.get(fingerprint)
+            if client is None:
+                import openai
+                client = openai.OpenAI(api_key=api_key)
+                self.clients[fingerprint] = client
+            return client
+
+    def validate(self, api_key):
+        fingerprint = key_fingerprint(api_key)
+        with self.lock:
+            validated_at = self.validated.get(fingerprint)
+        if validated_at is not None and time.time() - validated_at < self.validation_ttl_seconds:
+            return True
+
+        import openai
+        client = self.get_client(api_key)
+        try:
+            # one small object instead of the full models list
+            client.with_options(max_retries=1, timeout=10.0).models.retrieve(VALIDATION_MODEL)
+        except (openai.NotFoundError, openai.PermissionDeniedError):
+            # authenticated, the key just cannot see that model
+            pass
+        except openai.AuthenticationError:
+            self.forget(api_key)
+            raise
+
+        with self.lock:
+            self.validated[fingerprint] = time.time()
+        return True
+
+    def forget(self, api_key):
+        fingerprint = key_fingerprint(api_key)
+        with self.lock:
+            client = self.clients.pop(fingerprint, None)
+            self.validated.pop(fingerprint, None)
+        if client is not None:
+            client.close()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry()
+        return _registry
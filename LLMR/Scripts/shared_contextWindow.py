@@ -0,0 +1,244 @@
+import functools
+import os
+import threading
+from shared_rateLimiter import call_with_backoff
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+# tiktoken downloads its BPE files once, afterwards token counting works offline from this directory
+TOKENIZER_CACHE_DIR = os.path.join(script_dir, "tokenizer_cache")
+
+CONTEXT_STRATEGIES = ("sliding", "last_k", "summary", "none")
+
+# context windows in tokens, matched by the longest prefix of the (lowercase) model name
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4.1": 1047576,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo-instruct": 4096,
+    "gpt-3.5-turbo": 16385,
+    "o1-mini": 128000,
+    "o1-preview": 128000,
+    "o1": 200000,
+    "o3": 200000,
+    "o4-mini": 200000,
+    "meta-llama/llama-2": 4096,
+    "meta-llama/meta-llama-3-": 8192,
+    "meta-llama/llama-3.": 131072,
+    "mistralai/": 32768,
+    "tiiuae/falcon": 2048,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+DEFAULT_COMPLETION_RESERVE = 1024
+
+# per-message framing the chat format adds on top of the content (role, separators), and the reply primer
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+
+SUMMARY_PROMPT = (
+    "Summarize the following conversation between a user and an assistant in a few sentences. "
+    "Keep names, facts, decisions and open questions, leave out pleasantries."
+)
+
+
+def context_window_for(model):
+    name = (model or "").lower()
+    for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if name.startswith(prefix):
+            return MODEL_CONTEXT_WINDOWS[prefix]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def load_encoding(model):
+    # tiktoken is optional: without it (or without a cached BPE file when offline) we count ~4 characters per token
+    os.environ.setdefault("TIKTOKEN_CACHE_DIR", TOKENIZER_CACHE_DIR)
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            # non-OpenAI models (e.g. Hugging Face): cl100k_base is a closer estimate than characters / 4
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"<context window> Tokenizer for {model} unavailable ({str(e)}), estimating tokens from characters.")
+        return None
+
+
+class TokenCounter:
+    # the history is resent every turn, so the counts of earlier messages are memoized by their text
+    def __init__(self, model, cache_size=8192):
+        self.encoding = load_encoding(model)
+        self.count_text = functools.lru_cache(maxsize=cache_size)(self._count_text)
+
+    def _count_text(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return len(text) // 4 + 1
+
+    def count_message(self, message):
+        return self.count_text(str(message.get("content") or "")) + MESSAGE_OVERHEAD_TOKENS
+
+    def count_messages(self, messages):
+        return sum(self.count_message(message) for message in messages) + REPLY_OVERHEAD_TOKENS
+
+
+def extractive_summary(previous_summary, messages, max_characters):
+    # fallback without a summarizer (or when it fails): the start of every dropped message, newest kept
+    lines = [previous_summary] if previous_summary else []
+    for message in messages:
+        content = " ".join(str(message.get("content") or "").split())
+        if len(content) > 200:
+            content = content[:200] + "..."
+        lines.append(f"{message.get('role', 'user').capitalize()}: {content}")
+    text = "\n".join(lines)
+    return text[-max_characters:]
+
+
+def openai_summarizer(client, model, limiter=None, max_retries=5, max_tokens=256):
+    def summarize(previous_summary, messages):
+        transcript = "\n".join(f"{message['role'].capitalize()}: {message.get('content') or ''}" for message in messages)
+        if previous_summary:
+            transcript = f"Summary of the conversation before this part: {previous_summary}\n\n{transcript}"
+        request = [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ]
+        response = call_with_backoff(
+            lambda: client.chat.completions.create(model=model, messages=request, max_tokens=max_tokens, temperature=0),
+            limiter=limiter,
+            tokens=len(transcript) // 4 + max_tokens,
+            max_retries=max_retries
+        )
+        return (response.choices[0].message.content or "").strip()
+
+    return summarize
+
+
+class ContextWindow:
+    # keeps every request inside a token budget (the model's context window minus the completion reserve
+    # unless given explicitly). Leading system messages and the new user message are always kept.
+    #   sliding: drop the oldest turns until the prompt fits
+    #   last_k:  only the last k turns (user + assistant), then sliding if that still does not fit
+    #   summary: like sliding, but the dropped turns are replaced by a rolling summary (per session,
+    #            extended only by the turns dropped since the last request)
+    #   none:    count only
+    def __init__(self, model, strategy="sliding", budget=None, completion_reserve=None, last_k=10,
+                 summarize=None, summary_tokens=256, summary_role="system", log_prefix="<context window>"):
+        if strategy not in CONTEXT_STRATEGIES:
+            raise ValueError(f"Unknown context strategy '{strategy}', use one of {', '.join(CONTEXT_STRATEGIES)}")
+        self.model = model
+        self.strategy = strategy
+        if budget is None:
+            budget = context_window_for(model) - (completion_reserve or DEFAULT_COMPLETION_RESERVE)
+        self.budget = max(256, budget)
+        self.last_k = last_k
+        self.summarize = summarize
+        self.summary_tokens = summary_tokens
+        self.summary_role = summary_role
+        self.log_prefix = log_prefix
+        self.counter = TokenCounter(model)
+        self.lock = threading.Lock()
+        self.summaries = {}  # unique_id -> (summary, number of history messages it covers)
+        self.stats = {"requests": 0, "trimmed_requests": 0, "trimmed_tokens": 0}
+
+    def fit(self, messages, unique_id=None):
+        pinned = 0
+        while pinned < len(messages) - 1 and messages[pinned].get("role") == "system":
+            pinned += 1
+        head, rest = messages[:pinned], messages[pinned:]
+        counts = [self.counter.count_message(message) for message in rest]
+        head_tokens = sum(self.counter.count_message(message) for message in head) + REPLY_OVERHEAD_TOKENS
+        original_tokens = head_tokens + sum(counts)
+
+        start = 0
+        if self.strategy == "last_k" and self.last_k is not None:
+            start = max(0, len(rest) - 1 - 2 * self.last_k)
+
+        available = self.budget - head_tokens
+        if self.strategy == "summary":
+            available -= self.summary_tokens + MESSAGE_OVERHEAD_TOKENS
+        if self.strategy != "none":
+            kept_tokens = sum(counts[start:])
+            # never drop the new user message, even if it alone is over budget
+            while kept_tokens > available and start < len(rest) - 1:
+                kept_tokens -= counts[start]
+                start += 1
+            # start on a user message, an answer without its question confuses the model
+            while start < len(rest) - 1 and rest[start].get("role") != "user":
+                start += 1
+
+        trimmed = rest[:start]
+        kept = rest[start:]
+        summary_message = []
+        if self.strategy == "summary" and trimmed:
+            summary = self.rolling_summary(unique_id, trimmed)
+            if summary:
+                summary_message = [{"role": self.summary_role, "content": f"Summary of the earlier conversation: {summary}"}]
+
+        fitted = head + summary_message + kept
+        prompt_tokens = head_tokens + sum(counts[start:]) + sum(self.counter.count_message(message) for message in summary_message)
+        report = {
+            "prompt_tokens": prompt_tokens,
+            "original_tokens": original_tokens,
+            "trimmed_tokens": max(0, original_tokens - prompt_tokens),
+            "trimmed_messages": len(trimmed),
+            "budget": self.budget,
+        }
+
+        with self.lock:
+            self.stats["requests"] += 1
+            if trimmed:
+                self.stats["trimmed_requests"] += 1
+                self.stats["trimmed_tokens"] += report["trimmed_tokens"]
+        if trimmed:
+            print(f"{self.log_prefix} Context: trimmed {report['trimmed_tokens']} tokens ({len(trimmed)} messages, {self.strategy}), prompt is {prompt_tokens}/{self.budget} tokens.")
+
+        return fitted, report
+
+    def rolling_summary(self, unique_id, trimmed):
+        with self.lock:
+            summary, covered = self.summaries.get(unique_id, ("", 0))
+        if covered > len(trimmed):
+            # the history was replaced (e.g. edited in the UI), start over
+            summary, covered = "", 0
+        new_messages = trimmed[covered:]
+        if not new_messages:
+            return summary
+
+        max_characters = self.summary_tokens * 4
+        if self.summarize is not None:
+            try:
+                summary = self.summarize(summary, new_messages)[:max_characters]
+            except Exception as e:
+                print(f"{self.log_prefix} Context: summarizing failed ({str(e)}), keeping an excerpt instead.")
+                summary = extractive_summary(summary, new_messages, max_characters)
+        else:
+            summary = extractive_summary(summary, new_messages, max_characters)
+
+        if unique_id is not None:
+            with self.lock:
+                self.summaries[unique_id] = (summary, len(trimmed))
+        return summary
+
+    def forget(self, unique_id):
+        with self.lock:
+            self.summaries.pop(unique_id, None)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+def add_context_arguments(parser, summary_model=True):
+    parser.add_argument('--context_strategy', type=str, default='sliding', choices=CONTEXT_STRATEGIES, help='How the history is cut down to the token budget')
+    parser.add_argument('--context_budget', type=int, help="Prompt token budget (default: the model's context window minus the completion tokens)")
+    parser.add_argument('--context_last_k', type=int, default=10, help='Turns kept by the last_k strategy')
+    if summary_model:
+        parser.add_argument('--context_summary_model', type=str, help='Model that writes the rolling summary for the summary strategy (default: the chat model; gpt-4o-mini for o1-line models)')
+
@@ -0,0 +1,329 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from shared_historyFormat import history_files, history_id, read_history
+
+# bulk export of the saved histories (chathistory_*.json, Multicaller/multicaller_*.json, in any format) into two
+# flat tables for analysis: sessions (one row per file, settings flattened) and turns (one row per
+# chat turn / multicaller attempt). Parquet or Arrow with pyarrow, CSV without it.
+#
+# Every run writes new part files (<out>/sessions/part-00003.parquet, <out>/turns/part-00003.parquet)
+# for the files that are new or changed since the last run (the watermark in <out>/export_state.json).
+# A changed session therefore shows up again in a later part: keep the rows with the highest export_run.
+# Files are parsed in worker processes, a bounded number of chunks is in flight at a time, so memory
+# depends on --chunk_size, not on the size of the corpus.
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+CHAT_DIR = os.path.join(script_dir, "chat_histories")
+EXPORT_DIR = os.path.join(script_dir, "exports")
+STATE_FILE = "export_state.json"
+
+# never exported
+SECRET_KEYS = ("api_key", "api_token")
+
+# settings that get their own column (the full settings block is in settings_json as well)
+SETTINGS_COLUMNS = {
+    "model": "string",
+    "model_id": "string",
+    "system_message": "string",
+    "prompt": "string",
+    "n": "int",
+    "temperature": "float",
+    "max_tokens": "int",
+    "max_completion_tokens": "int",
+    "top_p": "float",
+    "frequency_penalty": "float",
+    "presence_penalty": "float",
+    "reasoning_effort": "string",
+    "stop_sequences": "string",
+    "seed": "int",
+    "batch_id": "string",
+    "downloaded_on": "string",
+}
+
+SESSION_COLUMNS = dict({
+    "session_id": "string",
+    "kind": "string",
+    "source": "string",
+    "source_mtime": "float",
+    "export_run": "int",
+    "entries": "int",
+}, **SETTINGS_COLUMNS, settings_json="string")
+
+TURN_COLUMNS = {
+    "session_id": "string",
+    "kind": "string",
+    "export_run": "int",
+    "seq": "int",
+    "user": "string",
+    "assistant": "string",
+    "error": "string",
+    "model": "string",
+    "prompt_tokens": "int",
+    "completion_tokens": "int",
+    "cached_tokens": "int",
+    "reasoning_tokens": "int",
+    "queue_wait": "float",
+    "ttft": "float",
+    "latency": "float",
+    "extra_json": "string",
+}
+
+# turn / attempt fields that have a column
+TURN_FIELDS = ("attempt", "user", "assistant", "error", "model", "usage", "queue_wait", "ttft", "latency")
+
+
+def load_pyarrow():
+    try:
+        import pyarrow
+        return pyarrow
+    except ImportError:
+        return None
+
+
+def as_value(value, kind):
+    # loose JSON -> column type; values that do not fit become null instead of failing the export
+    if value is None:
+        return None
+    try:
+        if kind == "int":
+            return int(value)
+        if kind == "float":
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def flatten_file(path, root, export_run):
+    data = read_history(path)
+    settings = {key: value for key, value in (data.get("settings") or {}).items() if key not in SECRET_KEYS}
+    unique_id = history_id(path)
+
+    if data.get("conversation") is not None:
+        kind, entries = "chat", data["conversation"]
+    elif data.get("responses") is not None:
+        kind, entries = "multicaller", data["responses"]
+    else:
+        raise ValueError("neither a conversation nor responses")
+
+    session = {
+        "session_id": unique_id,
+        "kind": kind,
+        "source": os.path.relpath(path, root),
+        "source_mtime": os.path.getmtime(path),
+        "export_run": export_run,
+        "entries": len(entries),
+        "settings_json": json.dumps(settings, ensure_ascii=False, sort_keys=True),
+    }
+    for key, kind_of_value in SETTINGS_COLUMNS.items():
+        session[key] = as_value(settings.get(key), kind_of_value)
+
+    default_model = settings.get("model") or settings.get("model_id")
+    turns = []
+    for position, entry in enumerate(entries, 1):
+        usage = entry.get("usage") or {}
+        extra = {key: value for key, value in entry.items() if key not in TURN_FIELDS}
+        turn = {
+            "session_id": unique_id,
+            "kind": kind,
+            "export_run": export_run,
+            "seq": as_value(entry.get("attempt", position), "int"),
+            # a multicaller attempt answers the prompt of the settings
+            "user": entry.get("user") if kind == "chat" else settings.get("prompt"),
+            "assistant": entry.get("assistant"),
+            "error": as_value(entry.get("error"), "string"),
+            "model": entry.get("model") or default_model,
+            "extra_json": json.dumps(extra, ensure_ascii=False) if extra else None,
+        }
+        for key in ("prompt_tokens", "completion_tokens", "cached_tokens", "reasoning_tokens"):
+            turn[key] = as_value(usage.get(key), "int")
+        for key in ("queue_wait", "ttft", "latency"):
+            turn[key] = as_value(entry.get(key), "float")
+        turns.append(turn)
+    return session, turns
+
+
+def parse_chunk(paths, root, export_run):
+    # runs in a worker process
+    sessions, turns, failed = [], [], []
+    for path in paths:
+        try:
+            session, session_turns = flatten_file(path, root, export_run)
+        except (OSError, ValueError, RuntimeError, AttributeError, IndexError) as e:
+            failed.append((path, str(e)))
+            continue
+        sessions.append(session)
+        turns.extend(session_turns)
+    return sessions, turns, failed
+
+
+class CsvSink:
+    def __init__(self, path, columns):
+        self.path = path
+        self.file = open(path + ".tmp", "w", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=list(columns))
+        self.writer.writeheader()
+        self.rows = 0
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.rows += len(rows)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+class ArrowSink:
+    # one row group / record batch per chunk: only the current chunk is held as Arrow data
+    def __init__(self, path, columns, file_format):
+        self.pyarrow = load_pyarrow()
+        types = {"string": self.pyarrow.string(), "int": self.pyarrow.int64(), "float": self.pyarrow.float64()}
+        self.schema = self.pyarrow.schema([(name, types[kind]) for name, kind in columns.items()])
+        self.path = path
+        self.rows = 0
+        if file_format == "parquet":
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(path + ".tmp", self.schema, compression="zstd")
+        else:
+            import pyarrow.ipc
+            self.writer = pyarrow.ipc.new_file(path + ".tmp", self.schema)
+
+    def write(self, rows):
+        if rows:
+            self.writer.write_table(self.pyarrow.Table.from_pylist(rows, schema=self.schema))
+            self.rows += len(rows)
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+def open_sink(path, columns, file_format):
+    if file_format == "csv":
+        return CsvSink(path, columns)
+    return ArrowSink(path, columns, file_format)
+
+
+def load_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"runs": 0, "files": {}}
+
+
+def save_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def export_histories(source=CHAT_DIR, out_dir=EXPORT_DIR, file_format=None, workers=None, chunk_size=200, full=False, log=print):
+    file_format = file_format or ("parquet" if load_pyarrow() is not None else "csv")
+    if file_format != "csv" and load_pyarrow() is None:
+        raise SystemExit(f"Writing {file_format} needs pyarrow (pip install pyarrow); use --format csv instead.")
+    started = time.perf_counter()
+
+    state = {"runs": 0, "files": {}} if full else load_state(out_dir)
+    if full:
+        # a full export replaces the earlier parts
+        for path in glob.glob(os.path.join(out_dir, "sessions", "part-*")) + glob.glob(os.path.join(out_dir, "turns", "part-*")):
+            os.remove(path)
+
+    # the watermark: size + mtime of every file at its last export
+    pending = []
+    signatures = {}
+    for path in history_files(source):
+        key = os.path.relpath(path, source)
+        try:
+            signatures[key] = file_signature(path)
+        except OSError:
+            continue
+        if state["files"].get(key) != signatures[key]:
+            pending.append(path)
+
+    if not pending:
+        log(f"<history export> Nothing new in {source} since the last export.")
+        return {"files": 0, "sessions": 0, "turns": 0, "failed": 0, "seconds": time.perf_counter() - started}
+
+    export_run = state["runs"] + 1
+    for table in ("sessions", "turns"):
+        os.makedirs(os.path.join(out_dir, table), exist_ok=True)
+    sessions_sink = open_sink(os.path.join(out_dir, "sessions", f"part-{export_run:05d}.{file_format}"), SESSION_COLUMNS, file_format)
+    turns_sink = open_sink(os.path.join(out_dir, "turns", f"part-{export_run:05d}.{file_format}"), TURN_COLUMNS, file_format)
+
+    chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(chunks)))
+    failed = []
+    exported = set()
+    reported = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # at most two chunks per worker in flight, the rest is submitted as results come back
+        waiting = iter(chunks)
+        running = {}
+        for chunk in waiting:
+            running[executor.submit(parse_chunk, chunk, source, export_run)] = chunk
+            if len(running) >= 2 * workers:
+                break
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = running.pop(future)
+                sessions, turns, chunk_failed = future.result()
+                sessions_sink.write(sessions)
+                turns_sink.write(turns)
+                failed.extend(chunk_failed)
+                failed_paths = {path for path, _ in chunk_failed}
+                exported.update(path for path in chunk if path not in failed_paths)
+                following = next(waiting, None)
+                if following is not None:
+                    running[executor.submit(parse_chunk, following, source, export_run)] = following
+            if time.perf_counter() - reported >= 1.0 or not running:
+                reported = time.perf_counter()
+                log(f"<history export> {len(exported) + len(failed)}/{len(pending)} files")
+
+    sessions_sink.close()
+    turns_sink.close()
+
+    # files that failed to parse (e.g. being written right now) are retried on the next run
+    for path in exported:
+        key = os.path.relpath(path, source)
+        state["files"][key] = signatures[key]
+    state["runs"] = export_run
+    save_state(out_dir, state)
+
+    for path, error in failed:
+        log(f"<history export> Skipped {path}: {error}")
+    summary = {"files": len(exported), "sessions": sessions_sink.rows, "turns": turns_sink.rows, "failed": len(failed),
+               "seconds": time.perf_counter() - started}
+    log(f"<history export> Run {export_run}: {summary['sessions']} sessions, {summary['turns']} turns ({file_format}) "
+        f"in {summary['seconds']:.1f}s, written to {out_dir}.")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the chat / multicaller histories to Parquet, Arrow or CSV")
+    parser.add_argument('--source', type=str, default=CHAT_DIR, help='Directory with chathistory_*.json / Multicaller/multicaller_*.json')
+    parser.add_argument('--out', type=str, default=EXPORT_DIR, help='Output directory (sessions/, turns/ and the export state)')
+    parser.add_argument('--format', type=str, choices=['parquet', 'arrow', 'csv'], help='Output format (default: parquet if pyarrow is installed, else csv)')
+    parser.add_argument('--workers', type=int, help='Parser processes (default: one per core)')
+    parser.add_argument('--chunk_size', type=int, default=200, help='Files per parser task (and per row group)')
+    parser.add_argument('--full', action='store_true', help='Ignore the watermark and re-export everything (replaces the earlier parts)')
+
+    args = parser.parse_args()
+
+    export_histories(args.source, args.out, args.format, args.workers, args.chunk_size, args.full)
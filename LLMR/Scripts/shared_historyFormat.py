@@ -0,0 +1,233 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+
+# on-disk format of the saved histories (chathistory_<id>, multicaller_<id>):
+#   json  chathistory_<id>.json      indent=4, what the .NET explorer lists and reads
+#   gzip  chathistory_<id>.json.gz   compact JSON, gzip (any tool can open it)
+#   zstd  chathistory_<id>.json.zst  compact JSON, zstandard with the preset dictionary below (pip install zstandard)
+# read_history detects the format from the content, so every reader handles all three. Run this file to
+# migrate existing files between formats; it reports the compression ratio and read / write throughput.
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+CHAT_DIR = os.path.join(script_dir, "chat_histories")
+
+EXTENSIONS = {"json": ".json", "gzip": ".json.gz", "zstd": ".json.zst"}
+FORMATS = tuple(EXTENSIONS)
+
+# on these small files level 3 compresses within a few percent of level 10+, at several times the speed
+ZSTD_LEVEL = 3
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# raw-content dictionary for zstd: the keys and values every history repeats, so even a one-turn session
+# compresses well. Files written with it can only be decoded with it: never change it
+PRESET_DICTIONARY = json.dumps({
+    "settings": {
+        "api_key": "sk-proj-", "api_token": "hf_", "model": "gpt-4o", "model_id": "meta-llama/",
+        "system_message": "You are a helpful assistant.", "reasoning_effort": "medium", "temperature": 0.7,
+        "max_tokens": None, "max_completion_tokens": None, "top_p": 1.0, "frequency_penalty": 0.0,
+        "presence_penalty": 0.0, "stop_sequences": "User:,\\nUser:", "prompt": "", "n": 5, "seed": None,
+        "batch_id": "batch_", "downloaded_on": "January 01, 2025 at 12:00:00",
+    },
+    "conversation": [{"user": "", "assistant": "", "model": "gpt-4o",
+                      "usage": {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "reasoning_tokens": 0},
+                      "queue_wait": 0.0, "ttft": 0.0, "latency": 0.0}],
+    "responses": [{"attempt": 1, "assistant": "", "error": "", "finish_reason": "stop", "cached": True}],
+}, separators=(",", ":")).encode("utf-8")
+
+
+def load_zstandard():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        raise RuntimeError("The zstd history format needs zstandard (pip install zstandard); use --history_format gzip instead.")
+
+
+_zstd = threading.local()
+
+
+def zstd_codec():
+    # (compressor, decompressor) of this thread, zstandard's objects must not be shared between threads;
+    # the dictionary is digested once per thread instead of once per file
+    if not hasattr(_zstd, "codec"):
+        zstandard = load_zstandard()
+        dictionary = zstandard.ZstdCompressionDict(PRESET_DICTIONARY, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        dictionary.precompute_compress(level=ZSTD_LEVEL)
+        _zstd.codec = (zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary), zstandard.ZstdDecompressor(dict_data=dictionary))
+    return _zstd.codec
+
+
+class FormatStats:
+    # bytes before / after encoding and the time spent, per process (shown on /metrics and by the migration)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        for direction in ("written", "read"):
+            self.stats.update({f"files_{direction}": 0, f"raw_bytes_{direction}": 0, f"stored_bytes_{direction}": 0, f"seconds_{direction}": 0.0})
+
+    def add(self, direction, raw_bytes, stored_bytes, seconds):
+        with self.lock:
+            self.stats[f"files_{direction}"] += 1
+            self.stats[f"raw_bytes_{direction}"] += raw_bytes
+            self.stats[f"stored_bytes_{direction}"] += stored_bytes
+            self.stats[f"seconds_{direction}"] += seconds
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def describe(self):
+        stats = self.get_stats()
+        lines = []
+        for direction, verb in (("written", "write"), ("read", "read")):
+            files = stats[f"files_{direction}"]
+            if not files:
+                continue
+            raw, stored, seconds = stats[f"raw_bytes_{direction}"], stats[f"stored_bytes_{direction}"], stats[f"seconds_{direction}"]
+            ratio = raw / stored if stored else 0.0
+            throughput = raw / 2**20 / seconds if seconds else 0.0
+            lines.append(f"{files} files {direction}: {raw / 2**20:.1f} MB JSON -> {stored / 2**20:.1f} MB on disk "
+                         f"(ratio {ratio:.1f}x), {throughput:.1f} MB/s {verb}")
+        return "; ".join(lines) if lines else "no history files read or written"
+
+
+_stats = FormatStats()
+
+
+def get_format_stats():
+    return _stats
+
+
+def history_extension(history_format):
+    if history_format not in EXTENSIONS:
+        raise ValueError(f"Unknown history format {history_format!r} (expected one of {', '.join(FORMATS)})")
+    return EXTENSIONS[history_format]
+
+
+def base_path(path):
+    # chathistory_<id>.json.zst -> chathistory_<id>
+    for extension in sorted(EXTENSIONS.values(), key=len, reverse=True):
+        if path.endswith(extension):
+            return path[:-len(extension)]
+    return path
+
+
+def history_id(path):
+    # chathistory_<id>.json(.gz|.zst) / multicaller_<id>.json(...) -> <id>
+    return os.path.basename(base_path(path)).split("_", 1)[1]
+
+
+def history_files(directory, prefixes=("chathistory", "multicaller")):
+    # every saved history below directory, in any format
+    paths = []
+    for prefix in prefixes:
+        for extension in EXTENSIONS.values():
+            paths += glob.glob(os.path.join(directory, "**", f"{prefix}_*{extension}"), recursive=True)
+    return sorted(paths)
+
+
+def encode_history(data, history_format="json"):
+    history_extension(history_format)
+    if history_format == "json":
+        stored = json.dumps(data, indent=4).encode("utf-8")
+        return stored, stored
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if history_format == "gzip":
+        # mtime=0: the same history always gives the same bytes
+        return gzip.compress(raw, compresslevel=6, mtime=0), raw
+    compressor, _ = zstd_codec()
+    return compressor.compress(raw), raw
+
+
+def decode_history(stored):
+    if stored.startswith(GZIP_MAGIC):
+        raw = gzip.decompress(stored)
+    elif stored.startswith(ZSTD_MAGIC):
+        _, decompressor = zstd_codec()
+        raw = decompressor.decompress(stored)
+    else:
+        raw = stored
+    return json.loads(raw), len(raw)
+
+
+def write_history(path, data, history_format="json", replace_others=True):
+    # path is the .json path; the file is written with the extension of the format, atomically, and
+    # (replace_others) the same history in another format is removed so there is one current copy
+    started = time.perf_counter()
+    stored, raw = encode_history(data, history_format)
+    target = base_path(path) + history_extension(history_format)
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    temp_path = target + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(stored)
+    os.replace(temp_path, target)
+    for extension in EXTENSIONS.values():
+        other = base_path(path) + extension
+        if replace_others and other != target and os.path.exists(other):
+            os.remove(other)
+    _stats.add("written", len(raw), len(stored), time.perf_counter() - started)
+    return target
+
+
+def read_history(path):
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        stored = f.read()
+    data, raw_length = decode_history(stored)
+    _stats.add("read", raw_length, len(stored), time.perf_counter() - started)
+    return data
+
+
+def add_format_arguments(parser):
+    parser.add_argument('--history_format', type=str, choices=list(FORMATS), default='json',
+                        help='Format of the saved histories (the .NET explorer lists only json)')
+
+
+def migrate(directory, history_format, keep=False, dry_run=False, log=print):
+    # rewrites every history below directory in history_format (and checks that it reads back the same)
+    converted, skipped, failed = 0, 0, 0
+    before, after = 0, 0
+    for path in history_files(directory):
+        if path.endswith(history_extension(history_format)):
+            skipped += 1
+            continue
+        try:
+            data = read_history(path)
+            size = os.path.getsize(path)
+            if dry_run:
+                stored, _ = encode_history(data, history_format)
+                before, after = before + size, after + len(stored)
+                converted += 1
+                continue
+            target = write_history(path, data, history_format, replace_others=not keep)
+            if read_history(target) != data:
+                raise ValueError("the converted file does not read back the same")
+            before, after = before + size, after + os.path.getsize(target)
+            converted += 1
+        except Exception as e:
+            failed += 1
+            log(f"<history format> Could not convert {path}: {str(e)}")
+    ratio = before / after if after else 0.0
+    log(f"<history format> {converted} files {'would be ' if dry_run else ''}converted to {history_format} "
+        f"({skipped} already {history_format}, {failed} failed): {before / 2**20:.1f} MB -> {after / 2**20:.1f} MB, ratio {ratio:.1f}x.")
+    log(f"<history format> {_stats.describe()}")
+    return {"converted": converted, "skipped": skipped, "failed": failed, "bytes_before": before, "bytes_after": after}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the saved chat / multicaller histories between json, gzip and zstd")
+    parser.add_argument('--to', type=str, choices=list(FORMATS), required=True, help='Target format')
+    parser.add_argument('--source', type=str, default=CHAT_DIR, help='Directory with the histories (searched recursively)')
+    parser.add_argument('--keep', action='store_true', help='Keep the original files next to the converted ones')
+    parser.add_argument('--dry_run', action='store_true', help='Only report the sizes the target format would have')
+
+    args = parser.parse_args()
+
+    migrate(args.source, args.to, keep=args.keep, dry_run=args.dry_run)
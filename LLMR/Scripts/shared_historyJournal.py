@@ -0,0 +1,167 @@
+import argparse
+import datetime
+import glob
+import json
+import os
+import threading
+from shared_historyFormat import add_format_arguments, write_history
+from shared_persistenceWriter import get_writer
+
+# the journals live next to (not inside) chat_histories: the .NET explorer lists every *.json below
+# chat_histories, and it compacts stale journals itself before listing (ChatHistoryCollection.LoadFiles)
+script_dir = os.path.dirname(os.path.abspath(__file__))
+CHAT_DIR = os.path.join(script_dir, "chat_histories")
+JOURNAL_DIR = os.path.join(script_dir, "chat_journals")
+
+
+def journal_path(unique_id):
+    return os.path.join(JOURNAL_DIR, f"chathistory_{unique_id}.jsonl")
+
+
+def marker_path(unique_id):
+    # holds the journal length that the current chathistory_<id>.json was built from
+    return os.path.join(JOURNAL_DIR, f"chathistory_{unique_id}.compacted")
+
+
+def history_path(unique_id):
+    return os.path.join(CHAT_DIR, f"chathistory_{unique_id}.json")
+
+
+def encode_record(record):
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def read_journal(unique_id):
+    with open(journal_path(unique_id), "rb") as f:
+        data = f.read()
+
+    settings = None
+    conversation = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # a turn that is being appended right now, it is picked up by the next compaction
+            break
+        record_type = record.pop("type", None)
+        if record_type == "session":
+            settings = record["settings"]
+        elif record_type == "turn":
+            conversation.append(record)
+
+    return settings, conversation, len(data)
+
+
+def is_compacted(unique_id):
+    try:
+        with open(marker_path(unique_id), "r") as f:
+            return int(f.read().strip()) == os.path.getsize(journal_path(unique_id))
+    except (OSError, ValueError):
+        return False
+
+
+def compact_session(unique_id, history_format="json"):
+    # builds the chathistory_<id>.json that the .NET side reads (same schema as before the journal),
+    # or its compressed form (shared_historyFormat.py)
+    if not unique_id or not os.path.exists(journal_path(unique_id)):
+        return None
+
+    settings, conversation, journal_length = read_journal(unique_id)
+    if settings is None:
+        return None
+
+    settings = dict(settings)
+    settings["downloaded_on"] = datetime.datetime.now().strftime("%B %d, %Y at %H:%M:%S")
+
+    full_data = {
+        "settings": settings,
+        "conversation": conversation
+    }
+
+    filepath = write_history(history_path(unique_id), full_data, history_format)
+
+    with open(marker_path(unique_id), "w") as f:
+        f.write(str(journal_length))
+
+    return filepath
+
+
+def compact_pending(history_format="json"):
+    compacted = []
+    for path in glob.glob(os.path.join(JOURNAL_DIR, "chathistory_*.jsonl")):
+        unique_id = os.path.basename(path)[len("chathistory_"):-len(".jsonl")]
+        if not is_compacted(unique_id):
+            filepath = compact_session(unique_id, history_format)
+            if filepath:
+                compacted.append(filepath)
+    return compacted
+
+
+class HistoryJournal:
+    # append-only session log: one JSON line per turn, the settings are written once as the
+    # session header. Cost per turn stays constant no matter how long the session gets.
+    # All disk I/O goes through the shared write-behind writer, callers only enqueue.
+    # With a store (shared_historyStore.HistoryStore) every turn is also written to SQLite.
+    def __init__(self, settings, log_prefix, writer=None, store=None, history_format="json"):
+        self.settings = settings
+        self.log_prefix = log_prefix
+        self.writer = writer or get_writer()
+        self.store = store
+        self.history_format = history_format
+        self.lock = threading.Lock()
+        self.sessions = set()
+
+    def append_turn(self, unique_id, user, assistant, **extra):
+        turn = {"type": "turn", "user": user, "assistant": assistant}
+        turn.update(extra)
+
+        with self.lock:
+            self.sessions.add(unique_id)
+
+        header = encode_record({"type": "session", "unique_id": unique_id, "settings": self.settings})
+        self.writer.append(journal_path(unique_id), encode_record(turn), header=header)
+        if self.store is not None:
+            record = {key: value for key, value in turn.items() if key != "type"}
+            self.writer.call(lambda: self.store.save_turn(unique_id, self.settings, record))
+
+        return journal_path(unique_id)
+
+    def compact_now(self, unique_id):
+        try:
+            filepath = compact_session(unique_id, self.history_format)
+            if filepath:
+                print(f"{self.log_prefix} History was successfully saved as {filepath}.")
+            return filepath
+        except Exception as e:
+            print(f"{self.log_prefix} Error saving chat history: {str(e)}")
+            return None
+
+    def compact(self, unique_id):
+        # queued behind the session's pending turns, repeated requests for one session are coalesced
+        if unique_id:
+            self.writer.call(lambda: self.compact_now(unique_id), key=("compact", unique_id))
+
+    def compact_all(self):
+        # shutdown path: write out everything still queued, then compact synchronously
+        self.writer.flush(10.0)
+        with self.lock:
+            sessions = list(self.sessions)
+        for unique_id in sessions:
+            if not is_compacted(unique_id):
+                self.compact_now(unique_id)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat history journal tools")
+    parser.add_argument('--compact', action='store_true', help='Write chathistory_<id>.json for every journal that changed since its last compaction')
+    add_format_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.compact:
+        for filepath in compact_pending(args.history_format):
+            print(f"Compacted {filepath}")
+    else:
+        print("No valid arguments provided.")
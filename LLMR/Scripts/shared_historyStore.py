@@ -0,0 +1,380 @@
+import argparse
+import contextlib
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from shared_historyFormat import FORMATS, history_files, history_id, read_history, write_history
+
+# optional SQLite store next to the JSON histories: one database instead of one file per session, so
+# listing / searching tens of thousands of sessions is an index lookup instead of a directory walk.
+# The servers and the multicaller write it through the persistence writer (--history_store), the JSON
+# files are written as before. Run this file to import existing JSON files or export to today's schema.
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+STORE_PATH = os.path.join(script_dir, "chat_history.sqlite3")
+CHAT_DIR = os.path.join(script_dir, "chat_histories")
+
+# format of "downloaded_on" in the JSON files
+DOWNLOADED_ON_FORMAT = "%B %d, %Y at %H:%M:%S"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    json TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    model TEXT,
+    settings_id INTEGER REFERENCES settings(id),
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    entries INTEGER NOT NULL DEFAULT 0,
+    title TEXT
+);
+CREATE INDEX IF NOT EXISTS sessions_model ON sessions(model, updated_at);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated_at);
+CREATE INDEX IF NOT EXISTS sessions_created ON sessions(created_at);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    user TEXT,
+    assistant TEXT,
+    model TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    created_at REAL NOT NULL,
+    extra TEXT,
+    UNIQUE (session_id, seq)
+);
+CREATE INDEX IF NOT EXISTS turns_model ON turns(model, created_at);
+CREATE TABLE IF NOT EXISTS multicaller_attempts (
+    session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+    attempt INTEGER NOT NULL,
+    assistant TEXT,
+    error TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    extra TEXT,
+    PRIMARY KEY (session_id, attempt)
+) WITHOUT ROWID;
+"""
+
+# full-text index over the turns if this SQLite has FTS5 (external content: the text is not stored twice)
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(user, assistant, content='turns', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS turns_fts_insert AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts(rowid, user, assistant) VALUES (new.id, new.user, new.assistant);
+END;
+CREATE TRIGGER IF NOT EXISTS turns_fts_delete AFTER DELETE ON turns BEGIN
+    INSERT INTO turns_fts(turns_fts, rowid, user, assistant) VALUES ('delete', old.id, old.user, old.assistant);
+END;
+"""
+
+
+def settings_model(settings):
+    return settings.get("model") or settings.get("model_id")
+
+
+def parse_downloaded_on(settings, default):
+    try:
+        return datetime.datetime.strptime(settings["downloaded_on"], DOWNLOADED_ON_FORMAT).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return default
+
+
+def usage_tokens(entry):
+    usage = entry.get("usage") or {}
+    return usage.get("prompt_tokens"), usage.get("completion_tokens")
+
+
+class HistoryStore:
+    # writes go through one connection (the persistence writer's thread in the servers), reads open
+    # their own: in WAL mode readers never wait for the writer
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.write_connection = None
+        with contextlib.closing(self.connect()) as connection:
+            connection.executescript(SCHEMA)
+            try:
+                connection.executescript(FTS_SCHEMA)
+                self.full_text = True
+            except sqlite3.OperationalError:
+                # built without FTS5: search falls back to LIKE
+                self.full_text = False
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL: a commit is one sequential append, durable across application crashes
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def writer(self):
+        if self.write_connection is None:
+            self.write_connection = self.connect()
+        return self.write_connection
+
+    def close(self):
+        with self.lock:
+            if self.write_connection is not None:
+                self.write_connection.close()
+                self.write_connection = None
+
+    # ---- writing ----
+
+    def settings_id(self, connection, settings):
+        # identical settings (same server, same model configuration) are stored once
+        stored = {key: value for key, value in settings.items() if key != "downloaded_on"}
+        text = json.dumps(stored, sort_keys=True, ensure_ascii=False)
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        connection.execute("INSERT OR IGNORE INTO settings(hash, json) VALUES (?, ?)", (digest, text))
+        return connection.execute("SELECT id FROM settings WHERE hash = ?", (digest,)).fetchone()[0]
+
+    def save_turn(self, unique_id, settings, turn, created_at=None):
+        # one chat turn (as journaled: user, assistant and any extra fields)
+        created_at = created_at or time.time()
+        with self.lock:
+            connection = self.writer()
+            with connection:
+                settings_id = self.settings_id(connection, settings)
+                title = (turn.get("user") or "")[:120]
+                connection.execute(
+                    "INSERT INTO sessions(id, kind, model, settings_id, created_at, updated_at, entries, title) VALUES (?, 'chat', ?, ?, ?, ?, 0, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at",
+                    (unique_id, settings_model(settings), settings_id, created_at, created_at, title)
+                )
+                connection.execute("UPDATE sessions SET entries = entries + 1 WHERE id = ?", (unique_id,))
+                seq = connection.execute("SELECT entries FROM sessions WHERE id = ?", (unique_id,)).fetchone()[0]
+                self.insert_turn(connection, unique_id, seq, turn, settings_model(settings), created_at)
+
+    def insert_turn(self, connection, unique_id, seq, turn, default_model, created_at):
+        extra = {key: value for key, value in turn.items() if key not in ("user", "assistant")}
+        prompt_tokens, completion_tokens = usage_tokens(turn)
+        connection.execute(
+            "INSERT INTO turns(session_id, seq, user, assistant, model, prompt_tokens, completion_tokens, created_at, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (unique_id, seq, turn.get("user"), turn.get("assistant"), turn.get("model") or default_model,
+             prompt_tokens, completion_tokens, created_at, json.dumps(extra, ensure_ascii=False) if extra else None)
+        )
+
+    def write_chat(self, connection, unique_id, settings, conversation, created_at):
+        # a whole session at once (importer); replaces what is stored for it. Caller holds the lock / transaction
+        settings_id = self.settings_id(connection, settings)
+        title = (conversation[0].get("user") or "")[:120] if conversation else None
+        connection.execute("DELETE FROM sessions WHERE id = ?", (unique_id,))
+        connection.execute(
+            "INSERT INTO sessions(id, kind, model, settings_id, created_at, updated_at, entries, title) VALUES (?, 'chat', ?, ?, ?, ?, ?, ?)",
+            (unique_id, settings_model(settings), settings_id, created_at, created_at, len(conversation), title)
+        )
+        for seq, turn in enumerate(conversation, 1):
+            self.insert_turn(connection, unique_id, seq, turn, settings_model(settings), created_at)
+
+    def save_multicaller(self, unique_id, settings, responses, created_at=None):
+        with self.lock:
+            connection = self.writer()
+            with connection:
+                self.write_multicaller(connection, unique_id, settings, responses, created_at or time.time())
+
+    def write_multicaller(self, connection, unique_id, settings, responses, created_at):
+        settings_id = self.settings_id(connection, settings)
+        connection.execute("DELETE FROM sessions WHERE id = ?", (unique_id,))
+        connection.execute(
+            "INSERT INTO sessions(id, kind, model, settings_id, created_at, updated_at, entries, title) VALUES (?, 'multicaller', ?, ?, ?, ?, ?, ?)",
+            (unique_id, settings_model(settings), settings_id, created_at, created_at, len(responses), (settings.get("prompt") or "")[:120])
+        )
+        rows = []
+        for position, entry in enumerate(responses, 1):
+            extra = {key: value for key, value in entry.items() if key not in ("attempt", "assistant", "error")}
+            prompt_tokens, completion_tokens = usage_tokens(entry)
+            rows.append((unique_id, entry.get("attempt", position), entry.get("assistant"), entry.get("error"),
+                         prompt_tokens, completion_tokens, json.dumps(extra, ensure_ascii=False) if extra else None))
+        connection.executemany(
+            "INSERT INTO multicaller_attempts(session_id, attempt, assistant, error, prompt_tokens, completion_tokens, extra) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+    # ---- reading ----
+
+    def list_sessions(self, model=None, kind=None, since=None, until=None, limit=100, offset=0):
+        # newest first; every filter is served by an index
+        clauses, values = [], []
+        if model is not None:
+            clauses.append("model = ?")
+            values.append(model)
+        if kind is not None:
+            clauses.append("kind = ?")
+            values.append(kind)
+        if since is not None:
+            clauses.append("updated_at >= ?")
+            values.append(since)
+        if until is not None:
+            clauses.append("updated_at < ?")
+            values.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with contextlib.closing(self.connect()) as connection:
+            rows = connection.execute(
+                f"SELECT id, kind, model, created_at, updated_at, entries, title FROM sessions {where} ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                values + [limit, offset]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def search(self, text, limit=100):
+        # sessions with a turn, a multicaller answer or a title containing the text
+        pattern = f"%{text}%"
+        if self.full_text:
+            # the text as one phrase, FTS5 query syntax in it is not interpreted
+            phrase = '"' + text.replace('"', '""') + '"'
+            turns = "SELECT turns.session_id FROM turns_fts JOIN turns ON turns.id = turns_fts.rowid WHERE turns_fts MATCH ?"
+            values = [phrase]
+        else:
+            turns = "SELECT session_id FROM turns WHERE user LIKE ? OR assistant LIKE ?"
+            values = [pattern, pattern]
+        with contextlib.closing(self.connect()) as connection:
+            rows = connection.execute(
+                "SELECT id, kind, model, created_at, updated_at, entries, title FROM sessions WHERE id IN ("
+                f" {turns} UNION SELECT session_id FROM multicaller_attempts WHERE assistant LIKE ?"
+                ") OR title LIKE ? ORDER BY updated_at DESC LIMIT ?",
+                values + [pattern, pattern, limit]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def export_session(self, unique_id):
+        # same schema as chathistory_<id>.json / multicaller_<id>.json
+        with contextlib.closing(self.connect()) as connection:
+            session = connection.execute(
+                "SELECT sessions.*, settings.json AS settings_json FROM sessions LEFT JOIN settings ON settings.id = sessions.settings_id WHERE sessions.id = ?",
+                (unique_id,)
+            ).fetchone()
+            if session is None:
+                return None
+            settings = json.loads(session["settings_json"] or "{}")
+            settings["downloaded_on"] = datetime.datetime.fromtimestamp(session["updated_at"]).strftime(DOWNLOADED_ON_FORMAT)
+
+            if session["kind"] == "multicaller":
+                responses = []
+                for row in connection.execute("SELECT * FROM multicaller_attempts WHERE session_id = ? ORDER BY attempt", (unique_id,)):
+                    entry = {"attempt": row["attempt"]}
+                    if row["error"] is not None:
+                        entry["error"] = row["error"]
+                    else:
+                        entry["assistant"] = row["assistant"]
+                    entry.update(json.loads(row["extra"]) if row["extra"] else {})
+                    responses.append(entry)
+                return {"settings": settings, "responses": responses}
+
+            conversation = []
+            for row in connection.execute("SELECT user, assistant, extra FROM turns WHERE session_id = ? ORDER BY seq", (unique_id,)):
+                turn = {"user": row["user"], "assistant": row["assistant"]}
+                turn.update(json.loads(row["extra"]) if row["extra"] else {})
+                conversation.append(turn)
+            return {"settings": settings, "conversation": conversation}
+
+    def export_directory(self, directory, history_format="json"):
+        # the whole store as files laid out like chat_histories
+        count = 0
+        for session in self.list_sessions(limit=-1):
+            data = self.export_session(session["id"])
+            if session["kind"] == "multicaller":
+                path = os.path.join(directory, "Multicaller", f"multicaller_{session['id']}.json")
+            else:
+                path = os.path.join(directory, f"chathistory_{session['id']}.json")
+            write_history(path, data, history_format)
+            count += 1
+        return count
+
+    # ---- import ----
+
+    def import_directory(self, directory=CHAT_DIR, batch_size=500):
+        # chathistory_<id>.json and Multicaller/multicaller_<id>.json (any format); importing again replaces the sessions
+        paths = history_files(directory)
+        imported, skipped = 0, 0
+        with self.lock:
+            connection = self.writer()
+            for start in range(0, len(paths), batch_size):
+                # one transaction per batch of files
+                with connection:
+                    for path in paths[start:start + batch_size]:
+                        if self.import_file(connection, path):
+                            imported += 1
+                        else:
+                            skipped += 1
+        return imported, skipped
+
+    def import_file(self, connection, path):
+        try:
+            data = read_history(path)
+        except (OSError, ValueError, RuntimeError):
+            return False
+        settings = data.get("settings") or {}
+        unique_id = history_id(path)
+        created_at = parse_downloaded_on(settings, os.path.getmtime(path))
+
+        if data.get("conversation") is not None:
+            self.write_chat(connection, unique_id, settings, data["conversation"], created_at)
+        elif data.get("responses") is not None:
+            self.write_multicaller(connection, unique_id, settings, data["responses"], created_at)
+        else:
+            return False
+        return True
+
+
+def add_store_arguments(parser):
+    parser.add_argument('--history_store', action='store_true', help='Also write the histories to the SQLite store')
+    parser.add_argument('--history_store_path', type=str, default=STORE_PATH, help='SQLite file of the history store')
+
+
+def store_from_args(args):
+    return HistoryStore(args.history_store_path) if args.history_store else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite chat history store: import, export, list, search")
+    parser.add_argument('--path', type=str, default=STORE_PATH, help='SQLite file of the history store')
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", help="Import the JSON histories")
+    importer.add_argument('--source', type=str, default=CHAT_DIR, help='Directory with chathistory_*.json / Multicaller/multicaller_*.json')
+    exporter = commands.add_parser("export", help="Write sessions as JSON in the chat_histories schema")
+    exporter.add_argument('--session', type=str, help='Only this session, printed to stdout')
+    exporter.add_argument('--out', type=str, help='Directory for all sessions')
+    exporter.add_argument('--history_format', type=str, choices=list(FORMATS), default='json', help='Format of the files written to --out')
+    lister = commands.add_parser("list", help="List sessions, newest first")
+    lister.add_argument('--model', type=str)
+    lister.add_argument('--kind', type=str, choices=['chat', 'multicaller'])
+    lister.add_argument('--limit', type=int, default=50)
+    searcher = commands.add_parser("search", help="Sessions containing a text")
+    searcher.add_argument('text', type=str)
+    searcher.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    store = HistoryStore(args.path)
+    started = time.perf_counter()
+    if args.command == "import":
+        imported, skipped = store.import_directory(args.source)
+        print(f"<history store> Imported {imported} files ({skipped} skipped) in {time.perf_counter() - started:.1f}s.")
+    elif args.command == "export":
+        if args.session:
+            print(json.dumps(store.export_session(args.session), indent=4))
+        elif args.out:
+            count = store.export_directory(args.out, args.history_format)
+            print(f"<history store> Exported {count} sessions to {args.out}.")
+        else:
+            parser.error("export needs --session or --out")
+    else:
+        if args.command == "list":
+            sessions = store.list_sessions(model=args.model, kind=args.kind, limit=args.limit)
+        else:
+            sessions = store.search(args.text, limit=args.limit)
+        for session in sessions:
+            updated = datetime.datetime.fromtimestamp(session["updated_at"]).strftime("%Y-%m-%d %H:%M")
+            print(f"{session['id']}  {updated}  {session['kind']:<11} {session['model'] or '-':<24} {session['entries']:>4}  {session['title'] or ''}")
+        print(f"<history store> {len(sessions)} sessions in {(time.perf_counter() - started) * 1000:.1f} ms.")
+    store.close()
@@ -0,0 +1,84 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    # requests has no session-wide timeout, the adapter fills it in for every call that sets none
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(pool_size=10, connect_timeout=5.0, read_timeout=60.0, headers=None):
+    # keep-alive connection pool: one TCP + TLS handshake per pooled connection instead of one per request.
+    # pool_size should match the number of requests the server runs at once (Gradio concurrency)
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(
+        timeout=(connect_timeout, read_timeout),
+        pool_connections=4,
+        pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def create_httpx_client(pool_size=20, connect_timeout=5.0, read_timeout=600.0):
+    # the OpenAI SDK talks through httpx: one client can be handed to several openai.Client instances
+    # (http_client=...) so all of them share one keep-alive pool. read_timeout is the SDK's default,
+    # o1-line models can think for minutes before the first token
+    import httpx
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+    )
+
+
+def create_async_httpx_client(pool_size=100, connect_timeout=5.0, read_timeout=600.0):
+    # for openai.AsyncOpenAI: every open stream is a coroutine on the event loop, so the pool can be
+    # much larger than the number of worker threads
+    import httpx
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+    )
+
+
+def connection_stats(session):
+    # urllib3 counts requests and newly opened connections per host pool
+    requests_sent = 0
+    connections_opened = 0
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+    return {
+        "requests": requests_sent,
+        "connections": connections_opened,
+        "reused": max(0, requests_sent - connections_opened),
+    }
+
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+
+def get_shared_session():
+    # process-wide session for short calls (e.g. the apiHandlers called repeatedly through Python.NET)
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = create_session(pool_size=4, read_timeout=30.0)
+        return _shared_session
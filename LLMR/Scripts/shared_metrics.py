@@ -0,0 +1,297 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+METRICS_LOG_PATH = os.path.join(script_dir, "metrics", "requests.jsonl")
+
+# upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+# persistence on the request path is an enqueue, far below the latency buckets
+PERSISTENCE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 1.0)
+
+TOKEN_KINDS = ("prompt", "completion", "cached", "reasoning")
+
+
+def usage_counts(usage):
+    # OpenAI usage object (or its dict form) -> token counts; the details are missing on older models
+    if usage is None:
+        usage = {}
+    elif not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, "model_dump") else vars(usage)
+    return {
+        "prompt_tokens": usage.get("prompt_tokens") or 0,
+        "completion_tokens": usage.get("completion_tokens") or 0,
+        "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0,
+        "reasoning_tokens": (usage.get("completion_tokens_details") or {}).get("reasoning_tokens") or 0,
+    }
+
+
+def usage_summary(prompt_tokens, completion_tokens, cached_tokens=0, reasoning_tokens=0):
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+    if cached_tokens:
+        usage["cached_tokens"] = cached_tokens
+    if reasoning_tokens:
+        usage["reasoning_tokens"] = reasoning_tokens
+    return usage
+
+
+class RequestRecord:
+    # everything measured about one model call. Times are seconds since the request arrived,
+    # so TTFT and latency include the queue wait the participant saw
+    def __init__(self, backend, model, session=None):
+        self.backend = backend
+        self.model = model
+        self.session = session
+        self.started = time.monotonic()
+        self.status = "ok"
+        self.queue_wait = 0.0
+        self.ttft = None
+        self.latency = None
+        self.chunks = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.reasoning_tokens = 0
+        self.persistence_seconds = 0.0
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def admitted(self):
+        self.queue_wait = self.elapsed()
+
+    def chunk(self):
+        # one streamed delta; the first one is the time to first token
+        self.chunks += 1
+        if self.ttft is None:
+            self.ttft = self.elapsed()
+
+    def add_usage(self, usage):
+        for key, value in usage_counts(usage).items():
+            setattr(self, key, getattr(self, key) + value)
+
+    def usage(self):
+        # per turn in the journal / the saved history
+        return usage_summary(self.prompt_tokens, self.completion_tokens, self.cached_tokens, self.reasoning_tokens)
+
+    def timings(self):
+        return {
+            "queue_wait": round(self.queue_wait, 3),
+            "ttft": round(self.ttft, 3) if self.ttft is not None else None,
+            "latency": round(self.latency if self.latency is not None else self.elapsed(), 3),
+        }
+
+    def as_dict(self):
+        record = {
+            "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+            "backend": self.backend,
+            "model": self.model,
+            "session": self.session,
+            "status": self.status,
+            "chunks": self.chunks,
+            "persistence_seconds": round(self.persistence_seconds, 6),
+        }
+        record.update(self.timings())
+        record.update(self.usage())
+        return record
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def label_text(**labels):
+    return ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+
+
+class MetricsRegistry:
+    # one per process, shared by every server / route in it (multiModel_gradioServer.py serves several).
+    # Aggregates for the Prometheus endpoint, one JSON line per request for the metrics log. The log
+    # lines are written by a QueueListener thread, request threads only enqueue
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}    # (backend, model, status) -> count
+        self.tokens = {}      # (backend, model, kind) -> count
+        self.chunks = {}      # (backend, model) -> count
+        self.histograms = {}  # (name, backend, model) -> Histogram
+        self.logger = None
+        self.listener = None
+
+    def configure_log(self, path=METRICS_LOG_PATH, max_bytes=10 * 2**20, backups=5):
+        # rotating JSONL log: requests.jsonl, requests.jsonl.1 ... requests.jsonl.<backups>
+        with self.lock:
+            if self.listener is not None:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            log_queue = queue.Queue()
+            self.listener = logging.handlers.QueueListener(log_queue, handler)
+            self.listener.start()
+            self.logger = logging.getLogger("llmr.metrics")
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+            self.logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        # lines still queued at exit are written out
+        atexit.register(self.close_log)
+
+    def close_log(self):
+        with self.lock:
+            listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+
+    def server(self, backend, model):
+        return ServerMetrics(self, backend, model)
+
+    def observe(self, record):
+        labels = (record.backend, record.model)
+        with self.lock:
+            key = labels + (record.status,)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.chunks[labels] = self.chunks.get(labels, 0) + record.chunks
+            for kind in TOKEN_KINDS:
+                amount = getattr(record, f"{kind}_tokens")
+                if amount:
+                    self.tokens[labels + (kind,)] = self.tokens.get(labels + (kind,), 0) + amount
+            for name, value in (("request_latency_seconds", record.latency),
+                                ("queue_wait_seconds", record.queue_wait),
+                                ("ttft_seconds", record.ttft),
+                                ("persistence_seconds", record.persistence_seconds)):
+                if value is not None:
+                    buckets = PERSISTENCE_BUCKETS if name == "persistence_seconds" else LATENCY_BUCKETS
+                    self.histograms.setdefault((name,) + labels, Histogram(buckets)).observe(value)
+            logger = self.logger
+        if logger is not None:
+            logger.info(json.dumps(record.as_dict(), ensure_ascii=False))
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        with self.lock:
+            lines.append("# TYPE llmr_requests_total counter")
+            for (backend, model, status), count in sorted(self.requests.items()):
+                lines.append(f"llmr_requests_total{{{label_text(backend=backend, model=model, status=status)}}} {count}")
+            lines.append("# TYPE llmr_tokens_total counter")
+            for (backend, model, kind), count in sorted(self.tokens.items()):
+                lines.append(f"llmr_tokens_total{{{label_text(backend=backend, model=model, kind=kind)}}} {count}")
+            lines.append("# TYPE llmr_stream_chunks_total counter")
+            for (backend, model), count in sorted(self.chunks.items()):
+                lines.append(f"llmr_stream_chunks_total{{{label_text(backend=backend, model=model)}}} {count}")
+            for name in ("request_latency_seconds", "queue_wait_seconds", "ttft_seconds", "persistence_seconds"):
+                lines.append(f"# TYPE llmr_{name} histogram")
+                for (histogram_name, backend, model), histogram in sorted(self.histograms.items()):
+                    if histogram_name == name:
+                        lines.extend(histogram.render(f"llmr_{name}", label_text(backend=backend, model=model)))
+
+        # the write-behind writer behind the journals
+        from shared_persistenceWriter import get_writer
+        writer_stats = get_writer().get_stats()
+        for name in ("writes", "bytes_written", "fsyncs", "errors"):
+            lines.append(f"# TYPE llmr_persistence_{name}_total counter")
+            lines.append(f"llmr_persistence_{name}_total {writer_stats[name]}")
+        lines.append("# TYPE llmr_persistence_write_seconds_total counter")
+        lines.append(f"llmr_persistence_write_seconds_total {writer_stats['write_seconds']:.6f}")
+        lines.append("# TYPE llmr_persistence_queued gauge")
+        lines.append(f"llmr_persistence_queued {writer_stats['queued']}")
+
+        # saved histories: JSON bytes vs. bytes on disk (compressed formats, shared_historyFormat.py)
+        from shared_historyFormat import get_format_stats
+        format_stats = get_format_stats().get_stats()
+        for direction in ("written", "read"):
+            for name in ("files", "raw_bytes", "stored_bytes"):
+                lines.append(f"# TYPE llmr_history_{name}_{direction}_total counter")
+                lines.append(f"llmr_history_{name}_{direction}_total {format_stats[f'{name}_{direction}']}")
+            lines.append(f"# TYPE llmr_history_seconds_{direction}_total counter")
+            lines.append(f"llmr_history_seconds_{direction}_total {format_stats[f'seconds_{direction}']:.6f}")
+
+        # cold starts of on-demand models: load times, waiting requests, keep-warm pings (shared_modelWarmup.py)
+        from shared_modelWarmup import render_warmers
+        lines.extend(render_warmers())
+        return "\n".join(lines) + "\n"
+
+
+class ServerMetrics:
+    # the registry seen from one server: fixed backend / model labels
+    def __init__(self, registry, backend, model):
+        self.registry = registry
+        self.backend = backend
+        self.model = model
+
+    def start(self, session=None):
+        return RequestRecord(self.backend, self.model, session)
+
+    def finish(self, record):
+        if record.latency is None:
+            record.latency = record.elapsed()
+        self.registry.observe(record)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = MetricsRegistry()
+        return _metrics
+
+
+def add_metrics_route(app, path="/metrics"):
+    # Prometheus scrape endpoint on the server's FastAPI app
+    from fastapi.responses import PlainTextResponse
+
+    def metrics():
+        return PlainTextResponse(get_metrics().render(), media_type="text/plain; version=0.0.4")
+
+    app.add_api_route(path, metrics, methods=["GET"])
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics_log', type=str, default=METRICS_LOG_PATH, help='Rotating JSONL log with one line per model call')
+    parser.add_argument('--metrics_log_max_mb', type=float, default=10, help='Size at which the metrics log is rotated')
+    parser.add_argument('--metrics_log_backups', type=int, default=5, help='Rotated metrics logs to keep')
+    parser.add_argument('--no_metrics_log', action='store_true', help='Do not write the metrics log (the /metrics endpoint stays)')
+
+
+def configure_metrics(args):
+    metrics = get_metrics()
+    if not args.no_metrics_log:
+        metrics.configure_log(args.metrics_log, int(args.metrics_log_max_mb * 2**20), args.metrics_log_backups)
+    return metrics
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+CATALOGUE_DIR = os.path.join(script_dir, "model_catalogue")
+
+DEFAULT_TTL_SECONDS = 6 * 3600
+
+
+def key_fingerprint(secret):
+    # the key itself never touches the disk, only a hash of it (one catalogue per account)
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:32]
+
+
+class ModelCatalogue:
+    # model lists per provider and key, in memory and on disk (model_catalogue/<provider>_<hash>.json).
+    #   fresh entry:   returned as is
+    #   stale entry:   returned right away, a background thread refreshes it (stale-while-revalidate)
+    #   no entry:      fetched synchronously (only the very first time per key)
+    # fetch(etag) returns (models, etag); models is None if the server answered "not modified"
+    def __init__(self, catalogue_dir=CATALOGUE_DIR, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.catalogue_dir = catalogue_dir
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.refreshing = set()
+
+    def path_for(self, provider, fingerprint):
+        return os.path.join(self.catalogue_dir, f"{provider}_{fingerprint}.json")
+
+    def load(self, provider, fingerprint):
+        with self.lock:
+            entry = self.entries.get((provider, fingerprint))
+        if entry is not None:
+            return entry
+        try:
+            with open(self.path_for(provider, fingerprint), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            self.entries[(provider, fingerprint)] = entry
+        return entry
+
+    def store(self, provider, fingerprint, entry):
+        with self.lock:
+            self.entries[(provider, fingerprint)] = entry
+        os.makedirs(self.catalogue_dir, exist_ok=True)
+        path = self.path_for(provider, fingerprint)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+
+    def refresh(self, provider, fingerprint, fetch, entry):
+        models, etag = fetch(entry.get("etag") if entry else None)
+        if models is None and entry is not None:
+            # not modified: the cached list is current again
+            models = entry["models"]
+            etag = etag or entry.get("etag")
+        entry = {"fetched_at": time.time(), "etag": etag, "models": models}
+        self.store(provider, fingerprint, entry)
+        return entry
+
+    def refresh_in_background(self, provider, fingerprint, fetch, entry):
+        with self.lock:
+            if (provider, fingerprint) in self.refreshing:
+                return
+            self.refreshing.add((provider, fingerprint))
+
+        def run():
+            try:
+                self.refresh(provider, fingerprint, fetch, entry)
+            except Exception:
+                # keep serving the stale list, the next call tries again
+                pass
+            finally:
+                with self.lock:
+                    self.refreshing.discard((provider, fingerprint))
+
+        threading.Thread(target=run, name=f"catalogue-{provider}", daemon=True).start()
+
+    def get(self, provider, secret, fetch, force_refresh=False):
+        fingerprint = key_fingerprint(secret)
+        entry = self.load(provider, fingerprint)
+
+        if entry is None or force_refresh:
+            return self.refresh(provider, fingerprint, fetch, entry)["models"]
+
+        if time.time() - entry.get("fetched_at", 0) > self.ttl_seconds:
+            self.refresh_in_background(provider, fingerprint, fetch, entry)
+        return entry["models"]
+
+    def invalidate(self, provider, secret):
+        fingerprint = key_fingerprint(secret)
+        with self.lock:
+            self.entries.pop((provider, fingerprint), None)
+        try:
+            os.remove(self.path_for(provider, fingerprint))
+        except OSError:
+            pass
+
+
+_catalogue = None
+_catalogue_lock = threading.Lock()
+
+
+def get_catalogue():
+    global _catalogue
+    with _catalogue_lock:
+        if _catalogue is None:
+            _catalogue = ModelCatalogue()
+        return _catalogue
@@ -0,0 +1,287 @@
+import functools
+import threading
+import time
+from shared_metrics import Histogram, label_text
+
+# cold starts of models that are loaded on demand (HF serverless inference answers 503 "is currently loading"
+# until the model is up, and unloads it again after a while without requests). One ModelWarmer per server:
+#   warm-up    started with the server, pings the model until it answers, so the first participants
+#              find it loaded instead of each getting a 503
+#   keep-warm  pings the model every keep_warm_interval seconds in which no real request reached it, as
+#              long as there was participant activity in the last keep_warm_idle seconds (a class is on)
+#   gate       requests that arrive while the model loads wait for it (at most max_waiters, at most
+#              load_timeout seconds) instead of failing; they see the estimated time left
+# ping() is supplied by the server and returns (loaded, estimated_seconds_left); an exception means the model
+# cannot be reached at all (bad token, unknown model): the gate opens and requests show the real error.
+# The gate sits in front of the admission control (gated below): a request waiting for the model holds no slot.
+
+# longest pause between two pings while the model loads (HF's estimate is often far too high)
+MAX_POLL_INTERVAL = 10.0
+# how often waiting participants get an update
+PROGRESS_INTERVAL = 1.0
+
+
+class ModelNotReady(Exception):
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason  # "full" (too many waiting) or "timeout"
+
+
+class ModelLoading(Exception):
+    # raised by a request that got the "model loading" answer (after warmer.report_loading): the request goes
+    # back through the gate instead of sleeping in the backoff
+    pass
+
+
+class ModelWarmer:
+    def __init__(self, ping, backend, model, keep_warm_interval=240.0, keep_warm_idle=1800.0, load_timeout=300.0,
+                 max_waiters=64, log_prefix="<model warmup>"):
+        self.ping = ping
+        self.backend = backend
+        self.model = model
+        self.keep_warm_interval = keep_warm_interval
+        self.keep_warm_idle = keep_warm_idle
+        self.load_timeout = load_timeout
+        self.max_waiters = max(0, max_waiters)
+        self.log_prefix = log_prefix
+        self.condition = threading.Condition()
+        self.state = "unknown"  # unknown -> loading -> ready (or failed: not reachable, the gate stays open)
+        self.estimate = None
+        self.estimated_at = None
+        self.loader = None
+        self.waiters = 0
+        self.last_activity = time.monotonic()
+        self.last_request = 0.0
+        self.stopped = threading.Event()
+        self.stats = {"cold_starts": 0, "pings": 0, "keep_warm_pings": 0, "waited": 0, "rejected": 0, "timed_out": 0}
+        self.load_seconds = Histogram()
+        self.wait_seconds = Histogram()
+        register(self)
+
+    # ---- loading ----
+
+    def start(self, warm_up=True):
+        # warm-up in the background (the server starts at once), and the keep-warm loop. Requests wait from
+        # the start: a warm model answers the first ping quickly, a cold one is not hit by every early request
+        if warm_up:
+            self.set_loading()
+            self.warm_up()
+        if self.keep_warm_interval and self.keep_warm_interval > 0:
+            threading.Thread(target=self.keep_warm, name=f"keep-warm {self.model}", daemon=True).start()
+
+    def warm_up(self):
+        # pings the model until it is loaded, unless that is already going on; returns at once
+        with self.condition:
+            if self.loader is not None:
+                return
+            self.loader = threading.Thread(target=self.load, name=f"warm-up {self.model}", daemon=True)
+            self.loader.start()
+
+    def load(self):
+        started = time.monotonic()
+        cold = False
+        outcome = "ready"
+        while not self.stopped.is_set():
+            try:
+                loaded, estimate = self.ping()
+            except Exception as e:
+                print(f"{self.log_prefix} Warm-up of {self.model} failed ({str(e)}), requests are passed through.")
+                outcome = "failed"
+                break
+            with self.condition:
+                self.stats["pings"] += 1
+            if loaded:
+                break
+            if not cold:
+                cold = True
+                print(f"{self.log_prefix} {self.model} is loading (estimated {estimate or 0:.0f}s), requests wait for it.")
+            self.set_loading(estimate)
+            if time.monotonic() - started >= self.load_timeout:
+                print(f"{self.log_prefix} {self.model} did not load within {self.load_timeout:.0f}s, requests are passed through.")
+                outcome = "failed"
+                break
+            self.stopped.wait(min(MAX_POLL_INTERVAL, max(1.0, estimate or 1.0)))
+
+        seconds = time.monotonic() - started
+        with self.condition:
+            if cold:
+                self.stats["cold_starts"] += 1
+                if outcome == "ready":
+                    self.load_seconds.observe(seconds)
+            self.state = outcome
+            self.estimate = None
+            self.estimated_at = None
+            self.loader = None
+            self.condition.notify_all()
+        if cold and outcome == "ready":
+            print(f"{self.log_prefix} {self.model} loaded after {seconds:.1f}s.")
+
+    def set_loading(self, estimate=None):
+        with self.condition:
+            self.state = "loading"
+            if estimate is not None:
+                self.estimate = estimate
+                self.estimated_at = time.monotonic()
+
+    def report_loading(self, estimate=None):
+        # a request (or a keep-warm ping) got the 503: the model went cold, new requests wait for the warm-up
+        self.set_loading(estimate)
+        self.warm_up()
+
+    def keep_warm(self):
+        while not self.stopped.wait(self.keep_warm_interval):
+            now = time.monotonic()
+            with self.condition:
+                idle = now - self.last_activity > self.keep_warm_idle
+                recent = now - self.last_request < self.keep_warm_interval
+                busy = self.loader is not None
+            if idle or recent or busy:
+                continue
+            try:
+                loaded, estimate = self.ping()
+            except Exception as e:
+                print(f"{self.log_prefix} Keep-warm ping of {self.model} failed ({str(e)}).")
+                continue
+            with self.condition:
+                self.stats["pings"] += 1
+                self.stats["keep_warm_pings"] += 1
+                self.last_request = time.monotonic()
+            if not loaded:
+                self.report_loading(estimate)
+
+    def stop(self):
+        self.stopped.set()
+
+    # ---- requests ----
+
+    def touch(self):
+        # participant activity (page load, message): keeps the keep-warm loop going
+        with self.condition:
+            self.last_activity = time.monotonic()
+
+    def wait(self):
+        # generator for a streaming predict: yields the estimated seconds left (None if unknown) about once a
+        # second while the model loads, returns when it can be called; raises ModelNotReady when turned away
+        now = time.monotonic()
+        with self.condition:
+            self.last_activity = now
+            self.last_request = now
+            if self.state != "loading":
+                return
+            if self.waiters >= self.max_waiters:
+                self.stats["rejected"] += 1
+                raise ModelNotReady("Model loading: too many messages are waiting for it already. Please try again in a minute.", "full")
+            self.waiters += 1
+            self.stats["waited"] += 1
+        deadline = now + self.load_timeout
+        try:
+            while True:
+                with self.condition:
+                    if self.state != "loading":
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats["timed_out"] += 1
+                        raise ModelNotReady(f"The model did not finish loading within {self.load_timeout:.0f}s.", "timeout")
+                    self.condition.wait(min(PROGRESS_INTERVAL, remaining))
+                    if self.state != "loading":
+                        return
+                    estimate = self.estimate
+                    if estimate is not None:
+                        estimate = max(0.0, estimate - (time.monotonic() - self.estimated_at))
+                yield estimate
+        finally:
+            with self.condition:
+                self.waiters -= 1
+                self.wait_seconds.observe(time.monotonic() - now)
+                self.last_request = time.monotonic()
+
+    # ---- metrics ----
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                "labels": label_text(backend=self.backend, model=self.model),
+                "ready": int(self.state == "ready"),
+                "waiters": self.waiters,
+                "stats": dict(self.stats),
+                "llmr_model_load_seconds": self.load_seconds,
+                "llmr_model_loading_wait_seconds": self.wait_seconds,
+            }
+
+
+def gated(warmer, metrics, notify=None, inform=None, unchanged=None, max_rounds=5):
+    # wraps a streaming chat predict(message, history, unique_id_state) that is already behind admitted():
+    # while the model loads the request waits here, before it takes a slot, and the participant is told once
+    # (inform, e.g. gr.Info). A predict that raises ModelLoading before its first output gives its slot back and
+    # comes through the gate again, at most max_rounds times. Turned away requests are handled like a full
+    # queue: the chat is left alone (unchanged), the reason goes to notify and the message stays in the textbox
+    def turn_away(message, history, unique_id_state, text, status):
+        record = metrics.start(unique_id_state)
+        record.status = status
+        metrics.finish(record)
+        if notify is not None:
+            notify(text)
+        return (history if unchanged is None else unchanged), unique_id_state, message
+
+    def decorator(predict):
+        @functools.wraps(predict)
+        def wrapper(message, history, unique_id_state):
+            informed = False
+            for _ in range(max_rounds):
+                try:
+                    for seconds_left in warmer.wait():
+                        if not informed and inform is not None:
+                            informed = True
+                            remaining = f" (about {seconds_left:.0f}s left)" if seconds_left else ""
+                            inform(f"Model loading{remaining}, your message is sent as soon as it is ready.")
+                except ModelNotReady as e:
+                    yield turn_away(message, history, unique_id_state, str(e), "rejected_loading" if e.reason == "full" else "loading_timeout")
+                    return
+                try:
+                    yield from predict(message, history, unique_id_state)
+                    return
+                except ModelLoading:
+                    continue
+            yield turn_away(message, history, unique_id_state, "The model is still loading. Please try again in a minute.", "loading_timeout")
+
+        return wrapper
+
+    return decorator
+
+
+_warmers = []
+_warmers_lock = threading.Lock()
+
+
+def register(warmer):
+    with _warmers_lock:
+        _warmers.append(warmer)
+
+
+def render_warmers():
+    # /metrics lines of every warmer in the process (shared_metrics.py)
+    with _warmers_lock:
+        snapshots = [warmer.snapshot() for warmer in _warmers]
+    if not snapshots:
+        return []
+    lines = []
+    for name, key in (("llmr_model_ready", "ready"), ("llmr_model_loading_waiters", "waiters")):
+        lines.append(f"# TYPE {name} gauge")
+        lines += [f"{name}{{{snapshot['labels']}}} {snapshot[key]}" for snapshot in snapshots]
+    for stat in snapshots[0]["stats"]:
+        lines.append(f"# TYPE llmr_model_{stat}_total counter")
+        lines += [f"llmr_model_{stat}_total{{{snapshot['labels']}}} {snapshot['stats'][stat]}" for snapshot in snapshots]
+    for name in ("llmr_model_load_seconds", "llmr_model_loading_wait_seconds"):
+        lines.append(f"# TYPE {name} histogram")
+        for snapshot in snapshots:
+            lines += snapshot[name].render(name, snapshot["labels"])
+    return lines
+
+
+def add_warmup_arguments(parser):
+    parser.add_argument('--no_warmup', action='store_true', help='Do not ping the model at startup (the first participants may hit the cold start)')
+    parser.add_argument('--keep_warm_interval', type=float, default=240.0, help='Seconds without requests after which the model is pinged to keep it loaded (0 = never)')
+    parser.add_argument('--keep_warm_idle', type=float, default=1800.0, help='Stop keeping the model warm after this many seconds without participant activity')
+    parser.add_argument('--load_timeout', type=float, default=300.0, help='Longest wait for a loading model, per request and for the warm-up')
+    parser.add_argument('--max_loading_waiters', type=int, default=64, help='Requests that can wait for a loading model before new ones are turned away')
@@ -0,0 +1,177 @@
+import atexit
+import os
+import queue
+import signal
+import threading
+import time
+
+
+class PersistenceWriter:
+    # write-behind persistence: request threads only enqueue, one writer thread does the disk I/O.
+    # Everything that arrives within `batch_window` seconds is handled as one batch: appends to the same
+    # file (i.e. the same unique_id) become one write and one fsync, and of several queued calls with
+    # the same key (e.g. compacting the same session twice) only the last one runs.
+    def __init__(self, max_queue_size=10000, batch_window=0.05, max_batch_size=1000, fsync=True):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.fsync = fsync
+        self.closed = False
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "enqueued": 0,
+            "batches": 0,
+            "writes": 0,
+            "bytes_written": 0,
+            "write_seconds": 0.0,
+            "fsyncs": 0,
+            "coalesced": 0,
+            "errors": 0,
+        }
+        self.thread = threading.Thread(target=self.run, name="persistence-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        # a full queue blocks the caller: back pressure instead of unbounded memory
+        self.queue.put(item)
+        self.count("enqueued")
+
+    def append(self, path, data, header=None):
+        # header is written first if the file does not exist yet when the batch is written
+        self.put(("append", path, data, header))
+
+    def call(self, fn, key=None):
+        self.put(("call", key, fn))
+
+    def flush(self, timeout=None):
+        if self.closed or not self.thread.is_alive():
+            return True
+        done = threading.Event()
+        self.queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def close(self, timeout=10.0):
+        if self.closed:
+            return
+        self.flush(timeout)
+        self.closed = True
+        self.queue.put(("stop",))
+        self.thread.join(timeout)
+
+    def count(self, name, amount=1):
+        with self.stats_lock:
+            self.stats[name] += amount
+
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats, queued=self.queue.qsize())
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size and batch[-1][0] not in ("flush", "stop"):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            if self.process(batch):
+                return
+
+    def process(self, batch):
+        appends = {}
+        calls = {}
+        events = []
+        stop = False
+
+        for item in batch:
+            kind = item[0]
+            if kind == "append":
+                _, path, data, header = item
+                if path in appends:
+                    self.count("coalesced")
+                entry = appends.setdefault(path, [header, []])
+                entry[1].append(data)
+            elif kind == "call":
+                _, key, fn = item
+                key = key if key is not None else object()
+                if calls.pop(key, None) is not None:
+                    self.count("coalesced")
+                calls[key] = fn
+            elif kind == "flush":
+                events.append(item[1])
+            elif kind == "stop":
+                stop = True
+
+        self.count("batches")
+
+        # appends first: a queued call (e.g. a compaction) sees every turn enqueued before it
+        for path, (header, chunks) in appends.items():
+            started = time.perf_counter()
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                data = b"".join(chunks)
+                if header is not None and not os.path.exists(path):
+                    data = header + data
+                with open(path, "ab") as f:
+                    f.write(data)
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                        self.count("fsyncs")
+                self.count("writes")
+                self.count("bytes_written", len(data))
+                self.count("write_seconds", time.perf_counter() - started)
+            except Exception as e:
+                self.count("errors")
+                print(f"<persistence writer> Error writing {path}: {str(e)}", flush=True)
+
+        for fn in calls.values():
+            try:
+                fn()
+            except Exception as e:
+                self.count("errors")
+                print(f"<persistence writer> Error in queued task: {str(e)}", flush=True)
+
+        for event in events:
+            event.set()
+
+        return stop
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    # one writer per process, shared by every journal / store in it
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = PersistenceWriter()
+            atexit.register(_writer.close)
+            install_sigterm_handler()
+        return _writer
+
+
+def install_sigterm_handler():
+    # SIGTERM normally skips atexit: flush the queue, then exit (or hand over to the previous handler)
+    try:
+        previous = signal.getsignal(signal.SIGTERM)
+
+        def handle_sigterm(signum, frame):
+            if _writer is not None:
+                _writer.flush(10.0)
+            if callable(previous):
+                previous(signum, frame)
+            else:
+                raise SystemExit(128 + signum)
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except (ValueError, OSError, AttributeError):
+        # signal handlers can only be installed from the main thread
+        pass
@@ -0,0 +1,190 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+# status codes worth another try: rate limits, overloaded / loading models and flaky gateways
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# transport level failures from openai / httpx / requests (matched by name, so no import is needed)
+RETRYABLE_EXCEPTION_NAMES = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "ConnectionError",
+    "ConnectTimeout",
+    "ReadTimeout",
+    "Timeout",
+}
+
+
+class RetryableError(Exception):
+    # raised by call sites that talk plain HTTP (e.g. requests to Hugging Face) to hand a
+    # status code and an optional server-provided wait time to call_with_backoff
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    # refills continuously at rate_per_minute, holds at most `capacity` tokens (default: ten
+    # seconds worth, so a full bucket cannot fire a minute of requests in one burst).
+    # reserve() may drive the bucket negative: the caller then sleeps off its own debt,
+    # which keeps concurrent callers in arrival order without holding the lock while waiting
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate_per_minute / 6.0))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+            self.updated_at = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate_per_second
+
+
+class RateLimiter:
+    # requests per minute and tokens per minute, either may be None (= unlimited)
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens=0):
+        wait = 0.0
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.reserve(1))
+        if self.token_bucket is not None and tokens:
+            wait = max(wait, self.token_bucket.reserve(tokens))
+        return wait
+
+    def acquire(self, tokens=0):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=0):
+        # same reservation, but the debt is slept off without blocking the event loop
+        wait = self.reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+def estimate_tokens(messages, max_tokens=None):
+    # rough prompt size (~4 characters per token) plus the completion budget, which
+    # OpenAI counts against the tokens-per-minute limit up front
+    if isinstance(messages, str):
+        characters = len(messages)
+    else:
+        characters = sum(len(str(message.get("content") or "")) for message in messages)
+    return characters // 4 + 1 + (max_tokens or 0)
+
+
+def get_status_code(exc):
+    status_code = getattr(exc, "status_code", None)
+    if status_code is None:
+        response = getattr(exc, "response", None)
+        status_code = getattr(response, "status_code", None)
+    return status_code
+
+
+def parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_retry_after(exc):
+    retry_after = getattr(exc, "retry_after", None)
+    if retry_after is not None:
+        return retry_after
+
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if "retry-after-ms" in headers:
+        milliseconds = parse_retry_after(headers.get("retry-after-ms"))
+        if milliseconds is not None:
+            return milliseconds / 1000.0
+    return parse_retry_after(headers.get("retry-after"))
+
+
+def hf_loading_wait(response):
+    # HF answers 503 {"error": "... is currently loading", "estimated_time": 20.0} while a model warms up
+    try:
+        return float(response.json().get("estimated_time"))
+    except Exception:
+        return parse_retry_after(response.headers.get("retry-after"))
+
+
+def is_retryable(exc):
+    if isinstance(exc, RetryableError):
+        return True
+    status_code = get_status_code(exc)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    return type(exc).__name__ in RETRYABLE_EXCEPTION_NAMES
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def retry_delay(exc, attempt, base_delay=1.0, max_delay=60.0):
+    delay = backoff_delay(attempt, base_delay, max_delay)
+    retry_after = get_retry_after(exc)
+    if retry_after is not None:
+        # never come back before the server asked us to
+        delay = max(delay, min(retry_after, max_delay * 5))
+    return delay
+
+
+def call_with_backoff(fn, limiter=None, tokens=0, max_retries=5, base_delay=1.0, max_delay=60.0, on_retry=None):
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire(tokens)
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = retry_delay(e, attempt, base_delay, max_delay)
+            if on_retry is not None:
+                on_retry(e, attempt + 1, delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+async def call_with_backoff_async(fn, limiter=None, tokens=0, max_retries=5, base_delay=1.0, max_delay=60.0, on_retry=None):
+    # call_with_backoff for coroutines: fn() returns an awaitable
+    attempt = 0
+    while True:
+        if limiter is not None:
+            await limiter.acquire_async(tokens)
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = retry_delay(e, attempt, base_delay, max_delay)
+            if on_retry is not None:
+                on_retry(e, attempt + 1, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,134 @@
+import re
+import zlib
+from collections import Counter
+from shared_rateLimiter import estimate_tokens
+
+# statistics over the answers of one multicaller run (or one sweep cell), computed right after the
+# calls, in the same process, and saved as the "summary" block next to "responses":
+#   chars, tokens    length distribution and histogram of the answers
+#   duplicates       exact duplicates (after normalizing case and whitespace)
+#   near_duplicates  MinHash estimate of the Jaccard similarity of word shingles between every pair
+#   agreement        share of the most frequent (normalized) answer
+# Needs numpy (imported lazily); without it the summary only says that it was skipped.
+
+SHINGLE_WORDS = 3
+MINHASH_PERMUTATIONS = 128
+NEAR_DUPLICATE_THRESHOLD = 0.8
+HISTOGRAM_BINS = 10
+# up to this many answers the full similarity matrix is saved, above it only the near-duplicate pairs
+MAX_MATRIX_SIZE = 100
+MAX_PAIRS = 1000
+# signature rows compared at once: memory is rows x n x permutations bytes
+ROW_BLOCK = 256
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def load_numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+def normalize_answer(text):
+    return " ".join(text.lower().split())
+
+
+def shingle_hashes(text, size=SHINGLE_WORDS):
+    # crc32 of every run of `size` words: stable across processes, unlike hash()
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        words = words + [""] * (size - len(words))
+    return {zlib.crc32(" ".join(words[i:i + size]).encode("utf-8")) for i in range(len(words) - size + 1)}
+
+
+def minhash_signatures(np, texts, permutations=MINHASH_PERMUTATIONS, seed=1):
+    # (len(texts), permutations) matrix: min over the shingles of (a * x + b) mod p per permutation
+    rng = np.random.default_rng(seed)
+    # a, b < 2**29 and x < 2**32 keep a * x + b below 2**63: no overflow in uint64
+    a = rng.integers(1, 1 << 29, size=permutations, dtype=np.uint64)
+    b = rng.integers(0, 1 << 29, size=permutations, dtype=np.uint64)
+    signatures = np.empty((len(texts), permutations), dtype=np.uint64)
+    for row, text in enumerate(texts):
+        x = np.fromiter(shingle_hashes(text), dtype=np.uint64)
+        signatures[row] = ((np.outer(x, a) + b) % MERSENNE_PRIME).min(axis=0)
+    return signatures
+
+
+def similarity_matrix(np, signatures):
+    # estimated Jaccard similarity = share of permutations with the same minimum, computed in row blocks
+    count = len(signatures)
+    matrix = np.empty((count, count), dtype=np.float64)
+    for start in range(0, count, ROW_BLOCK):
+        block = signatures[start:start + ROW_BLOCK]
+        matrix[start:start + len(block)] = (block[:, None, :] == signatures[None, :, :]).mean(axis=2)
+    return matrix
+
+
+def distribution(np, values, bins=HISTOGRAM_BINS):
+    values = np.asarray(values, dtype=np.float64)
+    counts, edges = np.histogram(values, bins=bins)
+    return {
+        "min": float(values.min()),
+        "mean": round(float(values.mean()), 2),
+        "median": float(np.median(values)),
+        "p90": float(np.percentile(values, 90)),
+        "max": float(values.max()),
+        "std": round(float(values.std()), 2),
+        "histogram": {"edges": [round(float(edge), 2) for edge in edges], "counts": counts.tolist()},
+    }
+
+
+def summarize_responses(responses):
+    answered = [entry for entry in responses if entry.get("assistant") is not None and "error" not in entry]
+    summary = {"responses": len(responses), "answered": len(answered), "errors": len(responses) - len(answered)}
+    if not answered:
+        return summary
+
+    np = load_numpy()
+    if np is None:
+        summary["skipped"] = "numpy is not installed (pip install numpy)"
+        return summary
+
+    texts = [str(entry["assistant"]) for entry in answered]
+    # the API's token count where there is one, ~4 characters per token otherwise
+    tokens = [(entry.get("usage") or {}).get("completion_tokens") or estimate_tokens(text) for entry, text in zip(answered, texts)]
+    summary["chars"] = distribution(np, [len(text) for text in texts])
+    summary["tokens"] = distribution(np, tokens)
+
+    normalized = [normalize_answer(text) for text in texts]
+    counts = Counter(normalized)
+    modal_answer, modal_count = counts.most_common(1)[0]
+    summary["duplicates"] = {
+        "distinct_answers": len(counts),
+        "exact_duplicate_rate": round(1 - len(counts) / len(texts), 4),
+    }
+    summary["agreement"] = {
+        "modal_answer": modal_answer[:200],
+        "modal_count": modal_count,
+        "modal_share": round(modal_count / len(texts), 4),
+    }
+
+    attempts = [entry.get("attempt") for entry in answered]
+    matrix = similarity_matrix(np, minhash_signatures(np, texts))
+    np.fill_diagonal(matrix, 0.0)
+    rows, columns = np.nonzero(np.triu(matrix >= NEAR_DUPLICATE_THRESHOLD, k=1))
+    order = np.argsort(-matrix[rows, columns], kind="stable")[:MAX_PAIRS]
+    near_duplicates = {
+        "method": f"MinHash, {MINHASH_PERMUTATIONS} permutations over {SHINGLE_WORDS}-word shingles",
+        "threshold": NEAR_DUPLICATE_THRESHOLD,
+        # answers with at least one other answer above the threshold
+        "near_duplicate_rate": round(float((matrix >= NEAR_DUPLICATE_THRESHOLD).any(axis=1).mean()), 4),
+        "mean_similarity": round(float(matrix.sum() / max(1, len(texts) * (len(texts) - 1))), 4),
+        "pairs": [[attempts[rows[i]], attempts[columns[i]], round(float(matrix[rows[i], columns[i]]), 3)] for i in order],
+    }
+    if len(texts) <= MAX_MATRIX_SIZE:
+        np.fill_diagonal(matrix, 1.0)
+        near_duplicates["attempts"] = attempts
+        near_duplicates["matrix"] = np.round(matrix, 3).tolist()
+    summary["near_duplicates"] = near_duplicates
+    return summary
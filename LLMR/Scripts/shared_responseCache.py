@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from shared_persistenceWriter import get_writer
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_DIR = os.path.join(script_dir, "response_cache")
+
+# request fields that do not change the answer
+IGNORED_PARAMETERS = {"stream", "stream_options"}
+
+
+def is_deterministic(parameters):
+    # only requests that are meant to give the same answer again are cached
+    if parameters.get("seed") is not None:
+        return True
+    temperature = parameters.get("temperature")
+    return temperature is not None and float(temperature) == 0.0
+
+
+class ResponseCache:
+    # content-addressed on-disk cache: one file per sha256(model, messages, sampling params, seed).
+    # A file's mtime is its last use, eviction drops expired entries first and then the least
+    # recently used ones until the cache fits into max_bytes again.
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=256 * 1024 * 1024, ttl_seconds=7 * 24 * 3600, bypass=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.bypass = bypass
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, _, size in self.entries())
+
+    def make_key(self, parameters, **extra):
+        relevant = {key: value for key, value in parameters.items() if key not in IGNORED_PARAMETERS}
+        relevant.update(extra)
+        canonical = json.dumps(relevant, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        if self.bypass:
+            return None
+
+        path = self.path_for(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        if time.time() - entry.get("created_at", 0) > self.ttl_seconds:
+            self.remove(path)
+            with self.lock:
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+
+        with self.lock:
+            self.hits += 1
+        return entry["response"]
+
+    def put(self, key, response):
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"created_at": time.time(), "response": response}, ensure_ascii=False).encode("utf-8")
+
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        os.replace(temp_path, path)
+
+        with self.lock:
+            self.total_bytes += len(data) - old_size
+            over_limit = self.total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def put_deferred(self, key, response):
+        # for request paths that must not wait on the disk (Gradio predict)
+        get_writer().call(lambda: self.put(key, response))
+
+    def remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self.lock:
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def evict(self):
+        now = time.time()
+        entries = sorted(self.entries(), key=lambda entry: entry[1])
+        # a file that was not used for longer than the TTL was also created before it
+        for path, last_used, _ in entries:
+            if now - last_used > self.ttl_seconds:
+                self.remove(path)
+        # then least recently used first, down to 90 % so eviction does not run on every put
+        for path, last_used, _ in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            if now - last_used <= self.ttl_seconds:
+                self.remove(path)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "bytes": self.total_bytes,
+            }
+
+    def describe(self):
+        stats = self.stats()
+        return f"Response cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, {stats['bytes'] / 1024:.0f} KiB on disk"
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--response_cache', action='store_true', help='Cache answers to deterministic requests (temperature 0 or a fixed seed) on disk')
+    parser.add_argument('--cache_bypass', action='store_true', help='Do not read from the response cache (fresh answers are still stored)')
+    parser.add_argument('--cache_max_mb', type=float, default=256, help='Maximum size of the response cache in MB')
+    parser.add_argument('--cache_ttl_hours', type=float, default=168, help='Hours a cached response stays valid')
+
+
+def cache_from_args(args):
+    if not args.response_cache:
+        return None
+    return ResponseCache(
+        max_bytes=int(args.cache_max_mb * 1024 * 1024),
+        ttl_seconds=args.cache_ttl_hours * 3600,
+        bypass=args.cache_bypass
+    )
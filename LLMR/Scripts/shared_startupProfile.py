@@ -0,0 +1,74 @@
+import contextlib
+import importlib.util
+import threading
+import time
+
+# imported first by the server scripts, so this is (close to) the start of the script
+PROCESS_START = time.perf_counter()
+
+
+class StartupProfile:
+    # wall time per startup phase (imports, app construction, launch / share tunnel) up to the moment
+    # the server accepts participants
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.phases = []
+        self.last_mark = PROCESS_START
+        self.ready_at = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        with self.lock:
+            # everything since the previous phase (module imports, argument parsing) is reported too
+            if start - self.last_mark > 0.001:
+                self.phases.append(("(script)", start - self.last_mark))
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.phases.append((name, end - start))
+                self.last_mark = end
+
+    def mark_ready(self):
+        self.ready_at = time.perf_counter()
+        return self.ready_at - PROCESS_START
+
+    def report(self, log_prefix):
+        if not self.enabled:
+            return
+        with self.lock:
+            phases = list(self.phases)
+        for name, seconds in phases:
+            print(f"{log_prefix} Startup: {name}: {seconds * 1000:.0f} ms", flush=True)
+        if self.ready_at is not None:
+            print(f"{log_prefix} Startup: accepting participants {(self.ready_at - PROCESS_START) * 1000:.0f} ms after start", flush=True)
+
+
+STARTUP = StartupProfile()
+
+
+def startup_phase(name):
+    return STARTUP.phase(name)
+
+
+def missing_packages(*packages):
+    # preflight: find_spec does not import, so a missing dependency is reported before any slow import
+    return [package for package in packages if importlib.util.find_spec(package) is None]
+
+
+def add_health_route(app, info, path="/health"):
+    # readiness probe for the .NET side / a reverse proxy: answers once the server accepts participants
+    started = time.perf_counter()
+
+    def health():
+        return dict(
+            info,
+            status="ready",
+            startup_seconds=round((STARTUP.ready_at or started) - PROCESS_START, 3),
+            uptime_seconds=round(time.perf_counter() - started, 3)
+        )
+
+    app.add_api_route(path, health, methods=["GET"])
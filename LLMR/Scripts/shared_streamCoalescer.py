@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class StreamCoalescer:
+    # collects streamed deltas and says when the UI should be updated: the first delta right away
+    # (time to first token), then at most every `interval` seconds unless `min_chars` new characters
+    # are waiting. The text is joined only when an update is sent, not once per chunk
+    def __init__(self, interval=0.05, min_chars=64):
+        self.interval = interval
+        self.min_chars = min_chars
+        self.parts = []
+        self.pending_chars = 0
+        self.last_update = None
+        self.chunks = 0
+        self.updates = 0
+        self._text = ""
+        self._joined = 0
+
+    def add(self, delta):
+        self.parts.append(delta)
+        self.pending_chars += len(delta)
+        self.chunks += 1
+
+        now = time.monotonic()
+        if self.last_update is None or self.pending_chars >= self.min_chars or now - self.last_update >= self.interval:
+            self.last_update = now
+            self.pending_chars = 0
+            self.updates += 1
+            return True
+        return False
+
+    def flush(self):
+        # after the stream: is there text the UI has not seen yet?
+        if self.pending_chars:
+            self.pending_chars = 0
+            self.updates += 1
+            return True
+        return False
+
+    @property
+    def text(self):
+        if self._joined != len(self.parts):
+            self._text = "".join(self.parts)
+            self.parts = [self._text]
+            self._joined = 1
+        return self._text
+
+
+class StreamStats:
+    # per-server totals: updates sent to the browsers versus chunks received from the model
+    def __init__(self, log_prefix, log_every=25):
+        self.log_prefix = log_prefix
+        self.log_every = log_every
+        self.lock = threading.Lock()
+        self.responses = 0
+        self.chunks = 0
+        self.updates = 0
+
+    def record(self, coalescer):
+        with self.lock:
+            self.responses += 1
+            self.chunks += coalescer.chunks
+            self.updates += coalescer.updates
+            responses, chunks, updates = self.responses, self.chunks, self.updates
+        if self.log_every and responses % self.log_every == 0:
+            print(f"{self.log_prefix} Streaming: {updates} UI updates for {chunks} chunks over {responses} responses.")
+
+    def get_stats(self):
+        with self.lock:
+            return {"responses": self.responses, "chunks": self.chunks, "updates": self.updates}
+
+
+def add_stream_arguments(parser):
+    parser.add_argument('--stream_interval_ms', type=float, default=50, help='Minimum time between two UI updates while streaming')
+    parser.add_argument('--stream_min_chars', type=int, default=64, help='Characters that trigger a UI update before the interval is over')